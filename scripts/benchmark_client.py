@@ -0,0 +1,236 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_DIR = os.path.join(REPO_ROOT, "src")
+CLIENT_DIR = os.path.join(REPO_ROOT, "video_client")
+DEFAULT_STREAMS_DIR = os.path.join(REPO_ROOT, "benchmark_streams")
+DEFAULT_BASELINE = os.path.join(REPO_ROOT, "benchmark_baseline.json")
+# Same as create_slurm_inputs.py
+IMAGE_SIZES = [0, 1, 2, 3]
+FPS_OPTIONS = [15, 25, 30]
+SEGMENT_SECONDS = 2
+# The served stream is a finished recording, a read failing for this long means it was read to the end
+READ_FAILURE_TIMEOUT = 1.0
+# Results that are worse when lower, every other compared result is worse when higher
+HIGHER_IS_BETTER = {"decode_fps"}
+COMPARED_RESULTS = ["decode_fps", "latency_p50_ms", "latency_p99_ms", "cpu_percent", "max_rss_mb"]
+
+
+def stream_name(image_size: int, fps: int) -> str:
+    return f"size{image_size}_fps{fps}"
+
+
+def generate_stream(streams_dir: str, image_size: int, fps: int, frames: int) -> str:
+    """
+    Renders a QR stream the way the server does (`streamgear_test.render_frame`) and writes it as a static HLS stream,
+    `<streams_dir>/<name>/video/stream.m3u8` with MPEG-TS segments, so it can be served like the server's. Frames are
+    numbered from 0 and stamped with their time in the stream, with a seeded `random`, so the same arguments always
+    give the same stream. A stream that was already generated is reused.
+    Runs in its own process, the server and client both have a `timing_marker` module
+    :return: directory of the stream
+    """
+    sys.path.insert(0, SERVER_DIR)
+    import cv2
+    from streamgear_test import IMAGE_SIZE_MAP, render_frame
+    stream_dir = os.path.join(streams_dir, stream_name(image_size, fps))
+    video_dir = os.path.join(stream_dir, "video")
+    playlist_path = os.path.join(video_dir, "stream.m3u8")
+    if os.path.exists(playlist_path):
+        return stream_dir
+    os.makedirs(video_dir, exist_ok=True)
+    random.seed(image_size * 1000 + fps)
+    dimensions = IMAGE_SIZE_MAP[image_size]
+    frames_per_segment = SEGMENT_SECONDS * fps
+    playlist = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{SEGMENT_SECONDS}",
+                "#EXT-X-MEDIA-SEQUENCE:0", "#EXT-X-PLAYLIST-TYPE:VOD"]
+    for segment, first_frame in enumerate(range(0, frames, frames_per_segment)):
+        segment_frames = min(frames_per_segment, frames - first_frame)
+        writer = cv2.VideoWriter(os.path.join(video_dir, f"stream{segment}.ts"), cv2.VideoWriter_fourcc(*"mp4v"),
+                                 fps, dimensions)
+        for frame_number in range(first_frame, first_frame + segment_frames):
+            writer.write(render_frame(frame_number, frame_number / fps, dimensions=dimensions))
+        writer.release()
+        playlist += [f"#EXTINF:{segment_frames / fps:.6f},", f"stream{segment}.ts"]
+    playlist.append("#EXT-X-ENDLIST")
+    with open(playlist_path, "w") as playlist_file:
+        playlist_file.write("\n".join(playlist) + "\n")
+    print(f"Generated {frames} frames at {dimensions[0]}x{dimensions[1]} {fps} fps in {stream_dir}")
+    return stream_dir
+
+
+class StreamServer(threading.Thread):
+    """
+    Static stand-in for flask_server.py: serves a generated stream directory at /video/<file> on a free port
+    """
+
+    def __init__(self, stream_dir: str):
+        super().__init__(daemon=True)
+        handler = partial(_QuietHandler, directory=stream_dir)
+        self._http = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.port = self._http.server_address[1]
+
+    def run(self) -> None:
+        self._http.serve_forever(poll_interval=0.2)
+
+    def stop(self) -> None:
+        self._http.shutdown()
+        self._http.server_close()
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+def run_client(port: int, frames: int, ingest: str, decode_workers: int) -> Dict[str, float]:
+    """
+    Runs a StreamAnalyzer over the served stream as fast as it can decode, in its own process so CPU time and peak
+    RSS are its own.
+    The end to end latency measured is the client's own, from a frame being read off the stream to its decoded
+    result being added to the statistics: the stream is a recording, so the QR timestamps are not wall-clock times.
+    The wall time runs to the last decoded frame, so waiting out the end of the stream is not counted
+    """
+    sys.path.insert(0, CLIENT_DIR)
+    from concurrent.futures import ThreadPoolExecutor
+    from client_cv import StreamAnalyzer
+    from histogram import LogHistogram
+
+    class TimedStreamAnalyzer(StreamAnalyzer):
+        def __init__(self, *args, **kwargs):
+            self.pipeline_latency = LogHistogram()
+            self.last_frame_done: Optional[float] = None
+            super().__init__(*args, **kwargs)
+
+        def add_frame_stats(self, frame_dict) -> None:
+            if frame_dict is not None:
+                self.pipeline_latency.record(time.time() - frame_dict.time_received)
+            super().add_frame_stats(frame_dict)
+            self.last_frame_done = time.perf_counter()
+
+    database_dir = tempfile.mkdtemp()
+    executor = ThreadPoolExecutor(max_workers=decode_workers)
+    analyzer = TimedStreamAnalyzer(ip_address="127.0.0.1", port=port,
+                                   database_name=os.path.join(database_dir, "benchmark.db"), record_params=False,
+                                   record_period_seconds=3600, ingest=ingest, executor=executor,
+                                   read_failure_timeout=READ_FAILURE_TIMEOUT)
+    usage_start = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    analyzer.get_stream_record_frames(limit_frames=frames)
+    wall_seconds = (analyzer.last_frame_done or time.perf_counter()) - start
+    usage_end = resource.getrusage(resource.RUSAGE_SELF)
+    executor.shutdown(wait=True)
+    analyzer.close()
+    cpu_seconds = usage_end.ru_utime - usage_start.ru_utime + usage_end.ru_stime - usage_start.ru_stime
+    decoded = analyzer.frame_stats.totals.decode.count
+    latency = analyzer.pipeline_latency
+    return {"frames_read": analyzer.frames_received, "frames_decoded": decoded, "wall_seconds": wall_seconds,
+            "decode_fps": decoded / wall_seconds if wall_seconds else 0.0,
+            "latency_p50_ms": (latency.percentile(50) or 0) * 1000,
+            "latency_p99_ms": (latency.percentile(99) or 0) * 1000,
+            "cpu_percent": 100 * cpu_seconds / wall_seconds if wall_seconds else 0.0,
+            # ru_maxrss is in kilobytes on linux
+            "max_rss_mb": usage_end.ru_maxrss / 1024}
+
+
+def run_benchmarks(image_sizes: List[int], fps_options: List[int], frames: int, streams_dir: str, ingest: str,
+                   decode_workers: int) -> List[dict]:
+    results = []
+    spawn = multiprocessing.get_context("spawn")
+    for image_size in image_sizes:
+        for fps in fps_options:
+            with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as process:
+                stream_dir = process.submit(generate_stream, streams_dir, image_size, fps, frames).result()
+            server = StreamServer(stream_dir)
+            server.start()
+            try:
+                with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as process:
+                    result = process.submit(run_client, server.port, frames, ingest, decode_workers).result()
+            finally:
+                server.stop()
+            result = {"stream": stream_name(image_size, fps), "image_size": image_size, "fps": fps, **result}
+            print(f"{result['stream']}: {result['decode_fps']:.1f} decoded frames/s, latency p50 "
+                  f"{result['latency_p50_ms']:.1f}ms p99 {result['latency_p99_ms']:.1f}ms, "
+                  f"cpu {result['cpu_percent']:.0f}%, max rss {result['max_rss_mb']:.0f}MB")
+            results.append(result)
+    return results
+
+
+def compare_to_baseline(results: List[dict], baseline: dict, tolerance: float) -> List[str]:
+    """
+    :param tolerance: relative change that still counts as noise, i.e. 0.1 for 10%
+    :return: one line per result that got worse than the baseline by more than the tolerance
+    """
+    baseline_results = {result["stream"]: result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        previous: Optional[dict] = baseline_results.get(result["stream"])
+        if previous is None:
+            continue
+        for key in COMPARED_RESULTS:
+            if not previous.get(key):
+                continue
+            change = (result[key] - previous[key]) / previous[key]
+            worse = -change if key in HIGHER_IS_BETTER else change
+            if worse > tolerance:
+                regressions.append(f"{result['stream']} {key}: {previous[key]:.2f} -> {result[key]:.2f} "
+                                   f"({change:+.0%})")
+    return regressions
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Measures client throughput against locally served QR streams")
+    parser.add_argument("-is", "--image-sizes", type=int, nargs="+", default=IMAGE_SIZES,
+                        help="IMAGE_SIZE_MAP entries to benchmark, all of them by default")
+    parser.add_argument("-fps", "--fps", type=int, nargs="+", default=FPS_OPTIONS, help="Stream frame rates")
+    parser.add_argument("-f", "--frames", type=int, default=500, help="Frames per stream")
+    parser.add_argument("-sd", "--streams-dir", default=DEFAULT_STREAMS_DIR,
+                        help="Where generated streams are kept, they are only generated once")
+    parser.add_argument("-i", "--ingest", choices=["opencv", "hls"], default="opencv",
+                        help="How the client reads the stream, see client_cv.py --ingest")
+    parser.add_argument("-w", "--decode-workers", type=int, default=10, help="Threads in the client decode pool")
+    parser.add_argument("-b", "--baseline", default=DEFAULT_BASELINE,
+                        help="json file to compare the results to, it is created if it does not exist")
+    parser.add_argument("-u", "--update-baseline", action="store_true",
+                        help="Write the results to the baseline file instead of comparing to it")
+    parser.add_argument("-t", "--tolerance", type=float, default=0.1,
+                        help="Relative change from the baseline that is not reported as a regression")
+    return parser
+
+
+def main() -> None:
+    args = get_parser().parse_args()
+    results = run_benchmarks(args.image_sizes, args.fps, args.frames, args.streams_dir, args.ingest,
+                             args.decode_workers)
+    if args.update_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, "w") as baseline_file:
+            json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "machine": platform.node(),
+                       "cpu_count": os.cpu_count(), "frames": args.frames, "ingest": args.ingest,
+                       "decode_workers": args.decode_workers, "results": results}, baseline_file, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    regressions = compare_to_baseline(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    print(f"No regressions against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
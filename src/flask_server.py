@@ -1,12 +1,22 @@
-from flask import render_template, Flask, send_from_directory, jsonify
+from flask import render_template, Flask, send_from_directory, jsonify, request, abort
 from flask.wrappers import Response
+from typing import Optional
 import os
+from image_sizes import streamed_image_size
+from segment_cache import SegmentCache
 
 app = Flask(__name__)
+# Serves the playlists and newest segments from memory and answers _HLS_msn blocking playlist reloads
+LOW_LATENCY = os.environ.get("LOW_LATENCY", "").lower() in ("1", "true", "yes")
+# Segments never change once listed, clients may keep them this long
+SEGMENT_MAX_AGE = 60
+segment_cache: Optional[SegmentCache] = None
 
 @app.after_request
 def add_header(response) -> Response:
     response.headers['X-UA-Compatible'] = 'IE=Edge,chrome=1'
+    if response.cache_control.immutable:
+        return response
     response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
     response.headers['Pragma'] = 'no-cache'
     response.headers['Expires'] = '0'
@@ -15,13 +25,16 @@ def add_header(response) -> Response:
 @app.route("/get_params")
 def get_params() -> Response:
     """
-    Returns params stored as environment variables
+    Returns params stored as environment variables, with IMAGE_SIZE the size actually streamed: the largest of
+    ABR_SIZES when a ladder is streamed
     """
-    params = ["CPU", "MEMORY", "IMAGE_SIZE", "FPS", "VIDEO_TYPE", "ID"]
+    params = ["CPU", "MEMORY", "IMAGE_SIZE", "FPS", "VIDEO_TYPE", "ID", "TIMING_MARKER", "ABR_SIZES", "LOW_LATENCY"]
     result_dict = {}
     for param in params:
         if param in os.environ:
             result_dict[param] = os.environ[param]
+    if "IMAGE_SIZE" in result_dict or "ABR_SIZES" in result_dict:
+        result_dict["IMAGE_SIZE"] = str(streamed_image_size())
     return jsonify(result_dict)
 
 @app.route('/')
@@ -35,9 +48,51 @@ def ping() -> Response:
 
 @app.route('/video/<string:file_name>')
 def stream(file_name) -> Response:
+    if segment_cache is not None:
+        if file_name.endswith(".m3u8"):
+            response = cached_playlist(file_name)
+        else:
+            response = cached_segment(file_name)
+        if response is not None:
+            return response
     video_dir = f'{os.getcwd()}/video'
     return send_from_directory(directory=video_dir, path=file_name)
 
 
+def cached_playlist(file_name: str) -> Optional[Response]:
+    """
+    Serves a playlist from the segment cache. With `_HLS_msn=<n>` the response is held until the playlist lists media
+    sequence number n, so the client hears about a segment as soon as it is written
+    """
+    msn = request.args.get("_HLS_msn", type=int)
+    playlist = segment_cache.playlist(file_name)
+    if playlist is None:
+        return None
+    if msn is not None:
+        # Like LL-HLS, a client asking for a segment more than two ahead of the newest is wrong about the stream
+        if playlist.last_sequence is not None and msn > playlist.last_sequence + 2:
+            abort(400)
+        playlist = segment_cache.wait_for_sequence(file_name, msn)
+    return Response(playlist.data, mimetype="application/vnd.apple.mpegurl")
+
+
+def cached_segment(file_name: str) -> Optional[Response]:
+    """
+    Serves a segment from the segment cache. The cached bytes are handed to the WSGI server as they are, without a
+    copy or a read from disk
+    """
+    data = segment_cache.segment(file_name)
+    if data is None:
+        return None
+    response = Response(data, mimetype="video/mp2t")
+    response.cache_control.public = True
+    response.cache_control.max_age = SEGMENT_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+
 if __name__ == '__main__':
-    app.run('0.0.0.0', port=5000)
\ No newline at end of file
+    if LOW_LATENCY:
+        segment_cache = SegmentCache(f'{os.getcwd()}/video')
+        segment_cache.start()
+    app.run('0.0.0.0', port=5000, threaded=True)
\ No newline at end of file
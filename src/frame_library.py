@@ -0,0 +1,89 @@
+import json
+import os
+import random
+import time
+from typing import Tuple
+import cv2
+import numpy as np
+from frame_generator import QRFrameGenerator
+from timing_marker import stamp_marker
+
+FRAME_LIBRARY_DIR = os.environ.get("FRAME_LIBRARY_DIR", "frame_library")
+LIBRARY_SECONDS = float(os.environ.get("LIBRARY_SECONDS", 10.0))
+# Longest payload a library frame can have, rendered first so every frame gets the same QR version and layout
+_WIDEST_TIME = 9999.999999999999
+_WIDEST_RANDOM = 0.1234567890123456789
+
+
+def library_name(dimensions: Tuple[int, int], framerate: float) -> str:
+    return f"qr_{dimensions[0]}x{dimensions[1]}_{framerate:g}fps"
+
+
+def build_library(path: str, dimensions: Tuple[int, int], framerate: float,
+                  seconds: float = LIBRARY_SECONDS) -> None:
+    """
+    Renders `seconds` of QR frames into `<path>.npy` and describes them in `<path>.json`. Frame `n` carries frame
+    number `n` and time `n / framerate`, the time since the start of the loop. Only the square holding the code is
+    kept, as grayscale, everything else in a frame is white. The json is written last, a library without one was not
+    finished and is built again
+    """
+    frames = max(int(round(seconds * framerate)), 1)
+    generator = QRFrameGenerator(dimensions)
+    generator.render({"frame_number": frames - 1, "time": _WIDEST_TIME, "random": _WIDEST_RANDOM})
+    top, left, size = generator.code_box
+    library = np.lib.format.open_memmap(f"{path}.npy", mode="w+", dtype=np.uint8, shape=(frames, size, size))
+    for frame_number in range(frames):
+        frame = generator.render({"frame_number": frame_number, "time": frame_number / framerate,
+                                  "random": random.random()})
+        if generator.code_box != (top, left, size):
+            raise AssertionError(f"QR layout of frame {frame_number} changed from {(top, left, size)} to "
+                                 f"{generator.code_box}")
+        library[frame_number] = frame[top:top + size, left:left + size, 0]
+    library.flush()
+    del library
+    with open(f"{path}.json", "w") as info_file:
+        json.dump({"width": dimensions[0], "height": dimensions[1], "fps": framerate, "frames": frames, "top": top,
+                   "left": left, "size": size}, info_file)
+
+
+class FrameLibrary:
+    """
+    Prerecorded QR frames for one frame size and FPS, built once and cached on disk in FRAME_LIBRARY_DIR, then
+    memory-mapped so only the pages being streamed are held in memory. Frames are looped; building a frame is a copy
+    of the code square into a white BGR frame, so the server's CPU goes to encoding and serving rather than to
+    generating QR codes.
+
+    The QR codes can't be changed once rendered, they carry the time since the start of the loop and frame numbers
+    that restart at 0 every loop, so the live frame number and time are stamped over the top of every frame as a
+    timing strip. A prerecorded stream has to be analyzed with the STRIP timing marker.
+    """
+
+    def __init__(self, dimensions: Tuple[int, int], framerate: float, directory: str = FRAME_LIBRARY_DIR,
+                 seconds: float = LIBRARY_SECONDS):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, library_name(dimensions, framerate))
+        if not os.path.exists(f"{path}.json"):
+            start = time.perf_counter()
+            build_library(path, dimensions, framerate, seconds)
+            print(f"Built frame library {path} in {time.perf_counter() - start:.1f}s")
+        with open(f"{path}.json") as info_file:
+            info = json.load(info_file)
+        self.frames: np.ndarray = np.load(f"{path}.npy", mmap_mode="r")
+        self.length = info["frames"]
+        self._top, self._left, self._size = info["top"], info["left"], info["size"]
+        self.frame = np.full((dimensions[1], dimensions[0], 3), 255, dtype=np.uint8)
+        self._code_area = self.frame[self._top:self._top + self._size, self._left:self._left + self._size]
+        # cv2 only writes to contiguous arrays, the code is expanded to BGR here and then copied into the frame, which
+        # is over 10x faster than broadcasting the grayscale frame into it with numpy
+        self._code_bgr = np.empty((self._size, self._size, 3), dtype=np.uint8)
+
+    def render(self, frame_number: int, timestamp: float) -> np.ndarray:
+        """
+        :param frame_number: frame number in the stream, the library frame shown is this modulo the loop length
+        :param timestamp: time the frame is due in the stream
+        :return: the library's frame buffer, overwritten by the next call
+        """
+        cv2.cvtColor(self.frames[frame_number % self.length], cv2.COLOR_GRAY2BGR, dst=self._code_bgr)
+        self._code_area[:] = self._code_bgr
+        stamp_marker(self.frame, frame_number=frame_number, timestamp=timestamp)
+        return self.frame
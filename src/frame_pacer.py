@@ -0,0 +1,132 @@
+import csv
+import queue
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+import numpy as np
+
+EMIT_LOG = "emit_lateness.csv"
+EMIT_LOG_COLUMNS = ["frame_number", "scheduled_time", "emit_time", "lateness"]
+# Frames rendered ahead of the emitter
+DEFAULT_LOOKAHEAD = 4
+# How often the emit log is flushed to disk, so writing it does not hold up the emitter every frame
+LOG_FLUSH_SECONDS = 1.0
+# Emitter sleeps until this close to a deadline, then spins to hit it exactly
+SPIN_SECONDS = 0.002
+
+
+class EmitLog:
+    """
+    When every frame was due and when it was actually handed to the encoder, appended to a csv file. The frames carry
+    their scheduled time, so a frame's lateness is how much later it entered the stream than its timestamp says and
+    can be subtracted from the latency the client measures for it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "w", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(EMIT_LOG_COLUMNS)
+        self._rows: List[list] = []
+        self._next_flush = time.time() + LOG_FLUSH_SECONDS
+        self.frames = 0
+        self.late_sum = 0.0
+        self.late_max = 0.0
+
+    def record(self, frame_number: int, scheduled_time: float, emit_time: float) -> None:
+        lateness = emit_time - scheduled_time
+        self._rows.append([frame_number, repr(scheduled_time), repr(emit_time), repr(lateness)])
+        self.frames += 1
+        self.late_sum += lateness
+        self.late_max = max(self.late_max, lateness)
+        if emit_time >= self._next_flush:
+            self.flush()
+            self._next_flush = emit_time + LOG_FLUSH_SECONDS
+
+    def flush(self) -> None:
+        self._writer.writerows(self._rows)
+        self._file.flush()
+        self._rows = []
+
+    def summary(self) -> str:
+        mean = self.late_sum / self.frames if self.frames else 0.0
+        return f"{self.frames} frames emitted, lateness mean {mean * 1000:.2f}ms max {self.late_max * 1000:.2f}ms"
+
+    def close(self) -> None:
+        self.flush()
+        self._file.close()
+
+
+class FrameProducer(threading.Thread):
+    """
+    Renders frames ahead of the emitter into a fixed pool of buffers. Frame `n` is stamped with the time it is
+    scheduled to be emitted, `start_time + n / framerate`, rather than the time it was rendered, so rendering early
+    does not show up as latency. Buffers go back to the pool once the emitter has streamed them; `ready` holds at
+    most `lookahead` frames, after which the producer waits for the emitter.
+    """
+
+    def __init__(self, render: Callable[[int, float], np.ndarray], framerate: float, start_time: float,
+                 frame_limit: int = None, lookahead: int = DEFAULT_LOOKAHEAD):
+        """
+        :param render: builds frame `n` with the timestamp given, may return a buffer it reuses
+        """
+        super().__init__(daemon=True)
+        self.render = render
+        self.framerate = framerate
+        self.start_time = start_time
+        self.frame_limit = frame_limit
+        self.ready: "queue.Queue[Optional[Tuple[int, float, np.ndarray]]]" = queue.Queue(maxsize=lookahead)
+        self.free: "queue.Queue[np.ndarray]" = queue.Queue()
+        self._buffers = lookahead + 2  # Frames waiting in `ready`, the one being emitted and the one being rendered
+        self._stop_event = threading.Event()
+
+    def scheduled_time(self, frame_number: int) -> float:
+        return self.start_time + frame_number / self.framerate
+
+    def run(self) -> None:
+        frame_number = 0
+        while not self._stop_event.is_set():
+            if self.frame_limit is not None and frame_number > self.frame_limit:
+                break
+            scheduled_time = self.scheduled_time(frame_number)
+            frame = self.render(frame_number, scheduled_time)
+            if self._buffers:
+                self._buffers -= 1
+                buffer = np.empty_like(frame)
+            else:
+                buffer = self.free.get()
+            np.copyto(buffer, frame)
+            self.ready.put((frame_number, scheduled_time, buffer))
+            frame_number += 1
+        self.ready.put(None)
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        # Unblock a producer waiting for room in `ready`
+        try:
+            self.ready.get_nowait()
+        except queue.Empty:
+            pass
+
+
+def emit_paced(producer: FrameProducer, emit: Callable[[np.ndarray], None], emit_log: EmitLog = None) -> None:
+    """
+    Hands the producer's frames to `emit` at their scheduled times until the producer runs out. A frame that is late
+    is emitted straight away rather than dropped, its lateness is recorded and the following frames keep their own
+    deadlines, so the stream catches up if it can.
+    """
+    while True:
+        item = producer.ready.get()
+        if item is None:
+            return
+        frame_number, scheduled_time, buffer = item
+        wait = scheduled_time - time.time()
+        if wait > SPIN_SECONDS:
+            time.sleep(wait - SPIN_SECONDS)
+        while time.time() < scheduled_time:
+            pass
+        emit_time = time.time()
+        emit(buffer)
+        if emit_log is not None:
+            emit_log.record(frame_number, scheduled_time, emit_time)
+        producer.free.put(buffer)
@@ -0,0 +1,37 @@
+import os
+from typing import Dict, List, Mapping, Tuple
+
+DEFAULT_IMAGE_SIZE = 1
+
+IMAGE_SIZE_MAP: Dict[int, Tuple[int, int]] = {
+    0: (486, 240),
+    1: (720, 480),
+    2: (1280, 720),
+    3: (1440, 1080)
+}
+
+
+def ladder_sizes(value: str) -> List[int]:
+    """
+    :param value: comma separated IMAGE_SIZE_MAP keys, or ALL for every size
+    :return: the image sizes, smallest first
+    """
+    if value.strip().upper() == "ALL":
+        return sorted(IMAGE_SIZE_MAP)
+    sizes = sorted({int(size) for size in value.split(",") if size.strip()})
+    unknown = [size for size in sizes if size not in IMAGE_SIZE_MAP]
+    if unknown:
+        raise AssertionError(f"Image sizes {unknown} are not in IMAGE_SIZE_MAP")
+    return sizes
+
+
+def streamed_image_size(environ: Mapping[str, str] = os.environ) -> int:
+    """
+    Image size the server streams, the largest of ABR_SIZES when it streams a ladder and IMAGE_SIZE otherwise. Read
+    by the stream and by the flask server, which reports it as IMAGE_SIZE
+    :param environ: the environment variables the server was started with
+    """
+    abr_sizes = ladder_sizes(environ.get("ABR_SIZES", ""))
+    if abr_sizes:
+        return abr_sizes[-1]
+    return int(environ.get("IMAGE_SIZE", DEFAULT_IMAGE_SIZE))
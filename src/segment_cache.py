@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+# How often the video directory is checked for a rewritten playlist
+DEFAULT_SCAN_SECONDS = 0.02
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# A blocking playlist reload waits at most this many target durations, like LL-HLS servers do
+BLOCKING_TARGET_DURATIONS = 3
+
+
+class CachedPlaylist:
+    __slots__ = ("data", "mtime", "last_sequence", "target_duration", "segments")
+
+    def __init__(self, data: bytes, mtime: int):
+        self.data = data
+        self.mtime = mtime
+        self.last_sequence: Optional[int] = None
+        self.target_duration = 0.0
+        self.segments: List[str] = []
+        media_sequence = 0
+        for line in data.decode(errors="replace").splitlines():
+            line = line.strip()
+            if line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+                media_sequence = int(line.split(":", 1)[1])
+            elif line.startswith("#EXT-X-TARGETDURATION:"):
+                self.target_duration = float(line.split(":", 1)[1])
+            elif line and not line.startswith("#") and not line.endswith(".m3u8"):
+                self.segments.append(line)
+        if self.segments:
+            self.last_sequence = media_sequence + len(self.segments) - 1
+
+
+class SegmentCache(threading.Thread):
+    """
+    Keeps the playlists of the stream being written to `directory` and the newest segments they list in memory, so
+    they are served without going to disk. Segments are only read once a playlist lists them, which is after the
+    encoder finished writing them, and are dropped oldest first once `max_bytes` is reached or no playlist lists them
+    any more.
+
+    `wait_for_sequence` blocks until a playlist lists a media sequence number, which is what lets the server answer a
+    `_HLS_msn` playlist reload the moment the segment is written instead of when the client polls next.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES, scan_seconds: float = DEFAULT_SCAN_SECONDS):
+        super().__init__(daemon=True, name="segment-cache")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.scan_seconds = scan_seconds
+        self.playlists: Dict[str, CachedPlaylist] = {}
+        self.segments: "OrderedDict[str, bytes]" = OrderedDict()
+        self.cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._changed = threading.Condition()
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.scan_seconds):
+            try:
+                self.scan()
+            except OSError as e:
+                print(f"Segment cache scan of {self.directory} failed: {e}")
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def scan(self) -> None:
+        """
+        Reloads every playlist that changed since the last scan and caches the segments it lists
+        """
+        changed: List[Tuple[str, CachedPlaylist]] = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".m3u8") or not entry.is_file():
+                    continue
+                mtime = entry.stat().st_mtime_ns
+                cached = self.playlists.get(entry.name)
+                if cached is not None and cached.mtime == mtime:
+                    continue
+                with open(entry.path, "rb") as playlist_file:
+                    changed.append((entry.name, CachedPlaylist(playlist_file.read(), mtime)))
+        if not changed:
+            return
+        # In playlist order, so the oldest segments are evicted first
+        new_segments = list(OrderedDict.fromkeys(segment for _, playlist in changed for segment in playlist.segments
+                                                 if segment not in self.segments))
+        loaded = []
+        for segment in new_segments:
+            try:
+                with open(os.path.join(self.directory, segment), "rb") as segment_file:
+                    loaded.append((segment, segment_file.read()))
+            except FileNotFoundError:
+                pass  # Deleted by the encoder since the playlist was written
+        with self._changed:
+            for name, data in loaded:
+                self.segments[name] = data
+                self.cached_bytes += len(data)
+            self.playlists.update(changed)
+            still_listed = {segment for playlist in self.playlists.values() for segment in playlist.segments}
+            for name in [name for name in self.segments if name not in still_listed]:
+                self.cached_bytes -= len(self.segments.pop(name))
+            while self.cached_bytes > self.max_bytes and self.segments:
+                self.cached_bytes -= len(self.segments.popitem(last=False)[1])
+            self._changed.notify_all()
+
+    def segment(self, name: str) -> Optional[bytes]:
+        data = self.segments.get(name)
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return data
+
+    def playlist(self, name: str) -> Optional[CachedPlaylist]:
+        return self.playlists.get(name)
+
+    def wait_for_sequence(self, name: str, sequence: int, timeout: float = None) -> Optional[CachedPlaylist]:
+        """
+        :param timeout: most seconds to wait, BLOCKING_TARGET_DURATIONS target durations of the playlist if not given
+        :return: the playlist once it lists `sequence`, or as it is when the time runs out. None if there is no such
+        playlist
+        """
+        with self._changed:
+            playlist = self.playlists.get(name)
+            if playlist is None:
+                return None
+            if timeout is None:
+                timeout = BLOCKING_TARGET_DURATIONS * max(playlist.target_duration, 1.0)
+            deadline = time.monotonic() + timeout
+            while playlist.last_sequence is None or playlist.last_sequence < sequence:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._changed.wait(remaining):
+                    break
+                playlist = self.playlists.get(name, playlist)
+            return playlist
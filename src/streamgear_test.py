@@ -1,61 +1,139 @@
-from vidgear.gears import StreamGear
-import cv2
-import qrcode
 import time
 import random
 import threading
 import os
-from PIL import Image
-from typing import Dict, Tuple
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from frame_generator import GenerationStats, QRFrameGenerator
+from frame_library import FrameLibrary
+from frame_pacer import DEFAULT_LOOKAHEAD, EMIT_LOG, EmitLog, FrameProducer, emit_paced
+from image_sizes import IMAGE_SIZE_MAP, ladder_sizes, streamed_image_size
+from timing_marker import stamp_marker
 
 DEFAULT_FRAMERATE = float(os.environ.get("FPS", 25.0))
-DEFAULT_IMAGE_SIZE = 1
 # os.environ['IMAGE_SIZE'] = "10"
 
-IMAGE_SIZE_MAP: Dict[int, Tuple[int, int]] = {
-    0: (486, 240),
-    1: (720, 480),
-    2: (1280, 720),
-    3: (1440, 1080)
-}
-
-IMAGE_SIZE = int(os.environ.get("IMAGE_SIZE", DEFAULT_IMAGE_SIZE))
-print(f"Image siz: {IMAGE_SIZE}")
+# Image sizes to stream as one HLS ladder, every frame is generated once at the largest and the encoder scales it down
+# for the others. Empty for a single rendition of IMAGE_SIZE
+ABR_SIZES = ladder_sizes(os.environ.get("ABR_SIZES", ""))
+# With a ladder this is its largest size whatever IMAGE_SIZE was set to, `/get_params` reports the same
+IMAGE_SIZE = streamed_image_size()
+print(f"Image size: {IMAGE_SIZE}")
 IMAGE_DIMENSIONS = IMAGE_SIZE_MAP[IMAGE_SIZE]
 
+# QR puts the frame number and time in a QR code, STRIP stamps them in a block strip that is much cheaper to decode
+TIMING_MARKER = os.environ.get("TIMING_MARKER", "QR").upper()
+# LIVE renders every frame as it is streamed, PRERECORDED loops a frame library rendered once (see frame_library.py)
+# and needs TIMING_MARKER=STRIP
+VIDEO_TYPE = os.environ.get("VIDEO_TYPE", "LIVE").upper()
+
 # Provides a scaling of image sizes from 1 - 10
 # FPS configuration would be important
 # Could do prerecorded QR code video
 # There's definitely CPU and memory
+# How often start_stream prints how long building and streaming frames took
+STATS_PERIOD_SECONDS = 10
+
+_generators: Dict[Tuple[int, int], QRFrameGenerator] = {}
 
-def start_stream(framerate: float=DEFAULT_FRAMERATE, output: str="video\\stream.m3u8", stream_frame_limit: int=None) -> None:
+
+def ladder_streams(framerate: float, sizes: List[int] = ABR_SIZES) -> List[dict]:
     """
-    Starts streaming qr code video to network stream
+    :return: StreamGear `-streams` for every size of the ladder but the largest, which is the source stream. The
+    bitrate is left to StreamGear to work out from the resolution and framerate
     """
+    return [{"-resolution": f"{IMAGE_SIZE_MAP[size][0]}x{IMAGE_SIZE_MAP[size][1]}", "-framerate": framerate}
+            for size in sizes[:-1]]
+
+
+def render_frame(frame_number: int, timestamp: float, dimensions: Optional[Tuple[int, int]] = None,
+                 strip_canvas: np.ndarray = None) -> np.ndarray:
+    """
+    Builds one frame of the stream. QR frames are drawn in memory by one `QRFrameGenerator` per frame size, the
+    frame returned is that generator's buffer and is overwritten by the next frame of the same size
+    :param dimensions: (width, height) of the frame, IMAGE_DIMENSIONS if not set
+    :param strip_canvas: blank frame to stamp a timing strip onto instead of drawing a QR code
+    """
+    if strip_canvas is not None:
+        return stamp_marker(strip_canvas, frame_number=frame_number, timestamp=timestamp)
+    dimensions = tuple(dimensions) if dimensions is not None else IMAGE_DIMENSIONS
+    generator = _generators.get(dimensions)
+    if generator is None:
+        generator = _generators[dimensions] = QRFrameGenerator(dimensions)
+    qr_code_data = {"frame_number": frame_number, "time": timestamp, "random": random.random()}
+    return generator.render(qr_code_data)
+
+
+def start_stream(framerate: float=DEFAULT_FRAMERATE, output: str="video\\stream.m3u8", stream_frame_limit: int=None,
+                 timing_marker: str=TIMING_MARKER, emit_log_path: str=os.path.join("video", EMIT_LOG),
+                 lookahead: int=DEFAULT_LOOKAHEAD, video_type: str=VIDEO_TYPE,
+                 abr_sizes: List[int]=ABR_SIZES) -> None:
+    """
+    Starts streaming qr code video to network stream. Frames are rendered ahead by a `FrameProducer` thread and
+    handed to StreamGear at exact 1 / framerate intervals, each stamped with the time it is due to be emitted. How
+    late every frame actually was is written to `emit_log_path`, next to the stream so the client can fetch it
+    :param timing_marker: "QR" to encode the frame number and time as a QR code, "STRIP" to stamp them into a block
+    strip at the top of a blank frame
+    :param lookahead: frames rendered ahead of the one being emitted
+    :param video_type: "LIVE" to render every frame, "PRERECORDED" to loop a `FrameLibrary`, which needs the STRIP
+    timing marker
+    :param abr_sizes: image sizes to stream as renditions of one master playlist, frames are rendered at the largest,
+    which has to be IMAGE_SIZE. Empty for a single rendition
+    """
+    if video_type == "PRERECORDED" and timing_marker != "STRIP":
+        raise AssertionError("PRERECORDED video needs TIMING_MARKER=STRIP, the QR codes of the frame library only carry "
+                             "their position in the loop")
+    from vidgear.gears import StreamGear  # Only the streaming needs vidgear, render_frame can be used without it
     options_stream = {"-livestream": True, "-input_framerate": framerate}
+    if abr_sizes:
+        if abr_sizes[-1] != IMAGE_SIZE:
+            raise AssertionError(f"The largest size of the ladder {abr_sizes} has to be IMAGE_SIZE {IMAGE_SIZE}")
+        options_stream["-streams"] = ladder_streams(framerate, abr_sizes)
     streamer = StreamGear(output=output, format="hls", **options_stream)
-    counter = 0
-    while True:
-        # Two params is probably the size of the frames width and ehight
-        qr_code_data = {"frame_number": counter, "time": time.time(), "random": random.random()}
-        qr_code = qrcode.make(data=qr_code_data)
-        qr_code.save("temp.png")
-        if IMAGE_SIZE != DEFAULT_IMAGE_SIZE:
-            width, height = IMAGE_DIMENSIONS[0], IMAGE_DIMENSIONS[1]
-            image = Image.open("temp.png")
-            new_image = image.resize((width, height))
-            new_image.save("temp.png")
-        frame = cv2.imread("temp.png")
+    strip_canvas = None
+    if timing_marker == "STRIP":
+        width, height = IMAGE_DIMENSIONS
+        strip_canvas = np.full((height, width, 3), 255, dtype=np.uint8)
+    library = None
+    if video_type == "PRERECORDED":
+        library = FrameLibrary(IMAGE_DIMENSIONS, framerate)
+    elif video_type != "LIVE":
+        raise AssertionError(f"Unknown video type {video_type}")
+    render_stats, stream_stats = GenerationStats(), GenerationStats()
+
+    def render(frame_number: int, timestamp: float) -> np.ndarray:
+        start = time.perf_counter()
+        if library is not None:
+            frame = library.render(frame_number, timestamp)
+        else:
+            frame = render_frame(frame_number, timestamp, strip_canvas=strip_canvas)
+        render_stats.record(time.perf_counter() - start)
+        return frame
+
+    next_stats = time.time() + STATS_PERIOD_SECONDS
+
+    def emit(frame: np.ndarray) -> None:
+        nonlocal next_stats
+        start = time.perf_counter()
         streamer.stream(frame)
-        key = cv2.waitKey(1)
-        if key == ord("q"):
-            print("Stream manually terminated. Ending now...")
-            break
-        if stream_frame_limit is not None and counter > stream_frame_limit:
-            print(f"Ending stream because {counter} frames have been sent")
-            break
-        counter += 1
-    streamer.terminate()
+        stream_stats.record(time.perf_counter() - start)
+        if time.time() >= next_stats:
+            print(f"Rendering: {render_stats.summary()}; streaming: {stream_stats.summary()}; {emit_log.summary()}")
+            next_stats += STATS_PERIOD_SECONDS
+
+    emit_log = EmitLog(emit_log_path)
+    # Give the producer time to fill its lookahead before the first deadline
+    producer = FrameProducer(render, framerate, start_time=time.time() + lookahead / framerate,
+                             frame_limit=stream_frame_limit, lookahead=lookahead)
+    producer.start()
+    try:
+        emit_paced(producer, emit, emit_log)
+        print(f"Ending stream because {emit_log.frames} frames have been sent")
+    finally:
+        producer.stop()
+        emit_log.close()
+        streamer.terminate()
+
 
 class StreamThread(threading.Thread):
 
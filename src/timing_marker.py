@@ -0,0 +1,57 @@
+import numpy as np
+
+# Layout of the timing strip. The client decoder in video_client/timing_marker.py has to use the same values
+MARKER_COLUMNS = 48
+MARKER_ROWS = 2
+SYNC_BITS = (1, 0, 1, 0)
+FRAME_NUMBER_BITS = 32
+TIME_BITS = 52  # microseconds since the epoch
+CHECKSUM_BITS = 8
+DARK, LIGHT = 0, 255
+
+
+def crc8(data: bytes) -> int:
+    """
+    CRC-8 (polynomial 0x07) used to check the strip payload
+    """
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+def payload_checksum(frame_number: int, time_micros: int) -> int:
+    return crc8(frame_number.to_bytes(4, "big") + time_micros.to_bytes(7, "big"))
+
+
+def _to_bits(value: int, width: int) -> np.ndarray:
+    return (value >> np.arange(width, dtype=np.uint64)).astype(np.uint64) & 1
+
+
+def marker_geometry(width: int):
+    """
+    :return: (x offset, block size) of the strip for a frame of the given width. The strip sits centered at the top
+    of the frame and is MARKER_ROWS blocks high
+    """
+    block = width // MARKER_COLUMNS
+    return (width - block * MARKER_COLUMNS) // 2, block
+
+
+def stamp_marker(frame: np.ndarray, frame_number: int, timestamp: float) -> np.ndarray:
+    """
+    Writes the frame number and timestamp into a strip of black and white blocks at the top of the frame, in place.
+    A set bit is a dark block
+    """
+    time_micros = int(round(timestamp * 1_000_000))
+    frame_number = frame_number & 0xFFFFFFFF
+    bits = np.concatenate([np.array(SYNC_BITS, dtype=np.uint64), _to_bits(frame_number, FRAME_NUMBER_BITS),
+                           _to_bits(time_micros, TIME_BITS),
+                           _to_bits(payload_checksum(frame_number, time_micros), CHECKSUM_BITS)])
+    levels = np.where(bits.reshape(MARKER_ROWS, MARKER_COLUMNS) == 1, DARK, LIGHT).astype(np.uint8)
+    x0, block = marker_geometry(frame.shape[1])
+    strip = np.repeat(np.repeat(levels, block, axis=0), block, axis=1)
+    region = frame[:MARKER_ROWS * block, x0:x0 + MARKER_COLUMNS * block]
+    region[...] = strip[..., None] if frame.ndim == 3 else strip
+    return frame
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The client modules import each other by file name, the way they are run from inside video_client/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "video_client"))
@@ -0,0 +1,111 @@
+import threading
+import time
+import numpy as np
+import pytest
+from capture import CapturedFrame, FrameQueue, FrameReader, OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_EVERY_NTH
+
+
+def _frame(number: int) -> CapturedFrame:
+    return CapturedFrame(frame=np.zeros((1, 1, 3), dtype=np.uint8), frame_received_counter=number,
+                         time_received=float(number), enqueued_at=0.0)
+
+
+def _drain(queue: FrameQueue) -> list:
+    numbers = []
+    while len(queue):
+        numbers.append(queue.get(timeout=0).frame_received_counter)
+    return numbers
+
+
+def test_block_waits_for_room():
+    queue = FrameQueue(maxsize=2, policy=OVERFLOW_BLOCK)
+    assert queue.put(_frame(0)) and queue.put(_frame(1))
+    third_put = threading.Thread(target=queue.put, args=(_frame(2),))
+    third_put.start()
+    third_put.join(timeout=0.2)
+    assert third_put.is_alive()
+    assert queue.get(timeout=1).frame_received_counter == 0
+    third_put.join(timeout=1)
+    assert not third_put.is_alive()
+    assert _drain(queue) == [1, 2]
+    assert queue.take_window().frames_dropped == 0
+
+
+def test_block_gives_up_once_closed():
+    queue = FrameQueue(maxsize=1, policy=OVERFLOW_BLOCK)
+    queue.put(_frame(0))
+    results = []
+    blocked_put = threading.Thread(target=lambda: results.append(queue.put(_frame(1))))
+    blocked_put.start()
+    queue.close()
+    blocked_put.join(timeout=1)
+    assert results == [False]
+    assert not queue.finished()
+    assert queue.get(timeout=0).frame_received_counter == 0
+    assert queue.finished()
+
+
+def test_drop_oldest():
+    dropped = []
+    queue = FrameQueue(maxsize=3, policy=OVERFLOW_DROP_OLDEST,
+                       on_drop=lambda item: dropped.append(item.frame_received_counter))
+    assert all(queue.put(_frame(number)) for number in range(5))
+    assert dropped == [0, 1]
+    assert queue.take_window().frames_dropped == 2
+    assert _drain(queue) == [2, 3, 4]
+
+
+def test_every_nth():
+    dropped = []
+    queue = FrameQueue(maxsize=4, policy=OVERFLOW_EVERY_NTH, every_nth=2,
+                       on_drop=lambda item: dropped.append(item.frame_received_counter))
+    accepted = [queue.put(_frame(number)) for number in range(8)]
+    # Frames 0 and 1 fill half the queue, then only every 2nd offered frame gets in until it is full
+    assert accepted == [True, True, False, True, False, True, False, False]
+    assert dropped == [2, 4, 6, 7]
+    window = queue.take_window()
+    assert window.frames_dropped == 4
+    assert window.max_depth == 4
+    assert _drain(queue) == [0, 1, 3, 5]
+
+
+def test_unknown_policy():
+    with pytest.raises(AssertionError):
+        FrameQueue(policy="drop-newest")
+
+
+class _FailingCapture:
+    """
+    A capture whose reads all fail, like a live stream that stalled or a source that ran out of frames
+    """
+
+    def __init__(self, end_of_stream: bool = None, frame_count: float = 0.0):
+        if end_of_stream is not None:
+            self.end_of_stream = end_of_stream
+        self.frame_count = frame_count
+
+    def grab(self) -> bool:
+        return False
+
+    def get(self, prop_id: int) -> float:
+        return self.frame_count
+
+
+# A file's position and frame count both come back as 1, it read its only frame
+@pytest.mark.parametrize("capture", [_FailingCapture(end_of_stream=True), _FailingCapture(frame_count=1.0)],
+                         ids=["ingester", "file"])
+def test_reader_ends_at_end_of_stream(capture):
+    reader = FrameReader(capture, read_failure_timeout=60)
+    assert reader.read() is None
+    assert reader.finished
+
+
+def test_reader_retries_a_live_stream_for_the_timeout():
+    reader = FrameReader(_FailingCapture(end_of_stream=False), read_failure_timeout=0.2)
+    start = time.monotonic()
+    reads = 0
+    while not reader.finished:
+        assert reader.read() is None
+        reads += 1
+    assert time.monotonic() - start >= 0.2
+    assert reads > 1
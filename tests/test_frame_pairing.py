@@ -0,0 +1,60 @@
+from frame_pairing import FramePairingEngine
+from frame_recorder import FrameDict
+
+
+def _frame(received: int, frame_number: int, time_received: float = None) -> FrameDict:
+    time_received = received * 0.04 if time_received is None else time_received
+    return FrameDict(frame_number=frame_number, frame_number_received=received, time_generated=time_received - 0.5,
+                     time_received=time_received, analysis_number=1)
+
+
+def test_consecutive_frames():
+    engine = FramePairingEngine(capacity=16)
+    for received in range(5):
+        engine.add(_frame(received, received + 100))
+    window = engine.take_window()
+    assert window.frames_counted == 4
+    assert window.frames_dropped == 0
+    assert window.frames_repeated == 0
+    assert window.latency.count == 4
+    assert window.average_latency() == 0.5
+    assert engine.take_window().frames_counted == 0
+    assert engine.totals.frames_counted == 4
+
+
+def test_drops_and_repeats():
+    engine = FramePairingEngine(capacity=16)
+    for received, frame_number in enumerate([10, 11, 13, 13, 13, 14, 20]):
+        engine.add(_frame(received, frame_number))
+    window = engine.take_window()
+    assert window.frames_dropped == 2  # 11 -> 13 and 14 -> 20
+    assert window.frames_repeated == 2
+    assert window.frames_counted == 4
+
+
+def test_unreadable_frames_are_drops_not_repeats():
+    engine = FramePairingEngine(capacity=16)
+    for received, frame_number in enumerate([10, 11, -1, -1, -1, 12, 13]):
+        engine.add(_frame(received, frame_number) if frame_number >= 0 else
+                   FrameDict(frame_number=-1, frame_number_received=received, time_generated=-1,
+                             time_received=received * 0.04, analysis_number=1, confidence=0.0))
+    window = engine.take_window()
+    assert window.frames_repeated == 0
+    assert window.frames_dropped == 4  # 11 -> -1, the two pairs of unreadable frames and -1 -> 12
+    assert window.frames_counted == 6
+    assert window.latency.count == 3  # Frames 10, 11 and 12 were paired with the frame after them
+
+
+def test_pairs_frames_added_out_of_order():
+    engine = FramePairingEngine(capacity=16)
+    for received in (2, 0, 3, 1):
+        engine.add(_frame(received, received))
+    assert engine.take_window().frames_counted == 3
+
+
+def test_frames_older_than_the_ring_are_ignored():
+    engine = FramePairingEngine(capacity=4)
+    engine.add(_frame(5, 5))
+    engine.add(_frame(1, 1))
+    engine.add(_frame(0, 0))
+    assert engine.take_window().frames_counted == 0
@@ -0,0 +1,50 @@
+import numpy as np
+from frame_pool import FramePool
+
+
+def test_buffers_are_reused():
+    pool = FramePool(initial_buffers=2, max_buffers=4)
+    assert pool.acquire(timeout=0) is None  # The frame shape is not known yet
+    first = np.zeros((4, 4, 3), dtype=np.uint8)
+    pool.adopt(first)
+    assert (pool.allocated, pool.leased) == (2, 1)
+    buffer = pool.acquire(timeout=0)
+    pool.release(buffer)
+    assert pool.acquire(timeout=0) is buffer
+    assert pool.take_window().max_leased == 2
+
+
+def test_exhausted_pool_waits_and_gives_up():
+    pool = FramePool(initial_buffers=1, max_buffers=2)
+    pool.adopt(np.zeros((4, 4, 3), dtype=np.uint8))
+    assert pool.acquire(timeout=0) is not None
+    assert pool.acquire(timeout=0.01) is None
+    window = pool.take_window()
+    assert window.exhausted == 1
+    assert window.wait.count == 1
+
+
+def test_frame_adopted_while_exhausted_does_not_grow_the_pool():
+    pool = FramePool(initial_buffers=1, max_buffers=2)
+    frames = [np.zeros((4, 4, 3), dtype=np.uint8)]
+    pool.adopt(frames[0])
+    frames.append(pool.acquire(timeout=0))
+    # Read without a buffer because the pool was exhausted, i.e. while the reader was stopping
+    frames.append(np.zeros((4, 4, 3), dtype=np.uint8))
+    pool.adopt(frames[-1])
+    for frame in frames:
+        pool.release(frame)
+    assert pool.leased == 0
+    assert pool.allocated == pool.max_buffers == 2
+    assert pool.acquire(timeout=0) is not None and pool.acquire(timeout=0) is not None
+    assert pool.acquire(timeout=0) is None
+
+
+def test_buffers_of_the_old_shape_are_dropped():
+    pool = FramePool(initial_buffers=2, max_buffers=4)
+    old = np.zeros((4, 4, 3), dtype=np.uint8)
+    pool.adopt(old)
+    pool.adopt(np.zeros((8, 8, 3), dtype=np.uint8))
+    pool.release(old)
+    assert pool.frame_shape == (8, 8, 3)
+    assert pool.acquire(timeout=0).shape == (8, 8, 3)
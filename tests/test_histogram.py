@@ -0,0 +1,61 @@
+import pytest
+from histogram import LogHistogram
+
+
+def test_percentiles_are_within_bucket_precision():
+    histogram = LogHistogram()
+    for value in range(1, 1001):
+        histogram.record(value / 1000)
+    assert histogram.count == 1000
+    assert histogram.min == pytest.approx(0.001)
+    assert histogram.max == pytest.approx(1.0)
+    assert histogram.mean() == pytest.approx(0.5005)
+    for percent in (50, 90, 99):
+        assert histogram.percentile(percent) == pytest.approx(percent / 100, rel=0.02)
+    assert histogram.percentile(100) == pytest.approx(1.0)
+
+
+def test_empty_histogram():
+    histogram = LogHistogram()
+    assert histogram.percentile(50) is None
+    assert histogram.mean() == 0
+
+
+def test_percentile_is_clamped_to_recorded_values():
+    histogram = LogHistogram()
+    histogram.record(0.123456)
+    assert histogram.percentile(1) == 0.123456
+    assert histogram.percentile(99) == 0.123456
+
+
+def test_merge_matches_recording_everything_in_one():
+    first, second, combined = LogHistogram(), LogHistogram(), LogHistogram()
+    for value in range(1, 501):
+        first.record(value / 1000)
+        combined.record(value / 1000)
+    for value in range(501, 2001):
+        second.record(value / 1000)
+        combined.record(value / 1000)
+    merged = first.merge(second)
+    assert merged is first
+    assert merged.count == combined.count
+    assert merged.min == combined.min
+    assert merged.max == combined.max
+    assert merged.total == pytest.approx(combined.total)
+    assert list(merged.counts) == list(combined.counts)
+    assert merged.percentile(50) == combined.percentile(50)
+
+
+def test_merge_rejects_other_resolution():
+    with pytest.raises(AssertionError):
+        LogHistogram().merge(LogHistogram(resolution=1e-3))
+
+
+def test_json_round_trip():
+    histogram = LogHistogram()
+    for value in (0.01, 0.02, 0.5, 3.0):
+        histogram.record(value)
+    loaded = LogHistogram.from_json(histogram.to_json())
+    assert list(loaded.counts) == list(histogram.counts)
+    assert (loaded.count, loaded.min, loaded.max) == (histogram.count, histogram.min, histogram.max)
+    assert loaded.percentile(90) == histogram.percentile(90)
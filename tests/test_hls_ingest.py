@@ -0,0 +1,83 @@
+import struct
+import pytest
+import hls_ingest
+from hls_ingest import HLSIngester, PlaylistSegment, Variant, parse_playlist, select_variant
+
+MEDIA_PLAYLIST = """#EXTM3U
+#EXT-X-VERSION:3
+#EXT-X-TARGETDURATION:4
+#EXT-X-MEDIA-SEQUENCE:17
+#EXTINF:4.000000,
+stream_17.ts
+#EXTINF:3.960000,
+stream_18.ts
+#EXT-X-ENDLIST
+"""
+
+MASTER_PLAYLIST = """#EXTM3U
+#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360
+stream_0.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=2800000,RESOLUTION=1280x720
+stream_1.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=5000000
+http://cdn.example.com/audio.m3u8
+"""
+
+
+def test_parse_media_playlist():
+    playlist, variants = parse_playlist(MEDIA_PLAYLIST, "http://server:5000/video/stream.m3u8")
+    assert variants == []
+    assert playlist.target_duration == 4.0
+    assert playlist.media_sequence == 17
+    assert playlist.ended
+    assert playlist.segments == [PlaylistSegment(17, "http://server:5000/video/stream_17.ts", 4.0),
+                                 PlaylistSegment(18, "http://server:5000/video/stream_18.ts", 3.96)]
+
+
+def test_parse_local_playlist_resolves_against_its_directory():
+    playlist, _ = parse_playlist(MEDIA_PLAYLIST.replace("#EXT-X-ENDLIST\n", ""), "/tmp/recording/stream.m3u8")
+    assert not playlist.ended
+    assert playlist.segments[0].uri == "/tmp/recording/stream_17.ts"
+
+
+def test_parse_master_playlist():
+    playlist, variants = parse_playlist(MASTER_PLAYLIST, "http://server:5000/video/stream.m3u8")
+    assert playlist is None
+    assert variants == [Variant(800000, "http://server:5000/video/stream_0.m3u8", 640, 360),
+                        Variant(2800000, "http://server:5000/video/stream_1.m3u8", 1280, 720),
+                        Variant(5000000, "http://cdn.example.com/audio.m3u8")]
+
+
+def test_parse_rejects_other_text():
+    with pytest.raises(AssertionError):
+        parse_playlist("<html></html>", "http://server:5000/video/stream.m3u8")
+
+
+def test_select_variant():
+    _, variants = parse_playlist(MASTER_PLAYLIST, "http://server:5000/video/stream.m3u8")
+    assert select_variant(variants) is variants[0]
+    assert select_variant(variants, "1280x720") is variants[1]
+    assert select_variant(variants, "720p") is variants[1]
+    assert select_variant(variants, " 360P ") is variants[0]
+    assert select_variant(variants, "2") is variants[2]
+    assert select_variant(variants, "audio.m3u8") is variants[2]
+    with pytest.raises(AssertionError):
+        select_variant(variants, "1080p")
+
+
+def test_malformed_segment_is_counted_and_skipped(tmp_path, monkeypatch):
+    (tmp_path / "stream.m3u8").write_text(MEDIA_PLAYLIST)
+    (tmp_path / "stream_17.ts").write_bytes(b"\x47" * 10)
+    (tmp_path / "stream_18.ts").write_bytes(b"not a segment")
+
+    def read_ts_timestamps(data: bytes):
+        raise struct.error("unpack requires a buffer of 4 bytes")
+
+    monkeypatch.setattr(hls_ingest, "read_ts_timestamps", read_ts_timestamps)
+    ingester = HLSIngester(str(tmp_path))
+    try:
+        assert not ingester.grab()
+        assert ingester.segments_failed == 2
+        assert ingester.end_of_stream
+    finally:
+        ingester.release()
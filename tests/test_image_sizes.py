@@ -0,0 +1,24 @@
+import importlib.util
+import os
+import pytest
+
+# The server's modules live in src/, which is not on the path of the client tests
+_spec = importlib.util.spec_from_file_location(
+    "image_sizes", os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src", "image_sizes.py"))
+image_sizes = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(image_sizes)
+
+
+def test_ladder_sizes():
+    assert image_sizes.ladder_sizes("") == []
+    assert image_sizes.ladder_sizes("2, 0,2") == [0, 2]
+    assert image_sizes.ladder_sizes("all") == sorted(image_sizes.IMAGE_SIZE_MAP)
+    with pytest.raises(AssertionError):
+        image_sizes.ladder_sizes("0,7")
+
+
+def test_streamed_image_size_is_the_largest_of_a_ladder():
+    assert image_sizes.streamed_image_size({}) == image_sizes.DEFAULT_IMAGE_SIZE
+    assert image_sizes.streamed_image_size({"IMAGE_SIZE": "2"}) == 2
+    assert image_sizes.streamed_image_size({"IMAGE_SIZE": "1", "ABR_SIZES": "0,2"}) == 2
+    assert image_sizes.streamed_image_size({"IMAGE_SIZE": "1", "ABR_SIZES": "ALL"}) == max(image_sizes.IMAGE_SIZE_MAP)
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import pytest
+from result_export import FILE_EXTENSIONS, export_results, load_results, load_results_frame
+
+PARAMS = {"cpu": 1024, "ram": 2, "image_size": 1, "fps": 25, "video_type": "LIVE", "analysis_number": 3}
+
+
+@pytest.fixture
+def data():
+    frames = 50
+    frame_number = np.arange(100, 100 + frames)
+    frame_number[20:] += 3
+    return pd.DataFrame({"frame_number": frame_number, "frame_number_received": np.arange(frames),
+                         "frame_number_index_to_0": frame_number - 100,
+                         "time_generated": 1700000000.0 + np.arange(frames) * 0.04,
+                         "time_received": 1700000000.1 + np.arange(frames) * 0.04,
+                         "calculated_fps": np.full(frames, 25.0)})
+
+
+@pytest.mark.parametrize("output_format,delta_encode", [("npy", False), ("npy", True), ("parquet", False),
+                                                        ("feather", False)])
+def test_round_trip(tmp_path, data, output_format, delta_encode):
+    if output_format != "npy":
+        pytest.importorskip("pyarrow")
+    path = str(tmp_path / f"results{FILE_EXTENSIONS[output_format]}")
+    assert export_results(data, path, PARAMS, output_format=output_format, delta_encode=delta_encode) == path
+    columns, params = load_results(path)
+    assert params == PARAMS
+    assert list(columns) == list(data.columns)
+    for column in data.columns:
+        np.testing.assert_array_equal(columns[column], data[column].to_numpy())
+        assert columns[column].dtype == (np.int64 if column.startswith("frame_number") else np.float64)
+    frame = load_results_frame(path)
+    assert list(frame.columns) == list(data.columns)
+    np.testing.assert_array_equal(frame.to_numpy(), data.to_numpy())
+    assert frame.attrs["stream_params"] == PARAMS
+
+
+def test_unknown_format(tmp_path, data):
+    with pytest.raises(AssertionError):
+        export_results(data, str(tmp_path / "results.xlsx"), PARAMS, output_format="xlsx")
@@ -0,0 +1,49 @@
+import pytest
+from sliding_windows import SlidingWindowStats, WindowScheduler
+
+
+def test_windows_sum_their_buckets():
+    stats = SlidingWindowStats(windows=[1, 10])
+    for frame in range(50):
+        time_received = 100.0 + frame * 0.2
+        stats.record_frame(time_received)
+        stats.record_interval(time_received, 0.2, dropped=frame % 10 == 0)
+        stats.record_latency(time_received, 0.1 + frame * 0.001, jitter=0.001)
+    window = stats.snapshot(10, 110.0)
+    assert window.frames_received == 50
+    assert window.frames_dropped == 5
+    assert window.fps == 5.0
+    assert window.latency_max == pytest.approx(0.149)
+    assert window.interval_mean == pytest.approx(0.2)
+    assert stats.snapshot(1, 101.0).frames_received == 5
+    # The window of a stream that ended at 102.5 only covers 2.5 seconds of it
+    assert stats.snapshot(10, 110.0, until=102.5).fps == pytest.approx(20.0)
+
+
+def test_scheduler_runs_on_boundaries_and_skips_missed_ones():
+    calls = []
+    scheduler = WindowScheduler()
+    scheduler.add(10, lambda boundary, until=None: calls.append((boundary, until)), delay=2, now=103.0)
+    assert scheduler.next_deadline() == 112
+    scheduler.run_due(111.9)
+    assert calls == []
+    scheduler.run_due(112.0)
+    scheduler.run_due(150.0)
+    assert calls == [(110, None), (120, None)]
+    assert scheduler.next_deadline() == 152
+
+
+def test_flush_records_the_window_the_stream_ended_in():
+    calls = []
+    scheduler = WindowScheduler()
+    scheduler.add(10, lambda boundary, until=None: calls.append((boundary, until)), delay=2, now=103.0)
+    scheduler.flush(105.5)
+    assert calls == [(110, 105.5)]
+
+
+def test_flush_records_a_finished_window_that_did_not_run_yet():
+    calls = []
+    scheduler = WindowScheduler()
+    scheduler.add(10, lambda boundary, until=None: calls.append((boundary, until)), delay=2, now=103.0)
+    scheduler.flush(111.0)
+    assert calls == [(110, None), (120, 111.0)]
@@ -0,0 +1,77 @@
+import sqlite3
+import numpy as np
+import pandas as pd
+import pytest
+from stream_analysis import STREAM_DATA_COLUMNS, analyze_frames, read_analysis, summarize_analyses
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / "stream_data.db")
+    rows = []
+    # Analysis 1: frames 0-9 with 4 and 5 lost and 7 received twice, 40ms apart and 100ms latency
+    received = 0
+    for frame_number in [0, 1, 2, 3, 6, 7, 7, 8, 9]:
+        time_received = 1000.0 + received * 0.04
+        rows.append((frame_number, received, time_received - 0.1, time_received, 1))
+        received += 1
+    # Analysis 2: 6 frames without gaps, latency growing by 10ms per frame
+    for frame_number in range(6):
+        time_received = 2000.0 + frame_number * 0.05
+        rows.append((frame_number, frame_number, time_received - 0.2 - frame_number * 0.01, time_received, 2))
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE stream_data (frame_number INT, frame_number_received INT, time_generated FLOAT, "
+                       "time_received FLOAT, analysis_number INT)")
+    connection.executemany(f"INSERT INTO stream_data ({', '.join(STREAM_DATA_COLUMNS)}) VALUES (?,?,?,?,?)", rows)
+    connection.commit()
+    connection.close()
+    return path
+
+
+def test_summary(database):
+    summary = summarize_analyses(database)
+    assert summary.index.tolist() == [1, 2]
+    first, second = summary.loc[1], summary.loc[2]
+    assert first["frames"] == 9
+    assert (first["first_frame"], first["last_frame"]) == (0, 9)
+    assert first["frames_missing"] == 2
+    assert first["max_gap"] == 3
+    assert first["duplicate_frames"] == 1
+    assert first["latency_mean"] == pytest.approx(0.1)
+    assert first["avg_fps"] == pytest.approx(25.0)
+    assert second["frames"] == 6
+    assert second["frames_missing"] == 0
+    assert second["latency_min"] == pytest.approx(0.2)
+    assert second["latency_max"] == pytest.approx(0.25)
+    assert second["jitter_mean"] == pytest.approx(0.01)
+    assert second["interval_mean"] == pytest.approx(0.05)
+
+
+@pytest.mark.parametrize("chunksize", [1, 2, 4, 8, 9, 10])
+def test_chunk_boundaries_do_not_change_the_summary(database, chunksize):
+    expected = summarize_analyses(database, chunksize=1000)
+    summary = summarize_analyses(database, chunksize=chunksize)
+    pd.testing.assert_frame_equal(summary, expected, check_dtype=False)
+
+
+def test_selected_analyses(database):
+    summary = summarize_analyses(database, analysis_numbers=[2], chunksize=4)
+    assert summary.index.tolist() == [2]
+    assert summary.loc[2, "frames"] == 6
+
+
+def test_no_rows(database):
+    assert summarize_analyses(database, analysis_numbers=[3]).empty
+
+
+def test_frames_dropped_counts_against_insertion_order(database):
+    connection = sqlite3.connect(database)
+    # Recorded out of frame order, by decoders finishing in a different order than the frames were received
+    connection.executemany("INSERT INTO stream_data VALUES (?,?,?,?,?)",
+                           [(5, 0, 1.0, 1.1, 3), (3, 1, 1.0, 1.2, 3), (4, 2, 1.0, 1.3, 3), (8, 5, 1.0, 1.4, 3)])
+    data = analyze_frames(read_analysis(connection, 3))
+    connection.close()
+    assert data["frame_number"].tolist() == [3, 4, 5, 8]
+    assert data.index.tolist() == [1, 2, 0, 3]
+    assert data["frames_dropped"].tolist() == [0, 0, 0, 2]
+    assert data["frame_number_index_to_0"].tolist() == [0, 1, 2, 5]
@@ -0,0 +1,53 @@
+import importlib.util
+import os
+import numpy as np
+import pytest
+from timing_marker import MARKER_COLUMNS, crc8, read_marker
+
+# The server's encoder lives in src/ under the same module name as the client's decoder
+_spec = importlib.util.spec_from_file_location(
+    "server_timing_marker", os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src",
+                                         "timing_marker.py"))
+server_timing_marker = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(server_timing_marker)
+
+
+def _stamped_frame(frame_number: int, timestamp: float, width: int = 640, height: int = 360) -> np.ndarray:
+    frame = np.full((height, width, 3), 255, dtype=np.uint8)
+    return server_timing_marker.stamp_marker(frame, frame_number=frame_number, timestamp=timestamp)
+
+
+def test_crc8_matches_the_server():
+    for data in (b"", b"\x00", b"123456789", bytes(range(11))):
+        assert crc8(data) == server_timing_marker.crc8(data)
+    assert crc8(b"123456789") == 0xF4  # CRC-8/SMBUS check value
+
+
+def test_round_trip():
+    reading = read_marker(_stamped_frame(123456, 1700000000.123456))
+    assert reading is not None
+    assert reading.frame_number == 123456
+    assert reading.time == pytest.approx(1700000000.123456, abs=1e-6)
+    assert reading.confidence == 1.0
+
+
+def test_round_trip_grayscale():
+    frame = np.full((240, 426), 255, dtype=np.uint8)
+    server_timing_marker.stamp_marker(frame, frame_number=7, timestamp=12.5)
+    reading = read_marker(frame)
+    assert (reading.frame_number, reading.time) == (7, 12.5)
+
+
+def test_flipped_bit_fails_the_checksum():
+    frame = _stamped_frame(42, 1000.0)
+    x0, block = server_timing_marker.marker_geometry(frame.shape[1])
+    # Invert one block of the frame number
+    column = 10
+    area = frame[:block, x0 + column * block:x0 + (column + 1) * block]
+    area[...] = 255 - area
+    assert read_marker(frame) is None
+
+
+def test_frame_without_strip():
+    assert read_marker(np.full((360, 640, 3), 255, dtype=np.uint8)) is None
+    assert read_marker(np.zeros((10, MARKER_COLUMNS * 2, 3), dtype=np.uint8)) is None
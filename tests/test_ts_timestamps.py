@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from ts_timestamps import PTS_CLOCK, TS_PACKET_SIZE, frame_gaps, read_ts_timestamps
+
+VIDEO_PID = 0x100
+
+
+def _pes_header(pts: int) -> bytes:
+    return bytes([0x00, 0x00, 0x01, 0xE0, 0x00, 0x00, 0x80, 0x80, 0x05,
+                  0x21 | ((pts >> 29) & 0x0E), (pts >> 22) & 0xFF, ((pts >> 14) & 0xFE) | 1, (pts >> 7) & 0xFF,
+                  ((pts << 1) & 0xFE) | 1])
+
+
+def _ts_packet(pts: int, keyframe: bool = False, pid: int = VIDEO_PID) -> bytes:
+    header = bytes([0x47, 0x40 | (pid >> 8), pid & 0xFF])
+    if keyframe:
+        # Adaptation field of one byte with the random access indicator set, then the payload
+        header += bytes([0x30, 0x01, 0x40])
+    else:
+        header += bytes([0x10])
+    packet = header + _pes_header(pts)
+    return packet + b"\xff" * (TS_PACKET_SIZE - len(packet))
+
+
+def test_reads_pts_and_keyframes():
+    data = _ts_packet(90000, keyframe=True) + _ts_packet(93600) + _ts_packet(97200)
+    timestamps = read_ts_timestamps(data)
+    assert timestamps.pts == pytest.approx([1.0, 1.04, 1.08])
+    assert timestamps.keyframes.tolist() == [True, False, False]
+
+
+def test_frames_are_returned_in_presentation_order():
+    data = _ts_packet(0, keyframe=True) + _ts_packet(3 * 3600) + _ts_packet(3600) + _ts_packet(2 * 3600)
+    timestamps = read_ts_timestamps(data)
+    assert timestamps.pts * PTS_CLOCK == pytest.approx([0, 3600, 7200, 10800])
+    assert timestamps.keyframes.tolist() == [True, False, False, False]
+
+
+def test_leading_garbage_and_other_pids_are_skipped():
+    data = b"\x00\x01" + _ts_packet(90000) + _ts_packet(180000, pid=0x101)
+    assert read_ts_timestamps(data).pts == pytest.approx([1.0])
+
+
+def test_not_mpeg_ts():
+    timestamps = read_ts_timestamps(b"#EXTM3U\n")
+    assert timestamps.pts.size == 0
+    assert timestamps.keyframes.size == 0
+
+
+def test_frame_gaps():
+    assert frame_gaps(np.array([0.0, 0.04, 0.08, 0.2, 0.24])).tolist() == [0, 0, 2, 0]
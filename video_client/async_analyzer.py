@@ -0,0 +1,232 @@
+import argparse
+import asyncio
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import List, Optional
+from capture import CapturedFrame, CaptureWindow
+from client_cv import StreamAnalyzer, DEFAULT_MAX_IN_FLIGHT
+from db_writer import DatabaseWriter
+from frame_recorder import FrameDict, MARKER_QR, MARKER_STRIP
+from hls_ingest import INGEST_MODES, INGEST_OPENCV
+from metrics_server import MetricsServer
+from sliding_windows import WindowScheduler
+from stage_profiler import STAGE_QUEUE_WAIT
+from stream_analysis import summarize_analyses
+
+
+class AsyncStreamAnalyzer:
+    """
+    Runs a StreamAnalyzer as asyncio tasks instead of a capture thread, executor callbacks and timers in the capture
+    loop:
+    * capture: reads frames with a `capture.FrameReader` on a one thread executor, since VideoCapture blocks, and puts
+      them on a bounded asyncio queue. A full queue holds up reading, like the block overflow policy
+    * dispatch: takes frames off the queue and decodes them on the decode executor, at most `max_in_flight` at once
+    * stats: gets the decoded frames in the order they finish and adds them to the analyzer's statistics
+    * windows: runs the analyzer's `WindowScheduler` from the loop, writing the summary statistics and sliding windows
+      on their wall-clock boundaries
+    The stream params are fetched on the loop's default executor. Many analyzers can run on one loop and share a
+    decode executor and database writer, see `run_streams`. The analyzer's database tables, statistics, decode cache
+    and frame pool are used as they are, only the scheduling differs.
+    """
+
+    def __init__(self, analyzer: StreamAnalyzer, record_params: bool = False,
+                 max_in_flight: int = DEFAULT_MAX_IN_FLIGHT):
+        """
+        :param analyzer: created with `record_params=False`, the params are fetched by `run` when `record_params` is set
+        :param max_in_flight: most frames of this stream being decoded at once
+        """
+        if analyzer.decode_processes:
+            raise AssertionError("The asyncio pipeline decodes on threads, decode processes are not supported")
+        self.analyzer = analyzer
+        self.record_params = record_params
+        self.max_in_flight = analyzer.max_in_flight or max_in_flight
+        self._reader = None
+        self._stopping = False
+        self._queue_window = CaptureWindow()
+
+    def stop(self) -> None:
+        """
+        Makes a running `run` finish after the frames it already read, can be called from a signal handler
+        """
+        self._stopping = True
+        if self._reader is not None:
+            self._reader.stop()
+
+    async def run(self, limit_frames: int = None, executor: ThreadPoolExecutor = None) -> None:
+        """
+        Records the stream until `limit_frames` frames were read, the stream ends or `stop` is called
+        :param executor: decode executor, the analyzer's own (or a new one with 10 threads) if not given
+        """
+        analyzer = self.analyzer
+        loop = asyncio.get_running_loop()
+        if self.record_params:
+            await loop.run_in_executor(None, analyzer.insert_params)
+        owns_executor = executor is None and analyzer.executor is None
+        executor = executor or analyzer.executor or ThreadPoolExecutor(max_workers=10)
+        capture_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"capture-{analyzer.analysis_number}")
+        video_capture = await loop.run_in_executor(capture_executor, analyzer.open_capture)
+        self._reader = analyzer.frame_reader(video_capture, limit_frames=limit_frames)
+        if self._stopping:
+            self._reader.stop()
+        frames: asyncio.Queue = asyncio.Queue(maxsize=analyzer.queue_size)
+        analyzer.queue_depth = frames.qsize
+        decoded: asyncio.Queue = asyncio.Queue()
+        scheduler = analyzer.window_scheduler(self._take_queue_window)
+        windows = asyncio.create_task(self._record_windows(scheduler))
+        try:
+            await asyncio.gather(self._capture(capture_executor, frames), self._dispatch(executor, frames, decoded),
+                                 self._collect(decoded))
+        finally:
+            windows.cancel()
+            self._reader.stop()
+            await loop.run_in_executor(capture_executor, video_capture.release)
+            capture_executor.shutdown(wait=True)
+            if owns_executor:
+                executor.shutdown(wait=True)
+        scheduler.flush(time.time())
+        await loop.run_in_executor(None, analyzer.db_writer.flush)
+        analyzer.print_decode_summary()
+
+    async def _capture(self, capture_executor: ThreadPoolExecutor, frames: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        reader = self._reader
+        try:
+            while not reader.finished:
+                captured = await loop.run_in_executor(capture_executor, reader.read)
+                if captured is None:
+                    continue
+                captured.enqueued_at = time.monotonic()
+                await frames.put(captured)
+                if not self.analyzer.sampled:
+                    self.analyzer.count_frame(captured.time_received)
+                depth = frames.qsize()
+                self._queue_window.depth_total += depth
+                self._queue_window.depth_samples += 1
+                self._queue_window.max_depth = max(self._queue_window.max_depth, depth)
+        finally:
+            await frames.put(None)
+
+    async def _dispatch(self, executor: ThreadPoolExecutor, frames: asyncio.Queue, decoded: asyncio.Queue) -> None:
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        decodes: List[asyncio.Task] = []
+        while True:
+            captured: Optional[CapturedFrame] = await frames.get()
+            if captured is None:
+                break
+            self._queue_window.wait.record(time.monotonic() - captured.enqueued_at)
+            if self.analyzer.profiler is not None:
+                self.analyzer.profiler.record(STAGE_QUEUE_WAIT, time.monotonic() - captured.enqueued_at)
+                self.analyzer.profiler.frame_shape = captured.frame.shape
+            await in_flight.acquire()
+            decodes = [task for task in decodes if not task.done()]
+            decodes.append(asyncio.create_task(self._decode(executor, captured, in_flight, decoded)))
+        await asyncio.gather(*decodes)
+        await decoded.put(None)
+
+    async def _decode(self, executor: ThreadPoolExecutor, captured: CapturedFrame, in_flight: asyncio.Semaphore,
+                      decoded: asyncio.Queue) -> None:
+        analyzer = self.analyzer
+        frame_recorder = analyzer.frame_recorder(captured)
+        try:
+            frame_dict = await asyncio.get_running_loop().run_in_executor(
+                executor, partial(frame_recorder.process_frame, db_writer=analyzer.db_writer,
+                                  table_name=analyzer.table_name, qr_locator=analyzer.qr_locator,
+                                  decode_cache=analyzer.decode_cache, profiler=analyzer.profiler,
+                                  submitted_at=time.perf_counter()))
+            await decoded.put(frame_dict)
+        except Exception as e:
+            print(f"Frame {captured.frame_received_counter} could not be decoded: {e}")
+        finally:
+            analyzer.release_frame(captured)
+            in_flight.release()
+
+    async def _collect(self, decoded: asyncio.Queue) -> None:
+        while True:
+            frame_dict: Optional[FrameDict] = await decoded.get()
+            if frame_dict is None:
+                return
+            self.analyzer.add_frame_stats(frame_dict)
+
+    def _take_queue_window(self) -> CaptureWindow:
+        queue_window, self._queue_window = self._queue_window, CaptureWindow()
+        return queue_window
+
+    async def _record_windows(self, scheduler: WindowScheduler) -> None:
+        while True:
+            await asyncio.sleep(max(scheduler.next_deadline() - time.time(), 0))
+            scheduler.run_due(time.time())
+
+
+async def run_streams(analyzers: List[AsyncStreamAnalyzer], limit_frames: int = None, decode_workers: int = 10,
+                      handle_interrupt: bool = True) -> None:
+    """
+    Runs several streams on the current event loop with one shared decode executor
+    :param handle_interrupt: stop every stream cleanly on Ctrl-C instead of cancelling them
+    """
+    loop = asyncio.get_running_loop()
+    if handle_interrupt:
+        loop.add_signal_handler(signal.SIGINT, lambda: [analyzer.stop() for analyzer in analyzers])
+    try:
+        with ThreadPoolExecutor(max_workers=decode_workers) as executor:
+            await asyncio.gather(*[analyzer.run(limit_frames=limit_frames, executor=executor)
+                                   for analyzer in analyzers])
+    finally:
+        if handle_interrupt:
+            loop.remove_signal_handler(signal.SIGINT)
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-ips", "--ip-addresses", nargs="+", required=True, help="Ip addresses of the streams")
+    parser.add_argument("-f", "--frame-limit", type=int, default=10000,
+                        help="How many frames to record from each stream, default is 10,000")
+    parser.add_argument("-d", "--database", default="stream_data.db", help="SQLite database to record to")
+    parser.add_argument("-w", "--decode-workers", type=int, default=10, help="Threads in the shared decode pool")
+    parser.add_argument("-m", "--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT,
+                        help="Most frames a single stream may have being decoded at once")
+    parser.add_argument("-r", "--record-params", action="store_true",
+                        help="Fetch the stream params from every server")
+    parser.add_argument("-tm", "--timing-marker", choices=[MARKER_QR, MARKER_STRIP], default=MARKER_QR,
+                        help="How the servers stamp frames: a QR code or a block strip (server TIMING_MARKER=STRIP)")
+    parser.add_argument("-i", "--ingest", choices=INGEST_MODES, default=INGEST_OPENCV,
+                        help="opencv reads the playlist with cv2.VideoCapture, hls downloads segments itself")
+    parser.add_argument("-mp", "--metrics-port", type=int,
+                        help="Serve live metrics of every stream on this port, at /metrics and /metrics.json")
+    parser.add_argument("-pr", "--profile", action="store_true",
+                        help="Time every stage of the pipeline per frame into stage_timings, see stage_profiler.py")
+    parser.add_argument("-o", "--outfile", help="Write the per stream summary to this csv file")
+    return parser
+
+
+def main() -> None:
+    args = get_parser().parse_args()
+    db_writer = DatabaseWriter(args.database)
+    db_writer.start()
+    analyzers = []
+    for ip_address in args.ip_addresses:
+        analysis_number = analyzers[-1].analyzer.analysis_number + 1 if analyzers else None
+        analyzer = StreamAnalyzer(ip_address=ip_address, database_name=args.database, record_params=False,
+                                  timing_marker=args.timing_marker, db_writer=db_writer,
+                                  analysis_number=analysis_number, max_in_flight=args.max_in_flight,
+                                  ingest=args.ingest, profile=args.profile)
+        analyzers.append(AsyncStreamAnalyzer(analyzer, record_params=args.record_params))
+    if args.metrics_port is not None:
+        metrics_server = MetricsServer(port=args.metrics_port)
+        for analyzer in analyzers:
+            metrics_server.register(analyzer.analyzer)
+        metrics_server.start()
+    try:
+        asyncio.run(run_streams(analyzers, limit_frames=args.frame_limit, decode_workers=args.decode_workers))
+    finally:
+        db_writer.close()
+    summary = summarize_analyses(args.database, analysis_numbers=[analyzer.analyzer.analysis_number
+                                                                  for analyzer in analyzers])
+    print(summary.to_string())
+    if args.outfile:
+        summary.to_csv(args.outfile)
+
+
+if __name__ == '__main__':
+    main()
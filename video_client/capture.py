@@ -0,0 +1,316 @@
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Optional, Tuple
+import cv2
+from numpy import ndarray
+from frame_pool import FramePool
+from histogram import LogHistogram
+from stage_profiler import STAGE_GRAB, STAGE_RETRIEVE, StageProfiler
+
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_OLDEST = "drop-oldest"
+OVERFLOW_EVERY_NTH = "every-nth"
+OVERFLOW_POLICIES = [OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_EVERY_NTH]
+# How long reads of a live stream may keep failing before the recording ends. Long enough to ride out a playlist
+# reload stall or a missing segment, several target durations of a live HLS stream. A stream that reports its end
+# stops right away
+DEFAULT_READ_FAILURE_TIMEOUT = 30.0
+# Longest pause between two reads that failed, the pause grows by 10ms with every failure in a row
+MAX_READ_FAILURE_SLEEP = 0.5
+
+
+@dataclass
+class CapturedFrame:
+    """
+    A frame read by the capture thread, waiting to be decoded
+    """
+    frame: ndarray
+    frame_received_counter: int
+    time_received: float
+    enqueued_at: float
+
+
+class CaptureWindow:
+    """
+    Queue statistics since the last summary was recorded. `frames_dropped` are frames the analyzer threw away because
+    it could not keep up, they are not counted as dropped by the stream
+    """
+    __slots__ = ("max_depth", "depth_total", "depth_samples", "wait", "frames_dropped")
+
+    def __init__(self):
+        self.max_depth = 0
+        self.depth_total = 0
+        self.depth_samples = 0
+        self.wait = LogHistogram()
+        self.frames_dropped = 0
+
+    def average_depth(self) -> float:
+        if not self.depth_samples:
+            return 0
+        return self.depth_total / self.depth_samples
+
+
+class FrameQueue:
+    """
+    Bounded queue between the capture thread and the decoders. What happens when it is full depends on the policy:
+    * block: the capture thread waits, nothing is dropped but the stream backs up in front of the client
+    * drop-oldest: the oldest waiting frame is dropped to make room
+    * every-nth: once the queue is half full only every `every_nth` frame is let in, and new frames are dropped when
+      it is completely full
+    """
+
+    def __init__(self, maxsize: int = 64, policy: str = OVERFLOW_BLOCK, every_nth: int = 2,
+                 on_drop: Callable[[CapturedFrame], None] = None):
+        """
+        :param on_drop: called with every frame dropped because of the policy, i.e. to give its buffer back
+        """
+        if policy not in OVERFLOW_POLICIES:
+            raise AssertionError(f"Unknown overflow policy {policy}, expected one of {OVERFLOW_POLICIES}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.every_nth = every_nth
+        self.on_drop = on_drop
+        self._frames: Deque[CapturedFrame] = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._offered = 0
+        self.window = CaptureWindow()
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def _record_depth(self) -> None:
+        depth = len(self._frames)
+        window = self.window
+        window.depth_total += depth
+        window.depth_samples += 1
+        if depth > window.max_depth:
+            window.max_depth = depth
+
+    def put(self, item: CapturedFrame) -> bool:
+        """
+        :return: False if the frame was dropped because of the overflow policy
+        """
+        dropped = None
+        with self._condition:
+            self._offered += 1
+            if self.policy == OVERFLOW_BLOCK:
+                self._condition.wait_for(lambda: len(self._frames) < self.maxsize or self._closed)
+            elif self.policy == OVERFLOW_DROP_OLDEST:
+                if len(self._frames) >= self.maxsize:
+                    dropped = self._frames.popleft()
+                    self.window.frames_dropped += 1
+            elif len(self._frames) >= self.maxsize or \
+                    (len(self._frames) >= self.maxsize // 2 and self._offered % self.every_nth != 0):
+                self.window.frames_dropped += 1
+                dropped = item
+            if self._closed:
+                dropped = item
+            elif dropped is not item:
+                item.enqueued_at = time.monotonic()
+                self._frames.append(item)
+                self._record_depth()
+                self._condition.notify_all()
+        if dropped is not None and self.on_drop is not None:
+            self.on_drop(dropped)
+        return dropped is not item
+
+    def get(self, timeout: float = None) -> Optional[CapturedFrame]:
+        """
+        :return: the oldest frame, or None if nothing arrived within the timeout or the queue is closed and empty
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._frames or self._closed, timeout=timeout):
+                return None
+            if not self._frames:
+                return None
+            item = self._frames.popleft()
+            self.window.wait.record(time.monotonic() - item.enqueued_at)
+            self._condition.notify_all()
+            return item
+
+    def close(self) -> None:
+        """
+        No more frames will be put in. Frames still waiting can be taken with `get`
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def finished(self) -> bool:
+        """
+        True once the queue is closed and every frame has been taken out
+        """
+        return self._closed and not self._frames
+
+    def take_window(self) -> CaptureWindow:
+        with self._condition:
+            window, self.window = self.window, CaptureWindow()
+        return window
+
+
+# Called for every frame with frame_number_received, time_received, presentation timestamp in seconds (-1 if not
+# known), whether it is a keyframe (None if not known) and whether it was sampled for QR decoding
+TimestampCallback = Callable[[int, float, float, Optional[bool], bool], None]
+
+
+class FrameReader:
+    """
+    Reads one frame at a time from a VideoCapture: numbers and timestamps it when it comes off the stream, decides
+    whether it is sampled and reads it into a pool buffer. Shared by the `CaptureThread` and the asyncio pipeline.
+
+    With `sample_every` or `sample_keyframes` only some frames are retrieved, every other frame is only grabbed and
+    reported to `on_timestamp` with its container timestamp. With an `hls_ingest.HLSIngester` frames that are only
+    grabbed are never decoded.
+    """
+
+    def __init__(self, video_capture: cv2.VideoCapture, limit_frames: int = None,
+                 read_failure_timeout: float = DEFAULT_READ_FAILURE_TIMEOUT, sample_every: int = 1,
+                 sample_keyframes: bool = False, on_timestamp: TimestampCallback = None, frame_pool: FramePool = None,
+                 profiler: StageProfiler = None):
+        """
+        :param read_failure_timeout: seconds reads of a live stream may keep failing in a row before the recording
+        ends. A stream that ended (see `end_of_stream`) ends the recording at its first failed read
+        :param sample_every: retrieve every nth frame
+        :param sample_keyframes: retrieve keyframes instead, needs a capture that knows them (`HLSIngester`)
+        :param frame_pool: frames are read into buffers leased from this pool, whoever ends up with a frame gives its
+        buffer back
+        :param profiler: times grabbing and retrieving every frame if set
+        """
+        self.video_capture = video_capture
+        self.limit_frames = limit_frames
+        self.read_failure_timeout = read_failure_timeout
+        self.sample_every = sample_every
+        self.sample_keyframes = sample_keyframes
+        self.on_timestamp = on_timestamp
+        self.frame_pool = frame_pool
+        self.profiler = profiler
+        self.frames_read = 0
+        self.finished = False
+        self._read_failures = 0
+        self._failing_since = 0.0
+        self._stop_requested = threading.Event()
+
+    def stop(self) -> None:
+        self._stop_requested.set()
+        self.finished = True
+
+    def end_of_stream(self) -> bool:
+        """
+        True if the capture ran out of frames: an `HLSIngester` past the last segment of a finished playlist, or a file
+        or VOD source that read as many frames as it has. Live sources report no frame count and never end here
+        """
+        end_of_stream = getattr(self.video_capture, "end_of_stream", None)
+        if end_of_stream is not None:
+            return end_of_stream
+        frame_count = self.video_capture.get(cv2.CAP_PROP_FRAME_COUNT)
+        return frame_count > 0 and self.video_capture.get(cv2.CAP_PROP_POS_FRAMES) >= frame_count
+
+    def _retrieve(self) -> Tuple[bool, Optional[ndarray]]:
+        if self.frame_pool is None:
+            return self.video_capture.retrieve()
+        buffer = None
+        while not self._stop_requested.is_set() and self.frame_pool.frame_shape is not None:
+            buffer = self.frame_pool.acquire(timeout=1.0)
+            if buffer is not None:
+                break
+        ret, frame = self.video_capture.retrieve(buffer) if buffer is not None else self.video_capture.retrieve()
+        if not ret or frame is None:
+            self.frame_pool.release(buffer)
+        elif frame is not buffer:
+            # First frame, or the resolution changed
+            self.frame_pool.release(buffer)
+            self.frame_pool.adopt(frame)
+        return ret, frame
+
+    def read(self) -> Optional[CapturedFrame]:
+        """
+        Reads the next frame. Blocks until the stream has one
+        :return: the frame, or None if it was not sampled or could not be read. `finished` is set once the frame
+        limit is reached, the stream ended or reads kept failing for `read_failure_timeout`
+        """
+        grab_start = time.perf_counter()
+        ret = self.video_capture.grab()
+        time_received = time.time()
+        if self.profiler is not None:
+            self.profiler.record(STAGE_GRAB, time.perf_counter() - grab_start)
+        self.frames_read += 1
+        if self.limit_frames is not None and self.frames_read > self.limit_frames:
+            print("Ending frames recording")
+            self.finished = True
+            return None
+        frame = None
+        if ret:
+            # cv2.VideoCapture has no keyframe property, only the HLSIngester knows them
+            keyframe = getattr(self.video_capture, "frame_keyframe", None)
+            sampled = bool(keyframe) if self.sample_keyframes else self.frames_read % self.sample_every == 0
+            if self.on_timestamp is not None:
+                self.on_timestamp(self.frames_read, time_received,
+                                  self.video_capture.get(cv2.CAP_PROP_POS_MSEC) / 1000, keyframe, sampled)
+            if not sampled:
+                self._read_failures = 0
+                return None
+            retrieve_start = time.perf_counter()
+            ret, frame = self._retrieve()
+            if self.profiler is not None:
+                self.profiler.record(STAGE_RETRIEVE, time.perf_counter() - retrieve_start)
+        if not ret or frame is None:
+            if self.end_of_stream():
+                print(f"End of stream after {self.frames_read - 1} frames, ending frames recording")
+                self.finished = True
+                return None
+            if not self._read_failures:
+                self._failing_since = time.monotonic()
+            self._read_failures += 1
+            print(f"Frame dropped! Frame number {self.frames_read}")
+            failing_for = time.monotonic() - self._failing_since
+            if failing_for >= self.read_failure_timeout:
+                print(f"{self._read_failures} reads in a row failed over {failing_for:.1f}s, ending frames recording")
+                self.finished = True
+            else:
+                time.sleep(min(0.01 * self._read_failures, MAX_READ_FAILURE_SLEEP))
+            return None
+        self._read_failures = 0
+        return CapturedFrame(frame=frame, frame_received_counter=self.frames_read, time_received=time_received,
+                             enqueued_at=0.0)
+
+
+class CaptureThread(threading.Thread):
+    """
+    Reads frames from a VideoCapture as fast as they arrive and puts them on a FrameQueue, so slow decoding never
+    delays reading the stream. See `FrameReader` for the parameters
+    """
+
+    def __init__(self, video_capture: cv2.VideoCapture, frame_queue: FrameQueue, limit_frames: int = None,
+                 read_failure_timeout: float = DEFAULT_READ_FAILURE_TIMEOUT, sample_every: int = 1,
+                 sample_keyframes: bool = False,
+                 on_timestamp: TimestampCallback = None, frame_pool: FramePool = None,
+                 profiler: StageProfiler = None):
+        super().__init__(daemon=True, name="capture")
+        self.frame_queue = frame_queue
+        self.reader = FrameReader(video_capture, limit_frames=limit_frames, read_failure_timeout=read_failure_timeout,
+                                  sample_every=sample_every, sample_keyframes=sample_keyframes,
+                                  on_timestamp=on_timestamp, frame_pool=frame_pool, profiler=profiler)
+
+    @property
+    def frames_read(self) -> int:
+        return self.reader.frames_read
+
+    def stop(self) -> None:
+        self.reader.stop()
+        self.frame_queue.close()
+
+    def run(self) -> None:
+        try:
+            while not self.reader.finished:
+                captured = self.reader.read()
+                if captured is not None:
+                    self.frame_queue.put(captured)
+        finally:
+            self.frame_queue.close()
@@ -1,95 +1,91 @@
 import cv2
+import numpy as np
 import pandas as pd
 import time
 import sqlite3
-from typing import List
-from concurrent.futures import ThreadPoolExecutor
+import threading
+from typing import Callable, Dict, List, Optional, Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
 import argparse
 import datetime
 import requests
 from aws_utils import get_public_ip_ecs_task_by_id, DEFAULT_CLUSTER, stop_task_by_id
-from frame_recorder import FrameRecorder, FrameDict
+from frame_recorder import FrameRecorder, FrameDict, MARKER_QR, MARKER_STRIP
+from capture import CapturedFrame, CaptureThread, CaptureWindow, FrameReader, FrameQueue, OVERFLOW_BLOCK, OVERFLOW_POLICIES, \
+    DEFAULT_READ_FAILURE_TIMEOUT, TimestampCallback
+from db_writer import DatabaseWriter
+from decode_pool import ProcessDecodePool
+from frame_cache import DecodeCache
+from frame_pairing import FramePairingEngine
+from frame_pool import FramePool, FramePoolWindow
+from histogram import LogHistogram
+from hls_ingest import HLSIngester, INGEST_HLS, INGEST_MODES, INGEST_OPENCV, create_segment_timings_table, \
+    resolve_variant_url
+from ts_timestamps import FRAME_TIMESTAMPS_TABLE, create_frame_timestamps_table
+from recording import StreamRecorder
+from result_export import EXPORT_FORMATS, FILE_EXTENSIONS, export_results, read_stream_params
+from stream_analysis import analyze_frames, create_stream_data_index, read_analysis, summarize_analyses
+from metrics_server import MetricsServer
+from stage_profiler import STAGE_QUEUE_WAIT, STAGE_STATS, STAGE_TIMINGS_TABLE, StageProfiler, create_stage_timings_table
+from qr_locator import QRLocator, LocatorStats
+from sliding_windows import DEFAULT_WINDOWS, WINDOWS_TABLE, SlidingWindowStats, WindowScheduler, create_windows_table
 
 new_url = "10.110.126.188"
+DEFAULT_MAX_IN_FLIGHT = 16
 DEFAULT_VIDEO_URL = f"http://{new_url}:5000/video/stream.m3u8"
 
-# Global variables
-FRAMES_BUFFER = {}
-COUNT_FRAMES_DROPPED = 0
-ROLLING_LATENCY = []
-CALCULATED_FPS = []
-FRAMES_COUNTED = 0
-PROCESSED_FRAMES = set()
+def print_state(record_period_serconds: float, frames_counter: int, frame_stats: FramePairingEngine,
+                db_writer: DatabaseWriter = None, locator_stats: LocatorStats = None, decode_cache: DecodeCache = None):
+    print(f"size frame buffer: {frame_stats.buffered_frames()}")
+    if db_writer is not None:
+        print(f"DB rows queued: {db_writer.rows_queued} flushed: {db_writer.rows_flushed} failed: {db_writer.rows_failed} "
+              f"backlog: {db_writer.backlog}")
+    if locator_stats is not None:
+        print(f"QR locator hit rates: {locator_stats.summary()}")
+    if decode_cache is not None:
+        print(f"Decode cache: {decode_cache.summary()}")
+    window = frame_stats.window
+    if window.frames_counted != 0:
+        fps = frames_counter / record_period_serconds
+        print(f"FRAMES_COUTED: {window.frames_counted} RECORD_PERIOD {record_period_serconds}")
+        print(f"Total fps: {fps} Total Latency: {window.average_latency()}")
+
+HISTOGRAM_NAMES = ["latency", "interval", "decode"]
+PERCENTILES = {"p50": 50, "p90": 90, "p99": 99}
+# Columns added to stream_data_final after it was first created, older databases get them added on start up
+FINAL_EXTRA_COLUMNS: Dict[str, str] = {
+    **{f"{name}_{label}": "FLOAT" for name in HISTOGRAM_NAMES for label in [*PERCENTILES, "max"]},
+    **{f"{name}_histogram": "TEXT" for name in HISTOGRAM_NAMES},
+    "queue_depth_max": "INT", "queue_depth_avg": "FLOAT", "queue_wait_p50": "FLOAT", "queue_wait_p99": "FLOAT",
+    "analyzer_frames_dropped": "INT", "frames_repeated": "INT", "decode_cache_hits": "INT", "decode_cache_misses": "INT",
+    "frame_pool_buffers": "INT", "frame_pool_max_leased": "INT", "frame_pool_exhausted": "INT",
+    "frame_pool_wait_p99": "FLOAT"
+}
+
+
+def next_analysis_number(cursor: sqlite3.Cursor) -> int:
+    """
+    :return: the analysis number after the highest one recorded in `stream_data`
+    """
+    sql = "SELECT max(analysis_number) from stream_data"
+    data = cursor.execute(sql).fetchall()[0][0]
+    if data is None:
+        return 0
+    return data + 1
 
 
-def handler(future):
-    data: FrameDict = future.result()
-    if data is None:
-        return
-    frame_number = data.frame_number_received
-    FRAMES_BUFFER[frame_number] = data
-    if frame_number != 0 and frame_number - 1 in FRAMES_BUFFER:
-        calculate_statistics(FRAMES_BUFFER[frame_number - 1], data)
-    if frame_number + 1 in FRAMES_BUFFER:
-        calculate_statistics(data, FRAMES_BUFFER[frame_number + 1])
-    for frame in [frame_number - 1, frame_number, frame_number + 1]:
-        delete_if_done(frame)
-        delete_trailing_frame_buffers(frame_number)
-
-def delete_trailing_frame_buffers(frame_number: int, trailing_period: int = 20) -> None:
+def add_missing_columns(cursor: sqlite3.Cursor, table_name: str, columns: Dict[str, str]) -> None:
     """
-    This attempts to remove old frames from frame buffer, without interfering with anything
-    :param trailing_period:
-    :return:
+    Adds columns that are missing from an existing table, so databases from older runs keep working
+    :param columns: column name -> sql type
     """
-    frame_cutoff = frame_number - trailing_period
-    if frame_cutoff < 0:
-        return
-    frame_numbers = list(FRAMES_BUFFER.keys())
-    for frame_number in frame_numbers:
-        if frame_number <= frame_cutoff:
-            del FRAMES_BUFFER[frame_number]
-
-
-
-
-def delete_if_done(frame_number):
-    neighbor_left = frame_number - 1 in FRAMES_BUFFER or frame_number == 0
-    neighbor_right = frame_number + 1 in FRAMES_BUFFER
-    if neighbor_left and neighbor_right and frame_number in FRAMES_BUFFER:
-        del FRAMES_BUFFER[frame_number]
-
-
-def calculate_statistics(frame1: FrameDict, frame2: FrameDict):
-    global COUNT_FRAMES_DROPPED
-    global ROLLING_LATENCY
-    global CALCULATED_FPS
-    global FRAMES_COUNTED
-    if frame1.frame_number == frame2.frame_number_received:
-        print("Identical frame numbers, skipping")
-        return
-    if frame1.frame_number != frame2.frame_number - 1:
-        COUNT_FRAMES_DROPPED += 1
-    difference_between_frame_times = frame2.time_received - frame1.time_received
-    if difference_between_frame_times != 0:
-        calculated_fps = 1 / difference_between_frame_times
-        if calculated_fps <= 100:
-            CALCULATED_FPS.append(calculated_fps)
-    latency = frame1.time_received - frame1.time_generated
-    FRAMES_COUNTED += 1
-    if not frame1.is_error_frame():
-        ROLLING_LATENCY.append(latency)
-
-def print_state(record_period_serconds: int, frames_counter: int):
-    print(f"size frame buffer: {len(FRAMES_BUFFER)}")
-    if FRAMES_COUNTED != 0:
-        try:
-            fps = frames_counter / record_period_serconds
-            print(f"FRAMES_COUTED: {FRAMES_COUNTED} RECORD_PERIOD {record_period_serconds}")
-            latency = sum(ROLLING_LATENCY) / len(ROLLING_LATENCY)
-            print(f"Total fps: {fps} Total Latency: {latency}")
-        except ZeroDivisionError as e:
-            return
+    existing = {row[1] for row in cursor.execute(f"PRAGMA table_info({table_name})").fetchall()}
+    for column, column_type in columns.items():
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {column} {column_type}")
+
 
 class StreamAnalyzer:
     """
@@ -100,17 +96,104 @@ class StreamAnalyzer:
                     "random"]
 
     def __init__(self, ip_address: str = DEFAULT_VIDEO_URL, database_name="stream_data.db",
-                 table_name: str = "stream_data", port: int = 5000, record_params: bool = True, record_period_seconds: int = 10):
+                 table_name: str = "stream_data", port: int = 5000, record_params: bool = True, record_period_seconds: int = 10,
+                 decode_processes: int = 0, timing_marker: str = MARKER_QR, db_writer: DatabaseWriter = None,
+                 executor: ThreadPoolExecutor = None, analysis_number: int = None, max_in_flight: int = None,
+                 queue_size: int = 64, overflow_policy: str = OVERFLOW_BLOCK, every_nth: int = 2,
+                 ingest: str = INGEST_OPENCV, stream_url: str = None, prefetch: int = 3, sample_every: int = None,
+                 sample_keyframes: bool = False, decode_cache_size: int = 32, frame_pool_size: int = None,
+                 sliding_windows: Sequence[float] = DEFAULT_WINDOWS, settle_seconds: float = 2.0, profile: bool = False,
+                 record_dir: str = None, variant: str = None, blocking_reload: bool = False,
+                 read_failure_timeout: float = DEFAULT_READ_FAILURE_TIMEOUT):
+        """
+        :param db_writer: writer to share with other analyzers, a new one is started if not given
+        :param executor: decode pool to share with other analyzers, each recording gets its own pool if not given
+        :param analysis_number: use this analysis number instead of the next free one in the database
+        :param max_in_flight: most frames this stream may have waiting for or in decoding at once. The capture loop
+        waits when it is reached, so a stream that falls behind cannot crowd others out of a shared pool
+        :param queue_size: frames that can wait between the capture thread and the decoders
+        :param overflow_policy: what to do when that queue is full, one of `capture.OVERFLOW_POLICIES`
+        :param every_nth: for the every-nth policy, which frames are still let in once the queue is half full
+        :param ingest: `INGEST_OPENCV` hands the playlist to `cv2.VideoCapture`, `INGEST_HLS` downloads and decodes the
+        segments itself with `hls_ingest.HLSIngester` and records when each segment was listed, downloaded and decoded
+        :param stream_url: playlist to read instead of the server's, for `INGEST_HLS` it may be a local directory
+        :param prefetch: segments `INGEST_HLS` downloads in parallel
+        :param sample_every: only QR decode every nth frame. FPS and drops are measured from the container timestamps
+        of every frame instead (`frame_timestamps` table), latency from the decoded frames
+        :param sample_keyframes: same, but QR decode the keyframes. Needs `INGEST_HLS`
+        :param decode_cache_size: frames to remember by fingerprint so repeated frames are not decoded again, 0 turns
+        the cache off
+        :param frame_pool_size: most frame buffers to read frames into, frames wait for a buffer once they are all in
+        use. By default enough for a full capture queue plus what the decoders hold, 0 allocates every frame instead
+        :param sliding_windows: lengths in seconds of the windows recorded to `stream_data_windows`, each is written
+        every time a wall-clock multiple of its length passes
+        :param settle_seconds: how long after a window ends it is written, so frames still being decoded count in it
+        :param profile: time every stage of every frame and record the histograms to `stage_timings` with the summary
+        statistics, see `stage_profiler.py`
+        :param record_dir: tee the stream's segments and the time every frame was received to this directory, so it
+        can be analyzed again with `replay.py`. Needs `INGEST_HLS`
+        :param variant: rendition to read when the stream is an ABR ladder, see `hls_ingest.select_variant`. The first
+        one in the master playlist if not given
+        :param blocking_reload: with `INGEST_HLS`, long-poll the playlist for the next segment (`_HLS_msn`) instead of
+        reloading it every half target duration, see `hls_ingest.HLSIngester`
+        :param read_failure_timeout: seconds reads of the stream may keep failing before the recording ends
+        """
+        if sample_keyframes and ingest != INGEST_HLS:
+            raise AssertionError("Sampling keyframes needs --ingest hls, cv2.VideoCapture does not report keyframes")
+        if record_dir is not None and ingest != INGEST_HLS:
+            raise AssertionError("Recording needs --ingest hls, cv2.VideoCapture does not hand out the segments")
         self.server_url = f"http://{ip_address}:{port}/"
-        self.stream_url = self.server_url + "video/stream.m3u8"
+        self.stream_url = stream_url if stream_url is not None else self.server_url + "video/stream.m3u8"
+        self.ingest = ingest
+        self.variant = variant
+        self.blocking_reload = blocking_reload
+        self.read_failure_timeout = read_failure_timeout
+        self.prefetch = prefetch
+        self.sample_every = sample_every
+        self.sample_keyframes = sample_keyframes
+        self.sampled = sample_every is not None or sample_keyframes
         self.video_log: pd.DataFrame = pd.DataFrame(columns=self.COLUMN_NAMES)
         self.database_name = database_name
         self.table_name = table_name
-        self.analysis_number: int
+        self.analysis_number: Optional[int] = analysis_number
         self.create_metric_sql()
         self.set_up_sql()
         self.create_final_sql_table()
         self.record_period_seconds = record_period_seconds
+        self.decode_processes = decode_processes
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.every_nth = every_nth
+        self.timing_marker = timing_marker
+        self.qr_locator = QRLocator()
+        self.sliding_windows = list(sliding_windows)
+        self.settle_seconds = settle_seconds
+        self.sliding = SlidingWindowStats(self.sliding_windows + [record_period_seconds],
+                                          history_seconds=max(self.sliding_windows + [record_period_seconds]) +
+                                          settle_seconds + 30)
+        self.frame_stats = FramePairingEngine(pair_frames=not self.sampled, sliding=self.sliding)
+        self.frames_received = 0
+        self.profiler = StageProfiler() if profile else None
+        self.queue_depth: Callable[[], int] = lambda: 0
+        self.live_gauges: Dict[str, Optional[float]] = {"fps": 0.0}
+        self.decode_cache = DecodeCache(capacity=decode_cache_size) if decode_cache_size else None
+        decoder_depth = (max_in_flight or 10) + 2
+        if frame_pool_size is None:
+            frame_pool_size = queue_size + decoder_depth + 8
+        self.frame_pool = FramePool(initial_buffers=min(decoder_depth, frame_pool_size), max_buffers=frame_pool_size) \
+            if frame_pool_size else None
+        self.executor = executor
+        if executor is not None and max_in_flight is None:
+            max_in_flight = DEFAULT_MAX_IN_FLIGHT
+        self.max_in_flight = max_in_flight
+        self._in_flight = threading.BoundedSemaphore(max_in_flight) if max_in_flight is not None else None
+        self._stop_requested = threading.Event()
+        self._owns_db_writer = db_writer is None
+        self.db_writer = db_writer if db_writer is not None else DatabaseWriter(self.database_name)
+        if self._owns_db_writer:
+            self.db_writer.start()
+        self.recorder = StreamRecorder(record_dir, stream_url=self.stream_url, analysis_number=self.analysis_number,
+                                       timing_marker=timing_marker) if record_dir is not None else None
         if record_params:
             self.insert_params()
 
@@ -119,39 +202,65 @@ class StreamAnalyzer:
         Sets up sql table meant to store the "final" data on video quality and analysis. The stats will be stored once
         every minute and will calculate stats such as rolling latency, frames dropped over the last minute, calculated
         FPS over that minute, maybe something else?
+        Latency, time between frames and decode time are also stored as p50/p90/p99/max plus the serialized
+        histogram, so windows can later be merged with `histogram.load_merged_histogram`
         """
         create_table_sql = "CREATE TABLE IF NOT EXISTS stream_data_final (minute_count INT," \
                            "frames_received INT, frames_dropped INT, avg_calculated_fps FLOAT, avg_calculated_latency FLOAT, analysis_number INT)"
         connection = sqlite3.connect(self.database_name)
         cursor = connection.cursor()
         cursor.execute(create_table_sql)
+        add_missing_columns(cursor, "stream_data_final", FINAL_EXTRA_COLUMNS)
         connection.commit()
         connection.close()
 
-    def record_summary_statistics(self, minute_count: int, recording_time_period: int, frames_counter: int) -> None:
-        global ROLLING_LATENCY
-        global CALCULATED_FPS
-        global COUNT_FRAMES_DROPPED
-        global FRAMES_COUNTED
+    def record_summary_statistics(self, window_index: int, recording_time_period: float, frames_counter: int,
+                                  capture_window: CaptureWindow = None, pool_window: FramePoolWindow = None) -> None:
+        """
+        Records the `stream_data_final` row of one `record_period_seconds` window
+        :param window_index: number of the window since recording started, written as `minute_count` which is what
+        the column was called when the period was a minute
+        :param capture_window: statistics of the capture queue over the same period, if frames came through one
+        :param pool_window: statistics of the frame buffer pool over the same period, if frames were read into one
+        """
+        window = self.frame_stats.take_window()
         try:
             fps = frames_counter / recording_time_period
         except ZeroDivisionError as e:
             fps = 0
-        try:
-            latency = sum(ROLLING_LATENCY) / len(ROLLING_LATENCY)
-        except ZeroDivisionError as e:
-            latency = 0
+        latency = window.average_latency()
         print(f"NRE FPS: {fps}")
-        sql = "INSERT INTO stream_data_final (minute_count, frames_dropped, avg_calculated_fps, avg_calculated_latency, analysis_number) VALUES (?,?,?,?,?)"
-        values = [minute_count, COUNT_FRAMES_DROPPED, fps, latency, self.analysis_number]
-        connection = sqlite3.connect(self.database_name)
-        cursor = connection.cursor()
-        cursor.execute(sql, values)
-        connection.commit()
-        connection.close()
-        ROLLING_LATENCY = []
-        COUNT_FRAMES_DROPPED = 0
-        FRAMES_COUNTED = 0
+        columns = ["minute_count", "frames_received", "frames_dropped", "avg_calculated_fps", "avg_calculated_latency",
+                   "analysis_number"]
+        values = [window_index, frames_counter, window.frames_dropped, fps, latency, self.analysis_number]
+        columns.append("frames_repeated")
+        values.append(window.frames_repeated)
+        if self.decode_cache is not None:
+            columns += ["decode_cache_hits", "decode_cache_misses"]
+            values += list(self.decode_cache.take_counts())
+        histograms: Dict[str, LogHistogram] = {"latency": window.latency, "interval": window.interval,
+                                               "decode": window.decode}
+        for name, histogram in histograms.items():
+            for label, percent in PERCENTILES.items():
+                columns.append(f"{name}_{label}")
+                values.append(histogram.percentile(percent))
+            columns += [f"{name}_max", f"{name}_histogram"]
+            values += [histogram.max, histogram.to_json()]
+        if capture_window is not None:
+            columns += ["queue_depth_max", "queue_depth_avg", "queue_wait_p50", "queue_wait_p99",
+                        "analyzer_frames_dropped"]
+            values += [capture_window.max_depth, capture_window.average_depth(), capture_window.wait.percentile(50),
+                       capture_window.wait.percentile(99), capture_window.frames_dropped]
+            print(f"Capture queue max depth: {capture_window.max_depth} "
+                  f"analyzer dropped frames: {capture_window.frames_dropped}")
+        if pool_window is not None:
+            columns += ["frame_pool_buffers", "frame_pool_max_leased", "frame_pool_exhausted", "frame_pool_wait_p99"]
+            values += [self.frame_pool.allocated, pool_window.max_leased, pool_window.exhausted,
+                       pool_window.wait.percentile(99)]
+        print(f"Latency p50: {window.latency.percentile(50)} p99: {window.latency.percentile(99)} "
+              f"max: {window.latency.max}")
+        sql = f"INSERT INTO stream_data_final ({', '.join(columns)}) VALUES ({','.join('?' * len(values))})"
+        self.db_writer.insert(sql, values)
 
 
     def set_up_sql(self) -> None:
@@ -162,6 +271,12 @@ class StreamAnalyzer:
         connection = sqlite3.connect(self.database_name)
         cursor = connection.cursor()
         cursor.execute(create_table_sql)
+        add_missing_columns(cursor, "stream_data", {"confidence": "FLOAT"})
+        create_stream_data_index(cursor)
+        create_segment_timings_table(cursor)
+        create_frame_timestamps_table(cursor)
+        create_windows_table(cursor)
+        create_stage_timings_table(cursor)
         connection.commit()
         self.set_analysis_number(cursor)
         connection.close()
@@ -178,13 +293,15 @@ class StreamAnalyzer:
         values = []
         for param in expected_params:
             values.append(params_json[param])
-        values.append(self.analysis_number)
-        sql = "INSERT INTO stream_params (cpu, ram, image_size, fps, video_type, analysis_number) VALUES (?,?,?,?,?,?)"
-        connection = sqlite3.connect(self.database_name)
-        cursor = connection.cursor()
-        cursor.execute(sql, values)
-        connection.commit()
-        connection.close()
+        if str(params_json["VIDEO_TYPE"]).upper() == "PRERECORDED" and self.timing_marker != MARKER_STRIP:
+            raise AssertionError("A PRERECORDED stream needs --timing-marker strip, the QR codes of its frame library "
+                                 "only carry their position in the loop")
+        # Servers that stream a single rendition do not report ABR_SIZES
+        abr_sizes = [size for size in params_json.get("ABR_SIZES", "").split(",") if size.strip()]
+        values += [self.analysis_number, len(abr_sizes) or 1, self.variant]
+        sql = "INSERT INTO stream_params (cpu, ram, image_size, fps, video_type, analysis_number, renditions, " \
+              "variant) VALUES (?,?,?,?,?,?,?,?)"
+        self.db_writer.insert(sql, values)
 
     def create_metric_sql(self) -> None:
         """
@@ -194,69 +311,283 @@ class StreamAnalyzer:
         * Image size
         * FPS
         * Pre Recorded Video vs. Live Generated
+        * Renditions the server streams and the one analyzed, for ABR ladders
         * Analysis number: Links to stream_data table so that we can compare data accross the different runs
         """
         create_table_sql = "CREATE TABLE IF NOT EXISTS stream_params (cpu INT, ram INT, image_size INT, fps INT, video_type CHAR(255), analysis_number INT)"
         connection = sqlite3.connect(self.database_name)
         cursor = connection.cursor()
         cursor.execute(create_table_sql)
+        add_missing_columns(cursor, "stream_params", {"renditions": "INT", "variant": "TEXT"})
         connection.commit()
         connection.close()
 
     def set_analysis_number(self, cursor: sqlite3.Cursor) -> None:
         """
         Sets an incrementing analysis number in the database. The database will store data from many differnt analysis
-        periods, so it's important to be able to distinguish them.
+        periods, so it's important to be able to distinguish them. An analysis number given to the constructor is kept.
         """
-        sql = "SELECT max(analysis_number) from stream_data"
-        data = cursor.execute(sql).fetchall()[0][0]
-        if data is None:
-            self.analysis_number = 0
-        else:
-            self.analysis_number = data + 1
+        if self.analysis_number is None:
+            self.analysis_number = next_analysis_number(cursor)
         print(f"Analysis number {self.analysis_number} set")
 
     def get_stream_record_frames(self, limit_frames: int = None, no_logging: bool = False) -> None:
         """
-        This function captures the network stream and records the information it receives into the video log
+        This function captures the network stream and records the information it receives into the video log.
+        A capture thread reads the stream as fast as frames arrive and this thread hands them to the decoders, with
+        a bounded queue in between that follows `overflow_policy` when the decoders fall behind
         :param limit_frames: number of frames to record for until breaking
         """
-        video_capture = cv2.VideoCapture(self.stream_url)
-        fps = video_capture.get(cv2.CAP_PROP_FPS)
-        wait_ms = int(1000 / fps)
-        frames_recorded_counter, frames_received_counter = 0, 0
-        time_last_data_record = time.time()
-        minute_count = 0
-        cur_frames = 0
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            while True:
-                start_loop = time.time()
-                ret, frame = video_capture.read()
-                frames_recorded_counter += 1
-                cur_frames += 1
-                if limit_frames is not None and frames_recorded_counter > limit_frames:
-                    print("Ending frames recording")
-                    break
-                frame_recorder = FrameRecorder(frame=frame, time=time.time(),
-                                               frame_received_counter=frames_recorded_counter,
-                                               analysis_number=self.analysis_number)
-
-                future = executor.submit(frame_recorder.process_frame, db_name=self.database_name,
-                                         table_name=self.table_name).add_done_callback(handler)
-                record_period_passed = time.time() - time_last_data_record >= self.record_period_seconds
-                if record_period_passed:
-                    print(f"{self.record_period_seconds} has passed since the last time a frame was recorded, recording now")
-                    print_state(self.record_period_seconds, cur_frames)
-                    self.record_summary_statistics(minute_count, self.record_period_seconds, cur_frames)
-                    minute_count += 1
-                    time_last_data_record = time.time()
-                    cur_frames = 0
-                end_loop = time.time()
-                loop_time = (end_loop - start_loop) * 1000
-                wait_time = wait_ms - loop_time
-                if wait_time <= 0:
-                    continue
-                cv2.waitKey(int(wait_time))
+        video_capture = self.open_capture()
+        frame_queue = FrameQueue(maxsize=self.queue_size, policy=self.overflow_policy, every_nth=self.every_nth,
+                                 on_drop=self.release_frame)
+        capture_thread = CaptureThread(video_capture, frame_queue, limit_frames=limit_frames,
+                                       read_failure_timeout=self.read_failure_timeout,
+                                       sample_every=self.sample_every or 1, sample_keyframes=self.sample_keyframes,
+                                       on_timestamp=self.timestamp_callback(),
+                                       frame_pool=self.frame_pool, profiler=self.profiler)
+        decode_pool = nullcontext()
+        if self.decode_processes:
+            decode_pool = ProcessDecodePool(workers=self.decode_processes, db_writer=self.db_writer,
+                                            on_result=self.add_frame_stats, table_name=self.table_name,
+                                            locator_stats=self.qr_locator.stats, timing_marker=self.timing_marker,
+                                            decode_cache=self.decode_cache)
+        thread_pool = ThreadPoolExecutor(max_workers=10) if self.executor is None else nullcontext(self.executor)
+        window_scheduler = self.window_scheduler(frame_queue.take_window)
+        self.queue_depth = frame_queue.__len__
+        capture_thread.start()
+        window_scheduler.start()
+        with thread_pool as executor, decode_pool:
+            while not frame_queue.finished():
+                if self._stop_requested.is_set():
+                    capture_thread.stop()
+                captured = frame_queue.get(timeout=0.5)
+                if captured is not None:
+                    if self.profiler is not None:
+                        self.profiler.record(STAGE_QUEUE_WAIT, time.monotonic() - captured.enqueued_at)
+                        self.profiler.frame_shape = captured.frame.shape
+                    if not self.sampled:
+                        self.count_frame(captured.time_received)
+                    frame_recorder = self.frame_recorder(captured)
+                    if self.decode_processes:
+                        decode_pool.submit(frame_recorder)  # The frame is copied to shared memory, its buffer is free
+                        self.release_frame(captured)
+                    else:
+                        self._submit_frame(executor, frame_recorder)
+        capture_thread.join()
+        window_scheduler.stop()
+        window_scheduler.join()
+        video_capture.release()
+        self._wait_in_flight()
+        window_scheduler.flush(time.time())
+        self.db_writer.flush()
+        self.print_decode_summary()
+
+    def window_scheduler(self, take_capture_window: Callable[[], Optional[CaptureWindow]],
+                         now: float = None) -> WindowScheduler:
+        """
+        Scheduler that writes the `stream_data_final` row every `record_period_seconds` and the sliding windows, off
+        the thread handling frames. Not started, and has to be flushed once the stream ended
+        :param take_capture_window: gives the capture queue statistics since it was last called
+        :param now: see `WindowScheduler.add`
+        """
+        scheduler = WindowScheduler()
+        window_index = iter(range(1 << 62))
+        scheduler.add(self.record_period_seconds, lambda boundary, until=None: self._record_period(
+            next(window_index), boundary, take_capture_window, until), delay=self.settle_seconds, now=now)
+        for window_seconds in self.sliding_windows:
+            scheduler.add(window_seconds, partial(self._record_sliding_window, window_seconds),
+                          delay=self.settle_seconds, now=now)
+        scheduler.add(1, self._update_live_gauges, now=now)
+        return scheduler
+
+    def _update_live_gauges(self, boundary: float, until: float = None) -> None:
+        """
+        Recomputes the fps and percentiles served by `metrics_snapshot` once a second, so a scrape only reads them
+        :param boundary: end of the second that just passed
+        :param until: unused, the gauges always cover the last complete 10 seconds
+        """
+        totals = self.frame_stats.totals
+        gauges = {"fps": self.sliding.snapshot(10, boundary).fps}
+        for name, histogram in {"latency_seconds": totals.latency, "decode_seconds": totals.decode}.items():
+            for label, percent in PERCENTILES.items():
+                gauges[f"{name}_{label}"] = histogram.percentile(percent)
+        self.live_gauges = gauges
+
+    def _record_period(self, window_index: int, boundary: float,
+                       take_capture_window: Callable[[], Optional[CaptureWindow]], until: float = None) -> None:
+        """
+        :param until: when the stream ended, if it ended inside this window
+        """
+        frames_counter = self.sliding.snapshot(self.record_period_seconds, boundary).frames_received
+        period_seconds = self.record_period_seconds
+        if until is not None and until < boundary:
+            period_seconds = max(period_seconds - (boundary - until), 0.001)
+        print(f"{self.record_period_seconds}s window {window_index} ended, recording now")
+        print_state(period_seconds, frames_counter, self.frame_stats, self.db_writer,
+                    self.qr_locator.stats, self.decode_cache)
+        self.record_summary_statistics(window_index, period_seconds, frames_counter,
+                                       capture_window=take_capture_window(), pool_window=self.take_pool_window())
+        if self.profiler is not None:
+            for row in self.profiler.window_rows(self.analysis_number, window_index):
+                self.db_writer.insert(f"INSERT INTO {STAGE_TIMINGS_TABLE} (analysis_number, window_index, stage, "
+                                      f"frame_width, frame_height, count, total_seconds, p50, p99, max, histogram) "
+                                      f"VALUES (?,?,?,?,?,?,?,?,?,?,?)", row)
+
+    def _record_sliding_window(self, window_seconds: float, boundary: float, until: float = None) -> None:
+        stats = self.sliding.snapshot(window_seconds, boundary, until=until)
+        self.db_writer.insert(
+            f"INSERT INTO {WINDOWS_TABLE} (analysis_number, window_seconds, window_end, frames_received, "
+            f"frames_dropped, fps, latency_mean, latency_max, jitter_mean, interval_mean) VALUES (?,?,?,?,?,?,?,?,?,?)",
+            [self.analysis_number, stats.window_seconds, stats.window_end, stats.frames_received, stats.frames_dropped,
+             stats.fps, stats.latency_mean, stats.latency_max, stats.jitter_mean, stats.interval_mean])
+
+    def open_capture(self):
+        """
+        :return: the stream opened with the configured ingest, a `cv2.VideoCapture` or an `HLSIngester`
+        """
+        if self.ingest == INGEST_HLS:
+            video_capture = HLSIngester(self.stream_url, prefetch=self.prefetch, db_writer=self.db_writer,
+                                        analysis_number=self.analysis_number, recorder=self.recorder,
+                                        variant=self.variant, blocking_reload=self.blocking_reload)
+        elif self.variant is not None:
+            video_capture = cv2.VideoCapture(resolve_variant_url(self.stream_url, self.variant))
+        else:
+            video_capture = cv2.VideoCapture(self.stream_url)
+        if not video_capture.isOpened():
+            raise cv2.error(f"Could not open stream {self.stream_url}")
+        print(f"Stream reports {video_capture.get(cv2.CAP_PROP_FPS)} fps")
+        return video_capture
+
+    def frame_reader(self, video_capture, limit_frames: int = None) -> FrameReader:
+        return FrameReader(video_capture, limit_frames=limit_frames, read_failure_timeout=self.read_failure_timeout,
+                           sample_every=self.sample_every or 1,
+                           sample_keyframes=self.sample_keyframes,
+                           on_timestamp=self.timestamp_callback(), frame_pool=self.frame_pool,
+                           profiler=self.profiler)
+
+    def frame_recorder(self, captured: CapturedFrame) -> FrameRecorder:
+        return FrameRecorder(frame=captured.frame, time=captured.time_received,
+                             frame_received_counter=captured.frame_received_counter,
+                             analysis_number=self.analysis_number, timing_marker=self.timing_marker)
+
+    def count_frame(self, time_received: float) -> None:
+        """
+        Counts a frame read from the stream, from the one thread handing frames out
+        """
+        self.frames_received += 1
+        self.sliding.record_frame(time_received)
+
+    def metrics_snapshot(self) -> dict:
+        """
+        Live values for `metrics_server.MetricsServer`, read without locking from the counters kept since the analyzer
+        was created and from the gauges the window scheduler recomputes every second (`_update_live_gauges`)
+        """
+        totals = self.frame_stats.totals
+        snapshot = {"analysis_number": self.analysis_number, "stream_url": self.stream_url, "variant": self.variant,
+                    "frames_received": self.frames_received, "frames_decoded": totals.decode.count,
+                    "frames_dropped": totals.frames_dropped, "frames_repeated": totals.frames_repeated,
+                    "decode_cache_hits": self.decode_cache.hits if self.decode_cache is not None else 0,
+                    "queue_depth": self.queue_depth(), "db_writer_backlog": self.db_writer.backlog,
+                    "db_rows_failed": self.db_writer.rows_failed,
+                    "frame_pool_leased": self.frame_pool.leased if self.frame_pool is not None else 0}
+        snapshot.update(self.live_gauges)
+        for name, histogram in {"latency_seconds": totals.latency, "decode_seconds": totals.decode}.items():
+            snapshot[f"{name}_sum"] = histogram.total
+            snapshot[f"{name}_count"] = histogram.count
+        return snapshot
+
+    def take_pool_window(self) -> Optional[FramePoolWindow]:
+        return self.frame_pool.take_window() if self.frame_pool is not None else None
+
+    def print_decode_summary(self) -> None:
+        print(f"QR locator hit rates: {self.qr_locator.stats.summary()}")
+        if self.decode_cache is not None:
+            print(f"Decode cache: {self.decode_cache.summary()}")
+        if self.frame_pool is not None:
+            print(f"Frame pool: {self.frame_pool.summary()}")
+
+    def release_frame(self, captured: CapturedFrame) -> None:
+        if self.frame_pool is not None:
+            self.frame_pool.release(captured.frame)
+
+    def timestamp_callback(self) -> Optional[TimestampCallback]:
+        """
+        :return: what the frame reader should call for every frame it reads, None if nothing has to know about frames
+        that are not retrieved
+        """
+        if self.recorder is None:
+            return self._record_timestamp if self.sampled else None
+        return self._record_frame
+
+    def _record_frame(self, frame_number_received: int, time_received: float, pts: float,
+                      keyframe: Optional[bool], sampled: bool) -> None:
+        self.recorder.record_frame(frame_number_received, time_received, pts)
+        if self.sampled:
+            self._record_timestamp(frame_number_received, time_received, pts, keyframe, sampled)
+
+    def _record_timestamp(self, frame_number_received: int, time_received: float, pts: float,
+                          keyframe: Optional[bool], sampled: bool) -> None:
+        self.frame_stats.add_timestamp(pts, time_received)
+        self.count_frame(time_received)
+        self.db_writer.insert(f"INSERT INTO {FRAME_TIMESTAMPS_TABLE} (analysis_number, frame_number_received, "
+                              f"time_received, pts, keyframe, sampled) VALUES (?,?,?,?,?,?)",
+                              [self.analysis_number, frame_number_received, time_received, pts,
+                               -1 if keyframe is None else int(keyframe), int(sampled)])
+
+    def _submit_frame(self, executor: ThreadPoolExecutor, frame_recorder: FrameRecorder) -> None:
+        if self._in_flight is not None:
+            self._in_flight.acquire()
+        future = executor.submit(frame_recorder.process_frame, db_writer=self.db_writer, table_name=self.table_name,
+                                 qr_locator=self.qr_locator, decode_cache=self.decode_cache, profiler=self.profiler,
+                                 submitted_at=time.perf_counter())
+        future.add_done_callback(partial(self._handle_result, frame_recorder.frame))
+
+    def _handle_result(self, frame: np.ndarray, future: Future) -> None:
+        try:
+            self.add_frame_stats(future.result())
+        finally:
+            if self.frame_pool is not None:
+                self.frame_pool.release(frame)
+            if self._in_flight is not None:
+                self._in_flight.release()
+
+    def add_frame_stats(self, frame_dict: Optional[FrameDict]) -> None:
+        if self.profiler is None:
+            self.frame_stats.add(frame_dict)
+            return
+        stats_start = time.perf_counter()
+        self.frame_stats.add(frame_dict)
+        self.profiler.record(STAGE_STATS, time.perf_counter() - stats_start)
+
+    def _wait_in_flight(self) -> None:
+        """
+        Waits until every frame this stream submitted has been decoded, needed when the executor is shared
+        """
+        if self._in_flight is None:
+            return
+        for _ in range(self.max_in_flight):
+            self._in_flight.acquire()
+        for _ in range(self.max_in_flight):
+            self._in_flight.release()
+
+    def stop(self) -> None:
+        """
+        Makes a running `get_stream_record_frames` finish after the frame it is on
+        """
+        self._stop_requested.set()
+
+    def close(self) -> None:
+        """
+        Writes out anything still queued for the database and closes the writer connection, unless the writer is
+        shared with other analyzers
+        """
+        if self.recorder is not None:
+            self.recorder.close()
+        if self._owns_db_writer:
+            self.db_writer.close()
+        else:
+            self.db_writer.flush()
 
     def analyze_stream(self) -> pd.DataFrame:
         """
@@ -269,29 +600,33 @@ class StreamAnalyzer:
         TODO: Disable this when no logging is set
         """
         connection = sqlite3.connect(self.database_name)
-        sql_query = f"SELECT * FROM {self.table_name} where analysis_number = {self.analysis_number}"
-        data = pd.read_sql(sql_query, connection)
-        data = data.sort_values(by=["frame_number"])
-        first_frame_received = data['frame_number'].iloc[0]
-        data['frame_number_index_to_0'] = data['frame_number'] - first_frame_received
-        data['frames_dropped'] = data['frame_number_received'] - data.index
-        data['time_difference'] = data['time_received'] - data['time_generated']
-        data['difference_between_frame_times'] = data['time_received'].rolling(2).apply(lambda x: x.iloc[1] - x.iloc[0])
-        data['calculated_fps'] = 1000 / (data['difference_between_frame_times'] * 1000)
-        return data
-
-    def run_and_analyze_stream(self, frame_limit: int = 2000, outfile: str = "data.csv", no_logging=False) -> None:
+        data = read_analysis(connection, self.analysis_number, table_name=self.table_name)
+        connection.close()
+        return analyze_frames(data)
+
+    def summarize_stream(self) -> pd.DataFrame:
+        """
+        Drop, gap, jitter and latency summary of this analysis, read in chunks. See `stream_analysis.summarize_analyses`
+        to summarize many analyses at once
+        """
+        return summarize_analyses(self.database_name, analysis_numbers=[self.analysis_number],
+                                  table_name=self.table_name)
+
+    def run_and_analyze_stream(self, frame_limit: int = 2000, outfile: str = "data.csv", no_logging=False,
+                               output_format: str = "csv") -> None:
         """
         This function runs the whole pipeline of running the program that generates and streams the qrcode network
         stream video in a separate thread, then starts receiving and recording the data from the frames, and finally
         processes the data recorded after the fact.
         :param frame_limit: Number of frames to give for the stream and stream recorder. i.e. if 2000 is given,
         then it will process 2000 frames before
+        :param output_format: one of `result_export.EXPORT_FORMATS`, the columnar formats also store the stream params
         """
         self.get_stream_record_frames(limit_frames=frame_limit, no_logging=no_logging)  # Start recording frames
         analyzed_data = self.analyze_stream()  # Post processing
         if outfile is not None:
-            analyzed_data.to_csv(outfile)
+            params = read_stream_params(self.database_name, self.analysis_number)
+            export_results(analyzed_data, outfile, params=params, output_format=output_format)
 
 def get_parser() -> argparse.ArgumentParser:
     time_str = "_".join(str(datetime.datetime.now()).split(" "))
@@ -304,8 +639,54 @@ def get_parser() -> argparse.ArgumentParser:
     parser.add_argument("-c", "--cluster-name", default=DEFAULT_CLUSTER, help="Provide a manual cluster")
     parser.add_argument("-f", "--frame-limit", type=int, default=10000,
                         help="Provide a specification for how many frames it should record, default is 10,000")
-    parser.add_argument("-o", "--outfile", default=f"data_{time_str}.csv",
-                        help="Provide a name for the file that will be output")
+    parser.add_argument("-o", "--outfile", default=f"data_{time_str}",
+                        help="Provide a name for the file that will be output, the extension of the output format "
+                             "is added if it is missing")
+    parser.add_argument("-of", "--output-format", choices=EXPORT_FORMATS, default="csv",
+                        help="csv, or a typed columnar format that also stores the stream params: parquet, feather "
+                             "or npy (a directory of memory mappable .npy files)")
+    parser.add_argument("-qs", "--queue-size", type=int, default=64,
+                        help="Frames that can wait between the capture thread and the decoders")
+    parser.add_argument("-op", "--overflow-policy", choices=OVERFLOW_POLICIES, default=OVERFLOW_BLOCK,
+                        help="What to do with new frames when that queue is full")
+    parser.add_argument("-n", "--every-nth", type=int, default=2,
+                        help="For the every-nth policy, decode every nth frame once the queue is half full")
+    parser.add_argument("-dp", "--decode-processes", type=int, default=0,
+                        help="Number of worker processes to decode QR codes with. Default 0 decodes on a thread pool")
+    parser.add_argument("-tm", "--timing-marker", choices=[MARKER_QR, MARKER_STRIP], default=MARKER_QR,
+                        help="How the server stamps frames: a QR code or a block strip (server TIMING_MARKER=STRIP)")
+    parser.add_argument("-i", "--ingest", choices=INGEST_MODES, default=INGEST_OPENCV,
+                        help="opencv reads the playlist with cv2.VideoCapture, hls downloads segments itself and "
+                             "records per segment timings (see hls_ingest.py)")
+    parser.add_argument("-su", "--stream-url", help="Read this playlist instead of the server's, with --ingest hls it "
+                                                    "may be a local directory holding a static HLS stream")
+    parser.add_argument("-s", "--sample-every", type=int,
+                        help="Only QR decode every nth frame, FPS and drops come from the container timestamps of "
+                             "every frame (see ts_timestamps.py)")
+    parser.add_argument("-sk", "--sample-keyframes", action="store_true",
+                        help="Same as --sample-every but QR decode keyframes, needs --ingest hls")
+    parser.add_argument("-dc", "--decode-cache", type=int, default=32,
+                        help="Recently decoded frames to remember so repeated frames are not decoded again, 0 for off")
+    parser.add_argument("-fp", "--frame-pool", type=int,
+                        help="Most preallocated frame buffers to read frames into, 0 allocates a new array per frame. "
+                             "Enough for a full capture queue plus the decoders by default")
+    parser.add_argument("-sw", "--sliding-windows", type=float, nargs="+", default=list(DEFAULT_WINDOWS),
+                        help="Lengths in seconds of the sliding windows written to stream_data_windows")
+    parser.add_argument("-mp", "--metrics-port", type=int,
+                        help="Serve live metrics on this port, at /metrics for Prometheus and /metrics.json")
+    parser.add_argument("-pr", "--profile", action="store_true",
+                        help="Time every stage of the pipeline per frame into stage_timings, see stage_profiler.py")
+    parser.add_argument("-rd", "--record-dir",
+                        help="Tee the stream to this directory to analyze it again later with replay.py, needs "
+                             "--ingest hls")
+    parser.add_argument("-p", "--prefetch", type=int, default=3, help="Segments to download in parallel with --ingest hls")
+    parser.add_argument("-va", "--variant",
+                        help="Rendition of an ABR ladder to analyze, i.e. 1280x720, 720p or its index in the master "
+                             "playlist. To analyze several at once use fleet.py --variants")
+    parser.add_argument("-br", "--blocking-reload", action="store_true",
+                        help="With --ingest hls, long-poll the playlist for the next segment (server LOW_LATENCY=1)")
+    parser.add_argument("-rft", "--read-failure-timeout", type=float, default=DEFAULT_READ_FAILURE_TIMEOUT,
+                        help="Seconds reads of the stream may keep failing in a row before the recording ends")
     return parser
 
 
@@ -321,23 +702,43 @@ def main() -> None:
         video_url = args.ip_address
         record_params = False
 
-    stream_analyzer = StreamAnalyzer(ip_address=video_url, record_params=record_params)
+    outfile = args.outfile
+    if not outfile.endswith(FILE_EXTENSIONS[args.output_format]):
+        outfile += FILE_EXTENSIONS[args.output_format]
+    stream_analyzer = StreamAnalyzer(ip_address=video_url, record_params=record_params,
+                                     decode_processes=args.decode_processes, timing_marker=args.timing_marker,
+                                     queue_size=args.queue_size, overflow_policy=args.overflow_policy,
+                                     every_nth=args.every_nth, ingest=args.ingest, stream_url=args.stream_url,
+                                     prefetch=args.prefetch, sample_every=args.sample_every,
+                                     sample_keyframes=args.sample_keyframes, decode_cache_size=args.decode_cache,
+                                     frame_pool_size=args.frame_pool, sliding_windows=args.sliding_windows,
+                                     profile=args.profile, record_dir=args.record_dir, variant=args.variant,
+                                     blocking_reload=args.blocking_reload,
+                                     read_failure_timeout=args.read_failure_timeout)
+    if args.metrics_port is not None:
+        metrics_server = MetricsServer(port=args.metrics_port)
+        metrics_server.register(stream_analyzer)
+        metrics_server.start()
     try:
-        stream_analyzer.run_and_analyze_stream(frame_limit=args.frame_limit, outfile=args.outfile)
+        stream_analyzer.run_and_analyze_stream(frame_limit=args.frame_limit, outfile=outfile,
+                                               output_format=args.output_format)
     except ZeroDivisionError:
         print("Received zero division error - sleeping for 15 seconds and trying again because server might still be "
               "starting up")
         time.sleep(15)
-        stream_analyzer.run_and_analyze_stream(frame_limit=args.frame_limit, outfile=args.outfile)
+        stream_analyzer.run_and_analyze_stream(frame_limit=args.frame_limit, outfile=outfile,
+                                               output_format=args.output_format)
     except cv2.error:
         print("Received cv2 error, attempting to connect again after 2s")
         time.sleep(2)
-        stream_analyzer.run_and_analyze_stream(frame_limit=args.frame_limit, outfile=args.outfile)
+        stream_analyzer.run_and_analyze_stream(frame_limit=args.frame_limit, outfile=outfile,
+                                               output_format=args.output_format)
     except KeyboardInterrupt:
+        print("Recording interrupted")
+    finally:
+        stream_analyzer.close()
         stop_task_by_id(task_identifier=args.identifier, cluster_name=args.cluster_name)
         print("Task stopped")
-    stop_task_by_id(task_identifier=args.identifier, cluster_name=args.cluster_name)
-    print("Task stopped")
 
 
 
@@ -0,0 +1,125 @@
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+_FLUSH = object()
+_STOP = object()
+
+
+class DatabaseWriter(threading.Thread):
+    """
+    Single writer for the SQLite database. Every INSERT the client makes is put onto a queue and written by this
+    thread on one long lived connection, in batches with `executemany`. This keeps the decode threads from opening
+    their own connections and fighting over the database lock.
+    """
+
+    def __init__(self, database_name: str, batch_size: int = 500, flush_interval_seconds: float = 0.5):
+        super().__init__(daemon=True)
+        self.database_name = database_name
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.rows_queued = 0
+        self.rows_flushed = 0
+        # Rows of batches that could not be written, they are lost and not counted as flushed
+        self.rows_failed = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._queued_lock = threading.Lock()
+        self._flushed = threading.Condition()
+        self._closed = False
+
+    @property
+    def backlog(self) -> int:
+        """
+        Number of rows that have been queued but not yet committed to the database or given up on
+        """
+        return self.rows_queued - self.rows_flushed - self.rows_failed
+
+    def insert(self, sql: str, values: Sequence) -> None:
+        """
+        Queues a single row to be written. Rows with the same sql statement are grouped into one `executemany`
+        :param sql: parametrized INSERT statement
+        :param values: values for the statement parameters
+        """
+        if self._closed:
+            raise AssertionError(f"Database writer for {self.database_name} is already closed")
+        with self._queued_lock:
+            self.rows_queued += 1
+        self._queue.put((sql, values))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until every row queued before this call has been committed or failed to be
+        :return: False if a batch failed to be written while waiting, or the rows were not all written in time
+        """
+        target = self.rows_queued
+        failed_before = self.rows_failed
+        self._queue.put(_FLUSH)
+        with self._flushed:
+            done = self._flushed.wait_for(lambda: self.rows_flushed + self.rows_failed >= target or not self.is_alive(),
+                                          timeout=timeout)
+            return done and self.rows_flushed + self.rows_failed >= target and self.rows_failed == failed_before
+
+    def close(self) -> None:
+        """
+        Flushes everything still queued and closes the connection
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        if self.is_alive():
+            self.join()
+
+    def run(self) -> None:
+        connection = sqlite3.connect(self.database_name, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        pending: Dict[str, List[Sequence]] = {}
+        pending_count = 0
+        deadline = time.monotonic() + self.flush_interval_seconds
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                item = _FLUSH
+            if item is _STOP:
+                stopping = True
+            elif item is not _FLUSH:
+                sql, values = item
+                pending.setdefault(sql, []).append(values)
+                pending_count += 1
+                if pending_count < self.batch_size and time.monotonic() < deadline:
+                    continue
+            if pending_count:
+                written = self._write_batch(connection, pending)
+                with self._flushed:
+                    if written:
+                        self.rows_flushed += pending_count
+                    else:
+                        self.rows_failed += pending_count
+                    self._flushed.notify_all()
+                pending = {}
+                pending_count = 0
+            else:
+                with self._flushed:
+                    self._flushed.notify_all()
+            deadline = time.monotonic() + self.flush_interval_seconds
+        connection.close()
+
+    @staticmethod
+    def _write_batch(connection: sqlite3.Connection, pending: Dict[str, List[Sequence]]) -> bool:
+        """
+        Writes the batch in one transaction, a batch that fails is rolled back as a whole
+        :return: whether the batch was committed
+        """
+        try:
+            with connection:
+                for sql, rows in pending.items():
+                    connection.executemany(sql, rows)
+        except sqlite3.Error as e:
+            print(f"Failed to write batch of {sum(len(rows) for rows in pending.values())} rows: {e}")
+            return False
+        return True
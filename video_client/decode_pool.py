@@ -0,0 +1,214 @@
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+import time
+import numpy as np
+import cv2
+from db_writer import DatabaseWriter
+from frame_cache import DecodeCache
+from frame_recorder import FrameDict, FrameRecorder, parse_qr_payload, MARKER_QR, MARKER_STRIP
+from qr_locator import LocatorStats, QRLocator
+from timing_marker import read_marker
+
+# State owned by each decode worker process, set up once by `_init_worker`
+_WORKER_SLOTS: List[np.ndarray] = []
+_WORKER_BLOCKS: List[shared_memory.SharedMemory] = []
+_WORKER_LOCATOR: Optional[QRLocator] = None
+
+
+def _init_worker(block_names: List[str], frame_shape: Tuple[int, ...], dtype: str) -> None:
+    global _WORKER_LOCATOR
+    _WORKER_BLOCKS.clear()
+    _WORKER_SLOTS.clear()
+    for name in block_names:
+        block = shared_memory.SharedMemory(name=name)
+        _WORKER_BLOCKS.append(block)
+        _WORKER_SLOTS.append(np.ndarray(frame_shape, dtype=dtype, buffer=block.buf))
+    _WORKER_LOCATOR = QRLocator()
+
+
+def _decode_slot(slot: int, timing_marker: str = MARKER_QR) -> Tuple[bool, Optional[dict], Tuple[str, ...], Optional[str], float]:
+    """
+    Runs the QR detection and payload parsing, or the timing strip read, for the frame sitting in a shared memory slot
+    :return: (decoded, payload, tried, hit, decode_seconds). decoded is False if OpenCV failed on the frame, payload
+    is None if the QR code could not be read, and tried/hit are the locator strategies so the parent can keep the stats
+    """
+    start_decode = time.perf_counter()
+    if timing_marker == MARKER_STRIP:
+        reading = read_marker(_WORKER_SLOTS[slot])
+        return True, reading._asdict() if reading is not None else None, (), None, time.perf_counter() - start_decode
+    try:
+        result = _WORKER_LOCATOR.locate(_WORKER_SLOTS[slot])
+    except cv2.error:
+        return False, None, (), None, time.perf_counter() - start_decode
+    payload = parse_qr_payload(result.value)
+    return True, payload, result.tried, result.hit, time.perf_counter() - start_decode
+
+
+class SharedFrameRing:
+    """
+    Fixed number of shared memory slots, each big enough for one frame. Frames are copied into a free slot and the
+    worker processes read them from there, so the frames never get pickled
+    """
+
+    def __init__(self, slots: int, frame_shape: Tuple[int, ...], dtype: np.dtype = np.uint8):
+        self.frame_shape = tuple(frame_shape)
+        self.dtype = np.dtype(dtype)
+        nbytes = int(np.prod(self.frame_shape)) * self.dtype.itemsize
+        self.blocks = [shared_memory.SharedMemory(create=True, size=nbytes) for _ in range(slots)]
+        self.slots = [np.ndarray(self.frame_shape, dtype=self.dtype, buffer=block.buf) for block in self.blocks]
+        self._free: List[int] = list(range(slots))
+
+    @property
+    def block_names(self) -> List[str]:
+        return [block.name for block in self.blocks]
+
+    def has_free_slot(self) -> bool:
+        return bool(self._free)
+
+    def put(self, frame: np.ndarray) -> int:
+        """
+        Copies a frame into a free slot. Callers have to check `has_free_slot` first
+        :return: index of the slot the frame was written to
+        """
+        slot = self._free.pop()
+        np.copyto(self.slots[slot], frame)
+        return slot
+
+    def release(self, slot: int) -> None:
+        self._free.append(slot)
+
+    def close(self) -> None:
+        self.slots = []
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+class ProcessDecodePool:
+    """
+    Decodes frames in a pool of worker processes that each keep their own QR detector. Frames are handed over through
+    a `SharedFrameRing` and the results are given to `on_result` in the same order the frames were submitted.
+    Submitting blocks on the oldest frame when every slot is in use.
+    """
+
+    def __init__(self, workers: int, db_writer: DatabaseWriter, on_result: Callable[[FrameDict], None],
+                 table_name: str = "stream_data", slots: int = None, locator_stats: LocatorStats = None,
+                 timing_marker: str = MARKER_QR, decode_cache: DecodeCache = None):
+        """
+        :param decode_cache: if given, frames identical to a recently decoded one are not sent to the workers
+        """
+        self.workers = workers
+        self.slots = slots if slots is not None else workers * 4
+        self.db_writer = db_writer
+        self.table_name = table_name
+        self.on_result = on_result
+        self.timing_marker = timing_marker
+        self.decode_cache = decode_cache
+        self.locator_stats = locator_stats if locator_stats is not None else LocatorStats()
+        self._ring: Optional[SharedFrameRing] = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending: Deque[Tuple[Future, Optional[int], FrameRecorder, Optional[bytes]]] = deque()
+        # Fingerprint -> result of frames the workers are decoding, for repeats submitted before it comes back
+        self._decoding: Dict[bytes, Future] = {}
+
+    def __enter__(self) -> "ProcessDecodePool":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def _start(self, frame: np.ndarray) -> None:
+        self._ring = SharedFrameRing(self.slots, frame.shape, frame.dtype)
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                             initargs=(self._ring.block_names, frame.shape, frame.dtype.str))
+
+    def _stop(self) -> None:
+        self.drain(block=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._ring is not None:
+            self._ring.close()
+            self._ring = None
+
+    def submit(self, frame_recorder: FrameRecorder) -> None:
+        """
+        Copies the frame into shared memory and queues it for decoding. The recorder drops its reference to the frame
+        """
+        frame = frame_recorder.frame
+        if frame is None:
+            print(f"Frame dropped! Frame number {frame_recorder.frame_received_counter}")
+            return
+        if self._ring is not None and (frame.shape != self._ring.frame_shape or frame.dtype != self._ring.dtype):
+            print(f"Frame shape changed to {frame.shape}, restarting decode workers")
+            self._stop()
+        if self._ring is None:
+            self._start(frame)
+        fingerprint = None
+        if self.decode_cache is not None:
+            fingerprint = self.decode_cache.fingerprint(frame)
+            decoding = self._decoding.get(fingerprint)
+            if decoding is not None:
+                # The same frame is still with the workers, this one gets its result
+                self.decode_cache.record_hit()
+                self._queue_resolved(decoding, frame_recorder)
+                return
+            found, payload = self.decode_cache.lookup(fingerprint, wait_seconds=0)
+            if found:
+                cached: Future = Future()
+                cached.set_result((True, payload, None, None, 0.0))
+                self._queue_resolved(cached, frame_recorder)
+                return
+        while not self._ring.has_free_slot():
+            self._deliver_oldest()
+        slot = self._ring.put(frame)
+        frame_recorder.frame = None
+        future = self._executor.submit(_decode_slot, slot, self.timing_marker)
+        self._pending.append((future, slot, frame_recorder, fingerprint))
+        if fingerprint is not None:
+            self._decoding[fingerprint] = future
+        self.drain(block=False)
+
+    def _queue_resolved(self, future: Future, frame_recorder: FrameRecorder) -> None:
+        """
+        Queues a frame that needs no decoding behind the frames before it, so results stay in submission order
+        """
+        frame_recorder.frame = None
+        self._pending.append((future, None, frame_recorder, None))
+        self.drain(block=False)
+
+    def drain(self, block: bool = False) -> None:
+        """
+        Hands finished results to `on_result` in submission order
+        :param block: if True waits for every outstanding frame, otherwise stops at the first unfinished one
+        """
+        while self._pending and (block or self._pending[0][0].done()):
+            self._deliver_oldest()
+
+    def _deliver_oldest(self) -> None:
+        future, slot, frame_recorder, fingerprint = self._pending.popleft()
+        try:
+            decoded, payload, tried, hit, decode_seconds = future.result()
+        finally:
+            if slot is not None:
+                self._ring.release(slot)
+        if slot is not None:
+            self.locator_stats.record(tried, hit)
+        if fingerprint is not None:
+            self._decoding.pop(fingerprint, None)
+            if decoded:
+                self.decode_cache.store(fingerprint, payload)
+            else:
+                self.decode_cache.abandon(fingerprint)
+        if not decoded:
+            print(f"Frame dropped! Frame number {frame_recorder.frame_received_counter}")
+            return
+        frame_dict = frame_recorder.record_payload(payload, db_writer=self.db_writer, table_name=self.table_name,
+                                                   decode_seconds=decode_seconds)
+        self.on_result(frame_dict)
+
+    def close(self) -> None:
+        self._stop()
@@ -0,0 +1,151 @@
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+import pandas as pd
+from aws_utils import get_public_ip_ecs_task_by_id, DEFAULT_CLUSTER, stop_task_by_id
+from client_cv import StreamAnalyzer, DEFAULT_MAX_IN_FLIGHT
+from db_writer import DatabaseWriter
+from frame_recorder import MARKER_QR, MARKER_STRIP
+from metrics_server import MetricsServer
+from stream_analysis import summarize_analyses
+
+
+class FleetAnalyzer:
+    """
+    Monitors several streams from one process. Every stream gets its own capture thread and StreamAnalyzer (so its
+    statistics stay separate under its own analysis number), while all of them share one decode thread pool and one
+    database writer. Each stream may only have `max_in_flight_per_stream` frames in the shared pool at once, so a
+    stream that decodes slowly (i.e. 1080p) waits on itself instead of filling the pool's queue for everyone else.
+    Streams that are ABR ladders can be read in several `variants` at once, each variant is a stream of its own.
+    """
+
+    def __init__(self, ip_addresses: List[str], database_name: str = "stream_data.db", decode_workers: int = 10,
+                 max_in_flight_per_stream: int = DEFAULT_MAX_IN_FLIGHT, record_params: bool = True,
+                 record_period_seconds: int = 10, timing_marker: str = MARKER_QR, variants: List[str] = None):
+        """
+        :param variants: renditions to analyze of every server, see `hls_ingest.select_variant`. Only the first
+        rendition if not given
+        """
+        self.ip_addresses = ip_addresses
+        self.database_name = database_name
+        self.db_writer = DatabaseWriter(database_name)
+        self.db_writer.start()
+        self.executor = ThreadPoolExecutor(max_workers=decode_workers)
+        self.analyzers: List[StreamAnalyzer] = []
+        try:
+            first_analysis_number = None
+            streams = [(ip_address, variant) for ip_address in ip_addresses for variant in (variants or [None])]
+            for stream_index, (ip_address, variant) in enumerate(streams):
+                try:
+                    analyzer = StreamAnalyzer(ip_address=ip_address, database_name=database_name,
+                                              record_params=record_params, record_period_seconds=record_period_seconds,
+                                              timing_marker=timing_marker, db_writer=self.db_writer,
+                                              executor=self.executor,
+                                              analysis_number=None if first_analysis_number is None
+                                              else first_analysis_number + stream_index,
+                                              max_in_flight=max_in_flight_per_stream, variant=variant)
+                except Exception as e:
+                    print(f"Skipping stream {ip_address}" + (f" variant {variant}" if variant is not None else "") +
+                          f", it could not be set up: {e}")
+                    continue
+                if first_analysis_number is None:
+                    first_analysis_number = analyzer.analysis_number - stream_index
+                self.analyzers.append(analyzer)
+            if not self.analyzers:
+                raise AssertionError(f"None of the {len(streams)} streams could be set up")
+        except BaseException:
+            self.close()
+            raise
+
+    @property
+    def analysis_numbers(self) -> List[int]:
+        return [analyzer.analysis_number for analyzer in self.analyzers]
+
+    def _record(self, analyzer: StreamAnalyzer, frame_limit: int) -> None:
+        try:
+            analyzer.get_stream_record_frames(limit_frames=frame_limit)
+        except Exception as e:
+            print(f"Stream {analyzer.stream_url} (analysis {analyzer.analysis_number}) stopped with error: {e}")
+
+    def run(self, frame_limit: int = None) -> None:
+        """
+        Records every stream until each has seen `frame_limit` frames, or until interrupted with Ctrl-C
+        """
+        threads = [threading.Thread(target=self._record, args=(analyzer, frame_limit), daemon=True,
+                                    name=f"capture-{analyzer.analysis_number}") for analyzer in self.analyzers]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            print("Stopping all streams")
+            for analyzer in self.analyzers:
+                analyzer.stop()
+            for thread in threads:
+                thread.join()
+
+    def summarize(self) -> pd.DataFrame:
+        self.db_writer.flush()
+        return summarize_analyses(self.database_name, analysis_numbers=self.analysis_numbers)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+        self.db_writer.close()
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    streams = parser.add_mutually_exclusive_group(required=True)
+    streams.add_argument("-ids", "--identifiers", nargs="+",
+                         help="ID environment variables of the ECS tasks to monitor, the tasks are stopped at the end")
+    streams.add_argument("-ips", "--ip-addresses", nargs="+", help="Manual ip addresses of the streams to monitor")
+    parser.add_argument("-c", "--cluster-name", default=DEFAULT_CLUSTER, help="Provide a manual cluster")
+    parser.add_argument("-f", "--frame-limit", type=int, default=10000,
+                        help="How many frames to record from each stream, default is 10,000")
+    parser.add_argument("-d", "--database", default="stream_data.db", help="SQLite database to record to")
+    parser.add_argument("-w", "--decode-workers", type=int, default=10, help="Threads in the shared decode pool")
+    parser.add_argument("-m", "--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT,
+                        help="Most frames a single stream may have queued in the shared decode pool")
+    parser.add_argument("-tm", "--timing-marker", choices=[MARKER_QR, MARKER_STRIP], default=MARKER_QR,
+                        help="How the servers stamp frames: a QR code or a block strip (server TIMING_MARKER=STRIP)")
+    parser.add_argument("-mp", "--metrics-port", type=int,
+                        help="Serve live metrics of every stream on this port, at /metrics and /metrics.json")
+    parser.add_argument("-va", "--variants", nargs="+",
+                        help="Renditions to analyze of every server streaming an ABR ladder, i.e. 486x240 720p 2")
+    parser.add_argument("-o", "--outfile", help="Write the per stream summary to this csv file")
+    return parser
+
+
+def main() -> None:
+    args = get_parser().parse_args()
+    if args.identifiers:
+        ip_addresses = [get_public_ip_ecs_task_by_id(task_identifier=identifier, cluster_name=args.cluster_name)
+                        for identifier in args.identifiers]
+    else:
+        ip_addresses = args.ip_addresses
+    fleet = FleetAnalyzer(ip_addresses, database_name=args.database, decode_workers=args.decode_workers,
+                          max_in_flight_per_stream=args.max_in_flight, record_params=bool(args.identifiers),
+                          timing_marker=args.timing_marker, variants=args.variants)
+    if args.metrics_port is not None:
+        metrics_server = MetricsServer(port=args.metrics_port)
+        for analyzer in fleet.analyzers:
+            metrics_server.register(analyzer)
+        metrics_server.start()
+    try:
+        fleet.run(frame_limit=args.frame_limit)
+        summary = fleet.summarize()
+        print(summary.to_string())
+        if args.outfile:
+            summary.to_csv(args.outfile)
+    finally:
+        fleet.close()
+        for identifier in args.identifiers or []:
+            stop_task_by_id(task_identifier=identifier, cluster_name=args.cluster_name)
+            print(f"Task {identifier} stopped")
+
+
+if __name__ == '__main__':
+    main()
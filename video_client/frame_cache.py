@@ -0,0 +1,106 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import numpy as np
+
+DEFAULT_STRIDE = 4
+
+
+def frame_fingerprint(frame: np.ndarray, stride: int = DEFAULT_STRIDE) -> bytes:
+    """
+    Hash of every `stride`th pixel of one channel of the frame. Cheap compared to finding a QR code, about 0.5ms for
+    1080p at a stride of 4. The stride has to stay below the size of a QR module or timing strip block, or two frames
+    differing only in the code could get the same fingerprint
+    """
+    sample = frame[::stride, ::stride, 1] if frame.ndim == 3 else frame[::stride, ::stride]
+    fingerprint = hashlib.blake2b(np.ascontiguousarray(sample), digest_size=16)
+    fingerprint.update(str(frame.shape).encode())
+    return fingerprint.digest()
+
+
+class DecodeCache:
+    """
+    Small LRU of frame fingerprint -> decoded payload, so a frame the player repeats (a stall or freeze) is not
+    decoded again. Frames whose code could not be read are cached too, with a payload of None. Can be used from any
+    thread. A frame repeated while the first copy is still being decoded waits for that decode instead of starting
+    another one, the decoder of a missed frame has to `store` (or `abandon`) its fingerprint.
+    """
+
+    def __init__(self, capacity: int = 32, stride: int = DEFAULT_STRIDE):
+        self.capacity = capacity
+        self.stride = stride
+        self._payloads: "OrderedDict[bytes, Optional[dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._decoding: Dict[bytes, threading.Event] = {}
+        self.hits = 0
+        self.misses = 0
+        self._window_hits = 0
+        self._window_misses = 0
+
+    def fingerprint(self, frame: np.ndarray) -> bytes:
+        return frame_fingerprint(frame, self.stride)
+
+    def lookup(self, fingerprint: bytes, wait_seconds: float = 1.0) -> Tuple[bool, Optional[dict]]:
+        """
+        :param wait_seconds: how long to wait for a decode of the same frame that is already running, 0 to not wait
+        :return: whether the fingerprint was cached, and a copy of its payload. A miss means the caller decodes
+        """
+        with self._lock:
+            decoding = self._decoding.get(fingerprint)
+        if decoding is not None and wait_seconds:
+            decoding.wait(wait_seconds)
+        with self._lock:
+            if fingerprint not in self._payloads:
+                self.misses += 1
+                self._window_misses += 1
+                self._decoding.setdefault(fingerprint, threading.Event())
+                return False, None
+            self._payloads.move_to_end(fingerprint)
+            self._count_hit()
+            payload = self._payloads[fingerprint]
+        return True, dict(payload) if payload is not None else None
+
+    def _count_hit(self) -> None:
+        self.hits += 1
+        self._window_hits += 1
+
+    def record_hit(self) -> None:
+        """
+        Counts a frame that was resolved from a decode of the same frame without going through `lookup`
+        """
+        with self._lock:
+            self._count_hit()
+
+    def store(self, fingerprint: bytes, payload: Optional[dict]) -> None:
+        with self._lock:
+            self._payloads[fingerprint] = dict(payload) if payload is not None else None
+            self._payloads.move_to_end(fingerprint)
+            if len(self._payloads) > self.capacity:
+                self._payloads.popitem(last=False)
+            decoding = self._decoding.pop(fingerprint, None)
+        if decoding is not None:
+            decoding.set()
+
+    def abandon(self, fingerprint: bytes) -> None:
+        """
+        The decode of a missed frame failed, frames waiting on it decode it themselves
+        """
+        with self._lock:
+            decoding = self._decoding.pop(fingerprint, None)
+        if decoding is not None:
+            decoding.set()
+
+    def take_counts(self) -> Tuple[int, int]:
+        """
+        :return: hits and misses since the last call
+        """
+        with self._lock:
+            counts = self._window_hits, self._window_misses
+            self._window_hits = self._window_misses = 0
+        return counts
+
+    def summary(self) -> str:
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups else 0
+        return f"{self.hits}/{lookups} ({rate:.0%}) frames resolved without decoding"
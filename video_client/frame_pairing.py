@@ -0,0 +1,159 @@
+import statistics
+import threading
+from array import array
+from collections import deque
+from typing import Optional
+from frame_recorder import FrameDict
+from histogram import LogHistogram
+from sliding_windows import SlidingWindowStats
+
+
+class PairingWindow:
+    """
+    Statistics gathered from pairs of consecutively received frames since the last summary was recorded. Latency,
+    time between received frames and decode time are kept as histograms so the window size does not grow with FPS.
+    `frames_repeated` counts frames that carried the same frame number as the frame received before them, i.e. the
+    player repeated a frame or froze
+    """
+    __slots__ = ("frames_dropped", "frames_counted", "frames_repeated", "latency", "interval", "decode")
+
+    def __init__(self):
+        self.frames_dropped = 0
+        self.frames_repeated = 0
+        self.frames_counted = 0
+        self.latency = LogHistogram()
+        self.interval = LogHistogram()
+        self.decode = LogHistogram()
+
+    def average_latency(self) -> float:
+        return self.latency.mean()
+
+
+class FramePairingEngine:
+    """
+    Pairs every decoded frame with the frames received right before and after it to count dropped frames, FPS and
+    latency. Frames are kept in a fixed size ring indexed by `frame_number_received`, with one preallocated column per
+    FrameDict field, so a slot is simply overwritten once the ring wraps around. Each StreamAnalyzer owns its own
+    engine, and results can be added from any thread.
+
+    When only a sample of the frames is QR decoded (`pair_frames=False`) decoded frames are not paired, they only add
+    their latency. Drops and the time between frames then come from the container timestamp of every frame, given
+    to `add_timestamp`.
+
+    Everything added to the window is also given to `sliding` if set, by the time the frame was received, and added to
+`totals`, which is never reset and is what the live metrics endpoint reads.
+    """
+
+    def __init__(self, capacity: int = 64, pair_frames: bool = True, sliding: SlidingWindowStats = None):
+        self.capacity = capacity
+        self.pair_frames = pair_frames
+        self.sliding = sliding
+        self._received = array("q", [-1] * capacity)
+        self._frame_number = array("q", [0] * capacity)
+        self._time_generated = array("d", [0.0] * capacity)
+        self._time_received = array("d", [0.0] * capacity)
+        self._lock = threading.Lock()
+        self.latest_received = -1
+        self.window = PairingWindow()
+        self.totals = PairingWindow()
+        self._windows = (self.window, self.totals)
+        self._last_pts = -1.0
+        self._last_time_received = -1.0
+        # Recent differences between timestamps, their median is taken as the time between two frames
+        self._pts_steps = deque(maxlen=64)
+
+    def add(self, data: Optional[FrameDict]) -> None:
+        """
+        Stores a decoded frame and computes statistics for every pair of neighbours that is now complete
+        """
+        if data is None:
+            return
+        frame_number_received = data.frame_number_received
+        slot = frame_number_received % self.capacity
+        with self._lock:
+            if self._received[slot] > frame_number_received:
+                return  # Arrived after its slot was reused, its neighbours are gone too
+            self._received[slot] = frame_number_received
+            self._frame_number[slot] = data.frame_number
+            self._time_generated[slot] = data.time_generated
+            self._time_received[slot] = data.time_received
+            for window in self._windows:
+                window.decode.record(data.decode_seconds)
+            if not self.pair_frames:
+                if data.time_generated != -1:
+                    latency = data.time_received - data.time_generated
+                    for window in self._windows:
+                        window.latency.record(latency)
+                    if self.sliding is not None:
+                        self.sliding.record_latency(data.time_received, latency)
+                return
+            if frame_number_received > self.latest_received:
+                self.latest_received = frame_number_received
+            if frame_number_received != 0 and self._received[(slot - 1) % self.capacity] == frame_number_received - 1:
+                self._calculate_statistics((slot - 1) % self.capacity, slot)
+            if self._received[(slot + 1) % self.capacity] == frame_number_received + 1:
+                self._calculate_statistics(slot, (slot + 1) % self.capacity)
+
+    def _calculate_statistics(self, slot1: int, slot2: int) -> None:
+        # Unreadable frames all carry frame number -1, two of them in a row are an outage and not a repeat
+        error_pair = self._frame_number[slot1] < 0 or self._frame_number[slot2] < 0
+        if not error_pair and self._frame_number[slot1] == self._frame_number[slot2]:
+            for window in self._windows:
+                window.frames_repeated += 1
+            return
+        dropped = self._frame_number[slot1] != self._frame_number[slot2] - 1
+        interval = self._time_received[slot2] - self._time_received[slot1]
+        latency = None
+        if self._time_generated[slot1] != -1:
+            latency = self._time_received[slot1] - self._time_generated[slot1]
+        for window in self._windows:
+            window.frames_dropped += dropped
+            window.interval.record(interval)
+            window.frames_counted += 1
+            if latency is not None:
+                window.latency.record(latency)
+        if self.sliding is not None:
+            self.sliding.record_interval(self._time_received[slot2], interval, dropped)
+            if latency is not None:
+                jitter = None
+                if self._time_generated[slot2] != -1:
+                    jitter = abs(self._time_received[slot2] - self._time_generated[slot2] - latency)
+                self.sliding.record_latency(self._time_received[slot1], latency, jitter)
+
+    def add_timestamp(self, pts: float, time_received: float) -> None:
+        """
+        Counts a frame from its container timestamp, for frames that are not QR decoded. A jump between timestamps of
+        more than 1.5 frames counts as a drop, like a jump in QR frame numbers does
+        :param pts: presentation timestamp in seconds, -1 if the capture could not tell
+        """
+        with self._lock:
+            if self._last_time_received != -1:
+                step = pts - self._last_pts
+                dropped = False
+                if pts != -1 and self._last_pts != -1 and step > 0:
+                    self._pts_steps.append(step)
+                    dropped = step > 1.5 * statistics.median(self._pts_steps)
+                for window in self._windows:
+                    window.interval.record(time_received - self._last_time_received)
+                    window.frames_counted += 1
+                    window.frames_dropped += dropped
+                if self.sliding is not None:
+                    self.sliding.record_interval(time_received, time_received - self._last_time_received, dropped)
+            self._last_pts = pts
+            self._last_time_received = time_received
+
+    def take_window(self) -> PairingWindow:
+        """
+        :return: the statistics gathered since the last call, and starts a new window
+        """
+        with self._lock:
+            window, self.window = self.window, PairingWindow()
+            self._windows = (self.window, self.totals)
+        return window
+
+    def buffered_frames(self) -> int:
+        """
+        Number of ring slots holding one of the last `capacity` received frames
+        """
+        cutoff = self.latest_received - self.capacity
+        return sum(1 for received in self._received if received > cutoff and received >= 0)
@@ -0,0 +1,118 @@
+import threading
+import time
+from typing import List, Optional, Tuple
+import numpy as np
+from histogram import LogHistogram
+
+
+class FramePoolWindow:
+    """
+    Pool statistics since the last summary was recorded. `exhausted` counts the times a buffer was wanted while all
+    `max_buffers` were leased out, `wait` is how long those waits took
+    """
+    __slots__ = ("max_leased", "exhausted", "wait", "grown")
+
+    def __init__(self):
+        self.max_leased = 0
+        self.exhausted = 0
+        self.wait = LogHistogram()
+        self.grown = 0
+
+
+class FramePool:
+    """
+    Preallocated frame buffers for `VideoCapture.read(image=...)`, so reading a frame does not allocate a new array
+    every time. A buffer is leased when a frame is read into it and given back once the frame is decoded (or dropped).
+    The pool starts with `initial_buffers`, sized to the pipeline depth, and only allocates more while fewer than
+    `max_buffers` exist. Past that `acquire` waits for a buffer to come back, which holds up reading the stream the
+    same way a full capture queue does.
+
+    Buffers are allocated once the frame shape is known, from the first frame read without a buffer. If the shape
+    changes the old buffers are dropped as they come back.
+    """
+
+    def __init__(self, initial_buffers: int = 12, max_buffers: int = 96):
+        self.initial_buffers = initial_buffers
+        self.max_buffers = max(max_buffers, initial_buffers)
+        self._free: List[np.ndarray] = []
+        self._condition = threading.Condition()
+        self._shape: Optional[Tuple[int, ...]] = None
+        self._dtype: Optional[np.dtype] = None
+        self.allocated = 0
+        self.leased = 0
+        self.window = FramePoolWindow()
+
+    @property
+    def frame_shape(self) -> Optional[Tuple[int, ...]]:
+        return self._shape
+
+    def _fits(self, buffer: np.ndarray) -> bool:
+        return buffer.shape == self._shape and buffer.dtype == self._dtype
+
+    def acquire(self, timeout: float = None) -> Optional[np.ndarray]:
+        """
+        :return: a free buffer, or None if the frame shape is not known yet or none came back within the timeout
+        """
+        with self._condition:
+            if self._shape is None:
+                return None
+            if not self._free and self.allocated >= self.max_buffers:
+                self.window.exhausted += 1
+                wait_start = time.perf_counter()
+                self._condition.wait_for(lambda: self._free or self.allocated < self.max_buffers, timeout=timeout)
+                self.window.wait.record(time.perf_counter() - wait_start)
+            if self._free:
+                buffer = self._free.pop()
+            elif self.allocated < self.max_buffers:
+                buffer = np.empty(self._shape, dtype=self._dtype)
+                self.allocated += 1
+                self.window.grown += 1
+            else:
+                return None
+            self._lease()
+            return buffer
+
+    def _lease(self) -> None:
+        self.leased += 1
+        if self.leased > self.window.max_leased:
+            self.window.max_leased = self.leased
+
+    def adopt(self, frame: np.ndarray) -> None:
+        """
+        Takes in a frame that was read without a pool buffer (i.e. the first frame, the first after a resolution
+        change, or one read while the pool was exhausted) as a leased buffer, and sets the pool up for frames of its
+        shape. A frame that takes the pool past `max_buffers` is dropped again when it is released
+        """
+        with self._condition:
+            if self._shape != frame.shape or self._dtype != frame.dtype:
+                self._shape = frame.shape
+                self._dtype = frame.dtype
+                self.allocated -= len(self._free)
+                self._free = [np.empty(frame.shape, dtype=frame.dtype)
+                              for _ in range(max(self.initial_buffers - self.leased - 1, 0))]
+                self.allocated += len(self._free)
+            self.allocated += 1
+            self._lease()
+
+    def release(self, buffer: Optional[np.ndarray]) -> None:
+        """
+        Gives a leased buffer back once nothing uses its frame anymore
+        """
+        if buffer is None:
+            return
+        with self._condition:
+            self.leased -= 1
+            if self._fits(buffer) and self.allocated <= self.max_buffers:
+                self._free.append(buffer)
+            else:
+                self.allocated -= 1
+            self._condition.notify()
+
+    def take_window(self) -> FramePoolWindow:
+        with self._condition:
+            window, self.window = self.window, FramePoolWindow()
+            self.window.max_leased = self.leased
+        return window
+
+    def summary(self) -> str:
+        return f"{self.allocated} buffers of {self.max_buffers}, {self.leased} leased"
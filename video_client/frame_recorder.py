@@ -1,9 +1,18 @@
 import time
 from dataclasses import dataclass
+from typing import Optional
 from numpy import ndarray
 import cv2
 import json
-import sqlite3
+from db_writer import DatabaseWriter
+from frame_cache import DecodeCache
+from qr_locator import QRLocator
+from stage_profiler import STAGE_DB_INSERT, STAGE_DETECT, STAGE_FINGERPRINT, STAGE_PARSE, STAGE_SCHEDULE, \
+    StageProfiler
+from timing_marker import read_marker
+
+MARKER_QR = "qr"
+MARKER_STRIP = "strip"
 
 @dataclass
 class FrameDict:
@@ -15,6 +24,8 @@ class FrameDict:
     time_generated: time.time
     time_received: time.time
     analysis_number: int
+    confidence: float = 1.0
+    decode_seconds: float = 0.0
 
     def is_error_frame(self) -> bool:
         return self.time_generated == -1
@@ -30,39 +41,111 @@ class FrameRecorder:
     frame_received_counter: int
     time: float
     analysis_number: int
+    timing_marker: str = MARKER_QR
 
-    def process_frame(self, db_name: str, table_name: str="stream_data", no_logging: bool=False) -> FrameDict:
+    def process_frame(self, db_writer: DatabaseWriter, table_name: str="stream_data", no_logging: bool=False,
+                      qr_locator: QRLocator=None, decode_cache: DecodeCache=None, profiler: StageProfiler=None,
+                      submitted_at: float=None) -> FrameDict:
         """
-        Decodes frames and puts them into SQL database
+        Decodes frames and queues them to be written to the SQL database
+        :param qr_locator: locator shared between frames so the QR code position can be reused, a fresh one is used
+        if not given
+        :param decode_cache: if given, a frame identical to a recently decoded one gets that frame's payload without
+        being decoded again
+        :param profiler: times each step of decoding the frame if set
+        :param submitted_at: `time.perf_counter` when the frame was handed to the decode pool, to time the wait for a
+        decode thread
         """
-        qr_decoder = cv2.QRCodeDetector()
+        start_decode = time.perf_counter()
+        if profiler is not None and submitted_at is not None:
+            profiler.record(STAGE_SCHEDULE, start_decode - submitted_at)
+        fingerprint = None
+        if decode_cache is not None:
+            fingerprint = decode_cache.fingerprint(self.frame)
+            found, payload = decode_cache.lookup(fingerprint)
+            if profiler is not None:
+                profiler.record(STAGE_FINGERPRINT, time.perf_counter() - start_decode)
+            if found:
+                if no_logging:
+                    return
+                return self.record_payload(payload, db_writer=db_writer, table_name=table_name,
+                                           decode_seconds=time.perf_counter() - start_decode, profiler=profiler)
         try:
-            original_val, pts, st_code = qr_decoder.detectAndDecode(self.frame)
+            payload = self.decode_payload(qr_locator, profiler=profiler)
         except cv2.error as e:
+            if decode_cache is not None:
+                decode_cache.abandon(fingerprint)
             print(f"Frame dropped! Frame number {self.frame_received_counter}")
             cv2.imwrite(f"frame/frame_{self.frame_received_counter}.png", self.frame)
             raise e
+        if decode_cache is not None:
+            decode_cache.store(fingerprint, payload)
         if no_logging:
             return
-        values = original_val.replace("'", '"')
-        try:
-            values = json.loads(values)
-        except json.decoder.JSONDecodeError:
+        return self.record_payload(payload, db_writer=db_writer, table_name=table_name,
+                                   decode_seconds=time.perf_counter() - start_decode, profiler=profiler)
+
+    def decode_payload(self, qr_locator: QRLocator=None, profiler: StageProfiler=None) -> Optional[dict]:
+        """
+        Reads the timing marker of the frame, raises `cv2.error` if OpenCV fails on the frame
+        :return: the payload, or None if the marker could not be read
+        """
+        detect_start = time.perf_counter()
+        if self.timing_marker == MARKER_STRIP:
+            reading = read_marker(self.frame)
+            if profiler is not None:
+                profiler.record(STAGE_DETECT, time.perf_counter() - detect_start)
+            return reading._asdict() if reading is not None else None
+        if qr_locator is None:
+            qr_locator = QRLocator()
+        original_val, pts = qr_locator.detect_and_decode(self.frame)
+        parse_start = time.perf_counter()
+        payload = parse_qr_payload(original_val)
+        if profiler is not None:
+            profiler.record(STAGE_DETECT, parse_start - detect_start)
+            profiler.record(STAGE_PARSE, time.perf_counter() - parse_start)
+        return payload
+
+    def record_payload(self, values: Optional[dict], db_writer: DatabaseWriter, table_name: str="stream_data",
+                       decode_seconds: float=0.0, profiler: StageProfiler=None) -> FrameDict:
+        """
+        Queues the decoded payload of this frame for the database and returns it as a FrameDict. A payload of None
+        means the QR code or timing strip could not be read and gives back an error frame
+        :param decode_seconds: time it took to find and decode the payload
+        """
+        if values is None:
             return FrameDict(**{"frame_number": -1, "frame_number_received": self.frame_received_counter, "time_generated": -1,
-                    "time_received": self.time, "analysis_number": self.analysis_number})
+                    "time_received": self.time, "analysis_number": self.analysis_number, "confidence": 0.0,
+                    "decode_seconds": decode_seconds})
         frame_number = values['frame_number']
         time_generated = values['time']
+        confidence = values.get("confidence", 1.0)
         insert_sql = f"INSERT INTO {table_name}(frame_number, frame_number_received," \
-                     " time_generated, time_received, analysis_number) VALUES(?,?,?,?,?)"
-        values = [frame_number, self.frame_received_counter, time_generated, self.time, self.analysis_number]
-        connection = sqlite3.connect(db_name)
-        cursor = connection.cursor()
-        cursor.execute(insert_sql, values)
-        connection.commit()
-        connection.close()
+                     " time_generated, time_received, analysis_number, confidence) VALUES(?,?,?,?,?,?)"
+        values = [frame_number, self.frame_received_counter, time_generated, self.time, self.analysis_number,
+                  confidence]
+        insert_start = time.perf_counter()
+        db_writer.insert(insert_sql, values)
+        if profiler is not None:
+            profiler.record(STAGE_DB_INSERT, time.perf_counter() - insert_start)
         values_dict = FrameDict(**{"frame_number": frame_number, "frame_number_received": self.frame_received_counter,
                                    "time_generated": time_generated, "time_received": self.time,
-                                   "analysis_number": self.analysis_number})
+                                   "analysis_number": self.analysis_number,
+                                   "confidence": confidence, "decode_seconds": decode_seconds})
         return values_dict
 
 
+def parse_qr_payload(original_val: str) -> Optional[dict]:
+    """
+    Parses the payload the streamer puts in its QR codes. The streamer writes a python dict, so the quotes have to be
+    swapped before it is valid json
+    :return: dict with at least `frame_number` and `time`, or None if the payload could not be read
+    """
+    values = original_val.replace("'", '"')
+    try:
+        values = json.loads(values)
+    except json.decoder.JSONDecodeError:
+        return None
+    if not isinstance(values, dict) or "frame_number" not in values or "time" not in values:
+        return None
+    return values
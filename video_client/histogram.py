@@ -0,0 +1,135 @@
+import json
+import sqlite3
+from array import array
+from typing import Iterable, Optional
+
+SUB_BUCKET_BITS = 7
+MAX_VALUE_BITS = 36
+_SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+_HALF = _SUB_BUCKETS >> 1
+BUCKET_COUNT = _SUB_BUCKETS + (MAX_VALUE_BITS - SUB_BUCKET_BITS) * _HALF
+
+
+def _bucket_index(value: int) -> int:
+    if value < _SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    index = _SUB_BUCKETS + (shift - 1) * _HALF + (value >> shift) - _HALF
+    return min(index, BUCKET_COUNT - 1)
+
+
+def _bucket_bounds(index: int):
+    """
+    :return: (lowest, highest) integer value that falls into the bucket
+    """
+    if index < _SUB_BUCKETS:
+        return index, index
+    shift = (index - _SUB_BUCKETS) // _HALF + 1
+    mantissa = (index - _SUB_BUCKETS) % _HALF + _HALF
+    return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+
+class LogHistogram:
+    """
+    Constant memory histogram in the style of HdrHistogram. Values are stored as integer multiples of `resolution`
+    (microseconds by default) in log2 buckets that are each split into 64 linear sub buckets, so every recorded value
+    is known to within about 1.5% and the whole histogram is a fixed array of about 2000 counts. Values below zero
+    are counted in the lowest bucket, the exact min and max are kept on the side. Histograms with the same resolution
+    can be merged, so windows can be combined across runs.
+    """
+
+    def __init__(self, resolution: float = 1e-6):
+        self.resolution = resolution
+        self.counts = array("q", [0]) * BUCKET_COUNT
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def record(self, value: float) -> None:
+        self.counts[_bucket_index(max(int(value / self.resolution), 0))] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other: "LogHistogram") -> "LogHistogram":
+        if other.resolution != self.resolution:
+            raise AssertionError(f"Cannot merge histograms with resolution {other.resolution} and {self.resolution}")
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+        return self
+
+    def mean(self) -> float:
+        if not self.count:
+            return 0
+        return self.total / self.count
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """
+        :param percent: percentile between 0 and 100
+        :return: value at that percentile (middle of its bucket, clamped to the recorded min/max), None if empty
+        """
+        if not self.count:
+            return None
+        target = max(int(round(percent / 100 * self.count)), 1)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                low, high = _bucket_bounds(index)
+                value = (low + high) / 2 * self.resolution
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def to_json(self) -> str:
+        """
+        Serializes to a sparse json document of non empty buckets, used for the *_histogram columns
+        """
+        buckets = [[index, count] for index, count in enumerate(self.counts) if count]
+        return json.dumps({"resolution": self.resolution, "sub_bucket_bits": SUB_BUCKET_BITS, "count": self.count,
+                           "total": self.total, "min": self.min, "max": self.max, "buckets": buckets})
+
+    @classmethod
+    def from_json(cls, serialized: str) -> "LogHistogram":
+        data = json.loads(serialized)
+        if data["sub_bucket_bits"] != SUB_BUCKET_BITS:
+            raise AssertionError(f"Histogram was stored with {data['sub_bucket_bits']} sub bucket bits, "
+                                 f"expected {SUB_BUCKET_BITS}")
+        histogram = cls(resolution=data["resolution"])
+        for index, count in data["buckets"]:
+            histogram.counts[index] = count
+        histogram.count = data["count"]
+        histogram.total = data["total"]
+        histogram.min = data["min"]
+        histogram.max = data["max"]
+        return histogram
+
+
+def load_merged_histogram(database_name: str, column: str = "latency_histogram",
+                          analysis_numbers: Iterable[int] = None) -> LogHistogram:
+    """
+    Merges the per window histograms stored in `stream_data_final`, i.e. to get fleet level percentiles over many runs
+    :param column: one of latency_histogram, interval_histogram or decode_histogram
+    :param analysis_numbers: runs to merge, all runs if not given
+    """
+    sql = f"SELECT {column} FROM stream_data_final WHERE {column} IS NOT NULL"
+    values = []
+    if analysis_numbers is not None:
+        values = list(analysis_numbers)
+        sql += f" AND analysis_number IN ({','.join('?' * len(values))})"
+    connection = sqlite3.connect(database_name)
+    merged = LogHistogram()
+    for serialized, in connection.execute(sql, values):
+        merged.merge(LogHistogram.from_json(serialized))
+    connection.close()
+    return merged
@@ -0,0 +1,598 @@
+import argparse
+import io
+import os
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Deque, List, NamedTuple, Optional, Set, Tuple
+from urllib.parse import urljoin
+import cv2
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from db_writer import DatabaseWriter
+from recording import StreamRecorder
+from ts_timestamps import SegmentTimestamps, read_ts_timestamps
+
+INGEST_OPENCV = "opencv"
+INGEST_HLS = "hls"
+INGEST_MODES = [INGEST_OPENCV, INGEST_HLS]
+SEGMENT_TIMINGS_TABLE = "segment_timings"
+# Raised by parse_playlist and read_ts_timestamps on a malformed playlist or segment
+PARSE_ERRORS = (ValueError, IndexError, struct.error)
+# Where a segment is written to when this OpenCV build cannot decode from a python buffer, memory backed on linux
+_SPILL_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+class PlaylistSegment(NamedTuple):
+    sequence: int
+    uri: str
+    duration: float
+
+
+class Variant(NamedTuple):
+    bandwidth: int
+    uri: str
+    width: int = 0
+    height: int = 0
+
+    @property
+    def name(self) -> str:
+        return f"{self.width}x{self.height}" if self.height else self.uri.rsplit("/", 1)[-1]
+
+
+@dataclass
+class MediaPlaylist:
+    target_duration: float
+    media_sequence: int
+    segments: List[PlaylistSegment]
+    ended: bool
+
+
+@dataclass
+class SegmentTiming:
+    """
+    When one segment went through each step of ingestion, all `time.time()` on the client clock
+    * time_listed: first playlist poll the segment appeared in
+    * time_request / time_first_byte / time_arrived: download started, response headers came in, last byte came in
+    * decode_seconds: time spent decoding its frames, time_decoded: done with its last frame
+    Frames read from it are numbered `first_frame_received` to `first_frame_received + frames - 1`, the same numbers
+    as `frame_number_received` in `stream_data`
+    """
+    sequence: int
+    uri: str
+    duration: float
+    time_listed: float
+    time_request: float = 0.0
+    time_first_byte: float = 0.0
+    time_arrived: float = 0.0
+    size_bytes: int = 0
+    first_frame_received: int = -1
+    frames: int = 0
+    decode_seconds: float = 0.0
+    time_decoded: float = 0.0
+    data: Optional[bytes] = field(default=None, repr=False)
+    timestamps: Optional[SegmentTimestamps] = field(default=None, repr=False)
+
+
+def parse_playlist(text: str, playlist_url: str) -> Tuple[Optional[MediaPlaylist], List[Variant]]:
+    """
+    Parses an m3u8 playlist. Segment and variant uris are made absolute against `playlist_url`
+    :return: the media playlist, or None and the variants if it is a master playlist
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not lines or lines[0] != "#EXTM3U":
+        raise AssertionError(f"{playlist_url} is not an m3u8 playlist")
+    target_duration = 0.0
+    media_sequence = 0
+    segments: List[PlaylistSegment] = []
+    variants: List[Variant] = []
+    ended = False
+    duration = 0.0
+    bandwidth = None
+    resolution = (0, 0)
+    for line in lines[1:]:
+        if line.startswith("#EXT-X-TARGETDURATION:"):
+            target_duration = float(line.split(":", 1)[1])
+        elif line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+            media_sequence = int(line.split(":", 1)[1])
+        elif line.startswith("#EXTINF:"):
+            duration = float(line.split(":", 1)[1].split(",")[0])
+        elif line.startswith("#EXT-X-STREAM-INF:"):
+            attributes = line.split(":", 1)[1]
+            bandwidth = 0
+            resolution = (0, 0)
+            for attribute in attributes.split(","):
+                if attribute.startswith("BANDWIDTH="):
+                    bandwidth = int(attribute.split("=", 1)[1])
+                elif attribute.startswith("RESOLUTION="):
+                    width, height = attribute.split("=", 1)[1].lower().split("x")
+                    resolution = (int(width), int(height))
+        elif line == "#EXT-X-ENDLIST":
+            ended = True
+        elif not line.startswith("#"):
+            uri = _resolve(playlist_url, line)
+            if bandwidth is not None:
+                variants.append(Variant(bandwidth, uri, *resolution))
+                bandwidth = None
+            else:
+                segments.append(PlaylistSegment(media_sequence + len(segments), uri, duration))
+    if variants:
+        return None, variants
+    return MediaPlaylist(target_duration, media_sequence, segments, ended), variants
+
+
+def select_variant(variants: List[Variant], variant: str = None) -> Variant:
+    """
+    :param variant: a resolution like 1280x720, a height like 720p, or the index of the variant in the master
+    playlist. The first variant if not given
+    """
+    if variant is None:
+        return variants[0]
+    variant = variant.strip().lower()
+    for candidate in variants:
+        if variant == candidate.name.lower() or (variant.endswith("p") and variant[:-1] == str(candidate.height)):
+            return candidate
+    if variant.isdigit() and int(variant) < len(variants):
+        return variants[int(variant)]
+    raise AssertionError(f"No variant {variant} in the master playlist, it has "
+                         f"{', '.join(candidate.name for candidate in variants)}")
+
+
+def resolve_variant_url(playlist_url: str, variant: str = None) -> str:
+    """
+    :return: the url of the media playlist of `variant` if `playlist_url` is a master playlist, else `playlist_url`
+    """
+    if _is_remote(playlist_url):
+        response = requests.get(playlist_url, timeout=10)
+        response.raise_for_status()
+        text = response.text
+    else:
+        with open(playlist_url) as playlist_file:
+            text = playlist_file.read()
+    playlist, variants = parse_playlist(text, playlist_url)
+    if playlist is not None:
+        if variant is not None:
+            raise AssertionError(f"{playlist_url} is a media playlist, variant {variant} can't be selected from it")
+        return playlist_url
+    return select_variant(variants, variant).uri
+
+
+def _is_remote(url: str) -> bool:
+    return url.startswith("http://") or url.startswith("https://")
+
+
+def _resolve(playlist_url: str, uri: str) -> str:
+    if _is_remote(uri) or os.path.isabs(uri):
+        return uri
+    if _is_remote(playlist_url):
+        return urljoin(playlist_url, uri)
+    return os.path.join(os.path.dirname(playlist_url), uri)
+
+
+def create_segment_timings_table(cursor: sqlite3.Cursor) -> None:
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {SEGMENT_TIMINGS_TABLE} (analysis_number INT, sequence INT, "
+                   f"uri TEXT, duration FLOAT, time_listed FLOAT, time_request FLOAT, time_first_byte FLOAT, "
+                   f"time_arrived FLOAT, size_bytes INT, first_frame_received INT, frames INT, decode_seconds FLOAT, "
+                   f"time_decoded FLOAT)")
+
+
+class HLSIngester:
+    """
+    Reads an HLS stream segment by segment instead of handing the playlist to `cv2.VideoCapture`, so the time a frame
+    spends being packaged, downloaded and decoded can be told apart. A poller thread reloads the playlist over one
+    keep-alive `requests.Session` and starts downloading every new segment right away on a small pool, so up to
+    `prefetch` segments download in parallel while earlier ones are being decoded. Segments are decoded from the
+    downloaded bytes, without going through a file. The container timestamps of every segment are read when it
+    arrives, so frames can be counted and timed by `grab` without decoding them.
+
+    Has the parts of the `cv2.VideoCapture` interface `capture.CaptureThread` uses (`grab`, `retrieve`, `read`,
+    `isOpened`, `get`, `release`). `playlist_url` may also be a local directory (or .m3u8 file in one) holding a static HLS stream.
+    """
+
+    def __init__(self, playlist_url: str, prefetch: int = 3, live_edge_segments: int = 3,
+                 poll_interval: float = None, db_writer: DatabaseWriter = None, analysis_number: int = None,
+                 read_timeout: float = 30, recorder: StreamRecorder = None, variant: str = None,
+                 blocking_reload: bool = False):
+        """
+        :param live_edge_segments: how many segments from the end of a live playlist to start at, a finished
+        (#EXT-X-ENDLIST) playlist is always read from the start
+        :param poll_interval: seconds between playlist reloads, half the target duration if not given
+        :param db_writer: writes a `segment_timings` row for every segment if given
+        :param read_timeout: give up when no new segment arrived for this long
+        :param recorder: tees every downloaded segment and which frames came from it to disk if given
+        :param variant: rendition to read from a master playlist, see `select_variant`
+        :param blocking_reload: reload the playlist with `_HLS_msn` set to the next segment, so a server that supports
+        it (flask_server.py with LOW_LATENCY) answers as soon as the segment is written. Reloads go back to polling
+        every `poll_interval` while the server answers without a new segment
+        """
+        if os.path.isdir(playlist_url):
+            playlist_url = os.path.join(playlist_url, "stream.m3u8")
+        self.playlist_url = playlist_url
+        self.prefetch = prefetch
+        self.live_edge_segments = live_edge_segments
+        self.poll_interval = poll_interval
+        self.db_writer = db_writer
+        self.analysis_number = analysis_number
+        self.read_timeout = read_timeout
+        self.recorder = recorder
+        self.variant = variant
+        self.blocking_reload = blocking_reload
+        self.target_duration = 0.0
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=prefetch + 1))
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=prefetch + 1))
+        self._downloads = ThreadPoolExecutor(max_workers=prefetch, thread_name_prefix="hls-segment")
+        self._pending: Deque[Tuple[SegmentTiming, Future]] = deque()
+        self._pending_ready = threading.Condition()
+        self._seen: Set[int] = set()
+        self._ended = False
+        self._stop_requested = threading.Event()
+        self._poller: Optional[threading.Thread] = None
+        self._segment: Optional[SegmentTiming] = None
+        self._decoder: Optional[cv2.VideoCapture] = None
+        # OpenCV does not keep the buffer it decodes from alive, it has to outlive the decoder
+        self._buffer: Optional[io.BytesIO] = None
+        self._spill_path: Optional[str] = None
+        # Frame of the current segment that was grabbed last, and how many of its frames were decoded
+        self._position = -1
+        self._decoded = 0
+        # Presentation timestamp in seconds and keyframe flag of the frame grabbed last, None if not known
+        self.frame_pts: Optional[float] = None
+        self.frame_keyframe: Optional[bool] = None
+        self.reads = 0
+        self.segments_read = 0
+        self.segments_failed = 0
+        # Set once there are no more segments to read: the playlist ended, none came within `read_timeout` or the
+        # ingester was released
+        self.end_of_stream = False
+        self.opened = False
+        self.frame_width = 0
+        self.frame_height = 0
+        self.fps = 0.0
+        self._open()
+
+    def _fetch(self, url: str, timing: SegmentTiming = None, timeout: float = 10) -> bytes:
+        if timing is not None:
+            timing.time_request = time.time()
+        if not _is_remote(url):
+            with open(url, "rb") as segment_file:
+                if timing is not None:
+                    timing.time_first_byte = time.time()
+                return segment_file.read()
+        response = self.session.get(url, timeout=timeout, stream=timing is not None)
+        response.raise_for_status()
+        if timing is not None:
+            timing.time_first_byte = time.time()
+        return response.content
+
+    def _load_playlist(self, next_sequence: int = None) -> Optional[MediaPlaylist]:
+        """
+        :param next_sequence: block until the playlist lists this media sequence number, on servers that support it
+        """
+        url, timeout = self.playlist_url, 10
+        if next_sequence is not None and _is_remote(url):
+            url += ("&" if "?" in url else "?") + f"_HLS_msn={next_sequence}"
+            # The server holds the request for up to three target durations
+            timeout += 3 * self.target_duration
+        playlist, variants = parse_playlist(self._fetch(url, timeout=timeout).decode(), self.playlist_url)
+        if playlist is None:
+            self.playlist_url = select_variant(variants, self.variant).uri
+            playlist, _ = parse_playlist(self._fetch(self.playlist_url).decode(), self.playlist_url)
+        return playlist
+
+    def _open(self) -> None:
+        try:
+            playlist = self._load_playlist()
+        except (requests.RequestException, OSError, AssertionError) + PARSE_ERRORS as e:
+            print(f"Could not load playlist {self.playlist_url}: {e}")
+            return
+        segments = playlist.segments
+        if not playlist.ended:
+            segments = segments[-self.live_edge_segments:]
+        # Segments before the starting point are never read, but must not be fetched by the first reload either
+        self._seen.update(segment.sequence for segment in playlist.segments)
+        self._queue_segments(segments, time.time())
+        self._ended = playlist.ended
+        self.target_duration = playlist.target_duration
+        if self.poll_interval is None:
+            self.poll_interval = max(playlist.target_duration / 2, 0.1)
+        self.opened = True
+        if not self._ended:
+            self._poller = threading.Thread(target=self._poll, daemon=True, name="hls-playlist")
+            self._poller.start()
+
+    def _queue_segments(self, segments: List[PlaylistSegment], time_listed: float) -> None:
+        with self._pending_ready:
+            for segment in segments:
+                self._seen.add(segment.sequence)
+                timing = SegmentTiming(sequence=segment.sequence, uri=segment.uri, duration=segment.duration,
+                                       time_listed=time_listed)
+                self._pending.append((timing, self._downloads.submit(self._download, timing)))
+            self._pending_ready.notify_all()
+
+    def _download(self, timing: SegmentTiming) -> SegmentTiming:
+        timing.data = self._fetch(timing.uri, timing)
+        timing.time_arrived = time.time()
+        timing.size_bytes = len(timing.data)
+        if self.recorder is not None:
+            self.recorder.save_segment_data(timing.sequence, timing.data)
+        timestamps = read_ts_timestamps(timing.data)
+        if len(timestamps.pts):
+            timing.timestamps = timestamps
+        return timing
+
+    def _poll(self) -> None:
+        wait = self.poll_interval
+        while not self._stop_requested.wait(wait):
+            wait = self.poll_interval
+            next_sequence = max(self._seen) + 1 if self.blocking_reload and self._seen else None
+            try:
+                playlist = self._load_playlist(next_sequence)
+            except (requests.RequestException, OSError, AssertionError) + PARSE_ERRORS as e:
+                print(f"Playlist reload failed: {e}")
+                continue
+            time_listed = time.time()
+            new_segments = [segment for segment in playlist.segments if segment.sequence not in self._seen]
+            self._queue_segments(new_segments, time_listed)
+            if self.blocking_reload and new_segments:
+                # Ask for the next one straight away, the server holds the request until it is written
+                wait = 0
+            if playlist.ended:
+                with self._pending_ready:
+                    self._ended = True
+                    self._pending_ready.notify_all()
+                return
+
+    def _next_segment(self) -> bool:
+        """
+        Waits for the next segment in playlist order. Its decoder is only opened once a frame is retrieved from it
+        :return: False if the stream ended or no segment came within `read_timeout`
+        """
+        with self._pending_ready:
+            if not self._pending_ready.wait_for(lambda: self._pending or self._ended or self._stop_requested.is_set(),
+                                                timeout=self.read_timeout):
+                print(f"No new segment for {self.read_timeout}s")
+                self.end_of_stream = True
+                return False
+            if not self._pending:
+                self.end_of_stream = True
+                return False
+            timing, future = self._pending.popleft()
+        try:
+            future.result()
+        except (requests.RequestException, OSError) + PARSE_ERRORS as e:
+            self.segments_failed += 1
+            print(f"Segment {timing.sequence} could not be downloaded or read: {e!r}")
+            return True
+        self._segment = timing
+        self._position = -1
+        self._decoded = 0
+        return True
+
+    def _open_decoder(self, data: bytes) -> cv2.VideoCapture:
+        try:
+            self._buffer = io.BytesIO(data)
+            decoder = cv2.VideoCapture(self._buffer, cv2.CAP_FFMPEG, [])
+            if decoder.isOpened():
+                return decoder
+        except (cv2.error, TypeError):
+            pass  # OpenCV before 4.10 can only open files
+        self._buffer = None
+        self._remove_spill_file()
+        descriptor, self._spill_path = tempfile.mkstemp(suffix=".ts", dir=_SPILL_DIR)
+        with os.fdopen(descriptor, "wb") as spill_file:
+            spill_file.write(data)
+        return cv2.VideoCapture(self._spill_path)
+
+    def _remove_spill_file(self) -> None:
+        if self._spill_path is not None:
+            os.remove(self._spill_path)
+            self._spill_path = None
+
+    def _decode_next(self) -> bool:
+        """
+        Decodes the next frame of the current segment, without converting it to BGR
+        """
+        timing = self._segment
+        if self._decoder is None:
+            self._decoder = self._open_decoder(timing.data)
+        decode_start = time.perf_counter()
+        ret = self._decoder.grab()
+        timing.decode_seconds += time.perf_counter() - decode_start
+        if ret:
+            self._decoded += 1
+        return ret
+
+    def _finish_segment(self) -> None:
+        timing = self._segment
+        if self._decoder is not None:
+            self._decoder.release()
+            self._decoder = None
+        self._buffer = None
+        self._segment = None
+        timing.data = None
+        self._remove_spill_file()
+        self.segments_read += 1
+        timing.time_decoded = time.time()
+        self._record_segment(timing)
+        if self.db_writer is not None:
+            self.db_writer.insert(
+                f"INSERT INTO {SEGMENT_TIMINGS_TABLE} (analysis_number, sequence, uri, duration, time_listed, "
+                f"time_request, time_first_byte, time_arrived, size_bytes, first_frame_received, frames, "
+                f"decode_seconds, time_decoded) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                [self.analysis_number, timing.sequence, timing.uri, timing.duration, timing.time_listed,
+                 timing.time_request, timing.time_first_byte, timing.time_arrived, timing.size_bytes,
+                 timing.first_frame_received, timing.frames, timing.decode_seconds, timing.time_decoded])
+
+    def _record_segment(self, timing: SegmentTiming) -> None:
+        if self.recorder is not None and timing.frames:
+            self.recorder.record_segment(timing.sequence, timing.uri, timing.duration, timing.first_frame_received,
+                                         timing.frames)
+
+    def _segment_frames(self) -> int:
+        """
+        Frames in the current segment according to its container timestamps, 0 if it has none and the frames have to
+        be found by decoding
+        """
+        timestamps = self._segment.timestamps
+        return len(timestamps.pts) if timestamps is not None else 0
+
+    def grab(self) -> bool:
+        """
+        Same as `cv2.VideoCapture.grab`, moves on to the next frame and blocks until the next segment is downloaded
+        when the current one is done. When the segment's container timestamps could be read nothing is decoded here,
+        so frames that are never retrieved cost nothing
+        """
+        self.reads += 1
+        while not self._stop_requested.is_set():
+            if self._segment is None and not self._next_segment():
+                return False
+            if self._segment is None:
+                continue
+            timing = self._segment
+            segment_frames = self._segment_frames()
+            if segment_frames:
+                if self._position + 1 >= segment_frames:
+                    self._finish_segment()
+                    continue
+            elif not self._decode_next():
+                self._finish_segment()
+                continue
+            self._position += 1
+            if timing.frames == 0:
+                timing.first_frame_received = self.reads
+            timing.frames += 1
+            if segment_frames:
+                self.frame_pts = float(timing.timestamps.pts[self._position])
+                self.frame_keyframe = bool(timing.timestamps.keyframes[self._position])
+                if len(timing.timestamps.pts) > 1:
+                    self.fps = 1 / float(np.median(np.diff(timing.timestamps.pts)))
+            else:
+                self.frame_pts = None
+                self.frame_keyframe = None
+            return True
+        return False
+
+    def retrieve(self, image: np.ndarray = None) -> Tuple[bool, Optional[np.ndarray]]:
+        """
+        Same as `cv2.VideoCapture.retrieve`, decodes the segment up to the grabbed frame
+        :param image: buffer to decode into, used if it has the right shape
+        """
+        if self._segment is None:
+            return False, None
+        while self._decoded <= self._position:
+            if not self._decode_next():
+                return False, None
+        decode_start = time.perf_counter()
+        ret, frame = self._decoder.retrieve(image) if image is not None else self._decoder.retrieve()
+        self._segment.decode_seconds += time.perf_counter() - decode_start
+        if ret and not self.frame_height:
+            self.frame_height, self.frame_width = frame.shape[:2]
+        return ret, frame
+
+    def read(self, image: np.ndarray = None) -> Tuple[bool, Optional[np.ndarray]]:
+        """
+        Same as `cv2.VideoCapture.read`
+        """
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def isOpened(self) -> bool:
+        return self.opened
+
+    def get(self, prop_id: int) -> float:
+        if prop_id == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop_id == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.frame_width
+        if prop_id == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.frame_height
+        if prop_id == cv2.CAP_PROP_POS_MSEC:
+            return self.frame_pts * 1000 if self.frame_pts is not None else -1
+        return 0.0
+
+    def release(self) -> None:
+        self._stop_requested.set()
+        with self._pending_ready:
+            self._pending_ready.notify_all()
+        if self._poller is not None:
+            self._poller.join()
+        if self._segment is not None:
+            self._record_segment(self._segment)
+            self._segment = None
+        if self._decoder is not None:
+            self._decoder.release()
+            self._decoder = None
+        self._buffer = None
+        self._remove_spill_file()
+        self._downloads.shutdown(wait=True, cancel_futures=True)
+        self.session.close()
+
+
+def latency_breakdown(database_name: str, analysis_number: int, table_name: str = "stream_data") -> pd.DataFrame:
+    """
+    Splits the latency of every segment read by an `HLSIngester` into
+    * packaging: last frame of the segment generated -> segment listed in the playlist (includes up to one poll
+      interval of waiting for the reload)
+    * network: listed -> last byte downloaded, including time waiting for a free download slot
+    * decode: time spent decoding its frames
+    * total: last frame generated -> last frame decoded, so what is left over after the three parts is time the
+      segment waited to be decoded
+    Frames are matched to segments by `frame_number_received`. `time_generated` is the server clock, so packaging and
+    total carry the clock offset between server and client like the latency in `stream_data` does.
+    """
+    connection = sqlite3.connect(database_name)
+    segments = pd.read_sql(f"SELECT * FROM {SEGMENT_TIMINGS_TABLE} WHERE analysis_number = ? ORDER BY sequence",
+                           connection, params=[analysis_number])
+    frames = pd.read_sql(f"SELECT frame_number_received, time_generated FROM {table_name} "
+                         f"WHERE analysis_number = ? AND time_generated != -1 ORDER BY frame_number_received",
+                         connection, params=[analysis_number])
+    connection.close()
+    segments = segments[segments["frames"] > 0]
+    received = frames["frame_number_received"].to_numpy()
+    # Index of each frame's segment: the last segment whose first frame is at or before it
+    segment_index = np.searchsorted(segments["first_frame_received"].to_numpy(), received, side="right") - 1
+    in_segment = segment_index >= 0
+    last_frame = segments["first_frame_received"].to_numpy() + segments["frames"].to_numpy() - 1
+    in_segment[in_segment] &= received[in_segment] <= last_frame[segment_index[in_segment]]
+    last_generated = pd.Series(frames["time_generated"].to_numpy()[in_segment]) \
+        .groupby(segment_index[in_segment]).max()
+    breakdown = pd.DataFrame({"sequence": segments["sequence"].to_numpy(), "frames": segments["frames"].to_numpy(),
+                              "size_bytes": segments["size_bytes"].to_numpy()})
+    breakdown["last_generated"] = last_generated.reindex(range(len(segments))).to_numpy()
+    breakdown["packaging"] = segments["time_listed"].to_numpy() - breakdown["last_generated"]
+    breakdown["network"] = segments["time_arrived"].to_numpy() - segments["time_listed"].to_numpy()
+    breakdown["time_to_first_byte"] = segments["time_first_byte"].to_numpy() - segments["time_request"].to_numpy()
+    breakdown["decode"] = segments["decode_seconds"].to_numpy()
+    breakdown["total"] = segments["time_decoded"].to_numpy() - breakdown["last_generated"]
+    return breakdown.set_index("sequence")
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--database", default="stream_data.db", help="SQLite database the client recorded to")
+    parser.add_argument("-a", "--analysis-number", type=int, required=True,
+                        help="Analysis recorded with --ingest hls to break down")
+    parser.add_argument("-o", "--outfile", help="Write the per segment breakdown to this csv file")
+    return parser
+
+
+def main() -> None:
+    args = get_parser().parse_args()
+    breakdown = latency_breakdown(args.database, args.analysis_number)
+    if args.outfile:
+        breakdown.to_csv(args.outfile)
+    print(breakdown.to_string())
+    print(breakdown[["packaging", "network", "time_to_first_byte", "decode", "total"]].describe().to_string())
+
+
+if __name__ == '__main__':
+    main()
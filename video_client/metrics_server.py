@@ -0,0 +1,131 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+DEFAULT_METRICS_PORT = 9100
+METRIC_PREFIX = "stream"
+# Snapshot key -> help text. A summary is read from the snapshot's <key>_p50/_p90/_p99/_sum/_count
+COUNTERS: Dict[str, str] = {
+    "frames_received": "Frames read from the stream",
+    "frames_decoded": "Frames whose timing marker was decoded, or found in the decode cache",
+    "frames_dropped": "Gaps in frame numbers (or container timestamps) between consecutively received frames",
+    "frames_repeated": "Frames that carried the same frame number as the frame before them",
+    "decode_cache_hits": "Frames resolved from the decode cache without decoding",
+    "db_rows_failed": "Rows lost because the batch they were written in failed",
+}
+GAUGES: Dict[str, str] = {
+    "fps": "Frames received per second over the last complete 10 seconds",
+    "queue_depth": "Frames waiting between capture and the decoders",
+    "db_writer_backlog": "Rows queued for the database but not committed yet",
+    "frame_pool_leased": "Frame buffers currently holding a frame",
+}
+SUMMARIES: Dict[str, str] = {
+    "latency_seconds": "Time between a frame being generated by the server and received by the client",
+    "decode_seconds": "Time to find and decode the timing marker of a frame",
+}
+QUANTILES: Dict[str, str] = {"p50": "0.5", "p90": "0.9", "p99": "0.99"}
+
+
+def _format_value(value) -> str:
+    if value is None:
+        return "NaN"
+    return repr(float(value))
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def render_prometheus(snapshots: List[dict]) -> str:
+    """
+    Prometheus text exposition (version 0.0.4) of stream snapshots, see `StreamAnalyzer.metrics_snapshot`. Every
+    series is labelled with the analysis number and stream url, and the variant when one was selected
+    """
+    lines = []
+
+    def labels(snapshot: dict, **extra: str) -> str:
+        values = {"analysis_number": str(snapshot["analysis_number"]), "stream": snapshot["stream_url"]}
+        if snapshot.get("variant") is not None:
+            values["variant"] = snapshot["variant"]
+        values.update(extra)
+        return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in values.items()) + "}"
+
+    for kind, metrics in (("counter", COUNTERS), ("gauge", GAUGES)):
+        for key, help_text in metrics.items():
+            name = f"{METRIC_PREFIX}_{key}" + ("_total" if kind == "counter" else "")
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            lines += [f"{name}{labels(snapshot)} {_format_value(snapshot.get(key))}" for snapshot in snapshots]
+    for key, help_text in SUMMARIES.items():
+        name = f"{METRIC_PREFIX}_{key}"
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} summary"]
+        for snapshot in snapshots:
+            for label, quantile in QUANTILES.items():
+                lines.append(f"{name}{labels(snapshot, quantile=quantile)} "
+                             f"{_format_value(snapshot.get(f'{key}_{label}'))}")
+            lines.append(f"{name}_sum{labels(snapshot)} {_format_value(snapshot.get(f'{key}_sum', 0))}")
+            lines.append(f"{name}_count{labels(snapshot)} {_format_value(snapshot.get(f'{key}_count', 0))}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    server: "_MetricsHTTPServer"
+
+    def do_GET(self) -> None:
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            body = render_prometheus(self.server.metrics.snapshot()).encode()
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif path == "/metrics.json":
+            body = json.dumps(self.server.metrics.snapshot()).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass  # A scrape every few seconds would drown out the client's own output
+
+
+class _MetricsHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], metrics: "MetricsServer"):
+        super().__init__(address, _MetricsHandler)
+        self.metrics = metrics
+
+
+class MetricsServer(threading.Thread):
+    """
+    Small HTTP server for watching running streams live, at `/metrics` in the Prometheus text format and at
+    `/metrics.json` as one json object per stream. A scrape only reads the counters the analyzers already keep and
+    the fps and percentiles their window schedulers recompute every second (see `StreamAnalyzer.metrics_snapshot`),
+    without taking any locks, so it never holds up capture or decoding. A value read in the middle of an update can be off by a frame, which is fine for a dashboard.
+    """
+
+    def __init__(self, port: int = DEFAULT_METRICS_PORT, host: str = "0.0.0.0"):
+        super().__init__(daemon=True, name="metrics-server")
+        self._analyzers = []
+        self._http = _MetricsHTTPServer((host, port), self)
+        self.port = self._http.server_address[1]
+
+    def register(self, analyzer) -> None:
+        """
+        :param analyzer: a StreamAnalyzer, or anything else with a `metrics_snapshot()`
+        """
+        self._analyzers.append(analyzer)
+
+    def snapshot(self) -> List[dict]:
+        return [analyzer.metrics_snapshot() for analyzer in list(self._analyzers)]
+
+    def run(self) -> None:
+        self._http.serve_forever(poll_interval=0.5)
+
+    def stop(self) -> None:
+        self._http.shutdown()
+        self._http.server_close()
@@ -0,0 +1,129 @@
+import threading
+from typing import Dict, NamedTuple, Optional, Tuple
+import numpy as np
+import cv2
+
+STRATEGIES = ("roi", "pyramid", "full")
+
+
+class LocateResult(NamedTuple):
+    value: str
+    pts: Optional[np.ndarray]
+    tried: Tuple[str, ...]
+    hit: Optional[str]
+
+
+class LocatorStats:
+    """
+    Counts how often each search strategy was tried and how often it found the QR code
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.attempts: Dict[str, int] = {strategy: 0 for strategy in STRATEGIES}
+        self.hits: Dict[str, int] = {strategy: 0 for strategy in STRATEGIES}
+
+    def record(self, tried: Tuple[str, ...], hit: Optional[str]) -> None:
+        with self._lock:
+            for strategy in tried:
+                self.attempts[strategy] += 1
+            if hit is not None:
+                self.hits[hit] += 1
+
+    def hit_rates(self) -> Dict[str, float]:
+        """
+        :return: fraction of attempts that decoded a QR code, per strategy
+        """
+        with self._lock:
+            return {strategy: self.hits[strategy] / self.attempts[strategy] if self.attempts[strategy] else 0.0
+                    for strategy in STRATEGIES}
+
+    def summary(self) -> str:
+        rates = self.hit_rates()
+        return " ".join(f"{strategy}: {self.hits[strategy]}/{self.attempts[strategy]} ({rates[strategy]:.0%})"
+                        for strategy in STRATEGIES)
+
+
+class QRLocator:
+    """
+    QR detector for a stream where the code stays in the same place. Each frame is searched in order:
+    * roi: grayscale crop around the corners of the last successful decode, padded by `roi_padding`
+    * pyramid: whole grayscale frame, downscaled so its short side is about `pyramid_side` pixels
+    * full: the original frame at full resolution
+    and the first strategy that decodes wins. Detectors are kept per thread so one locator can be shared by a pool.
+    """
+
+    def __init__(self, roi_padding: float = 0.15, pyramid_side: int = 480, stats: LocatorStats = None):
+        self.roi_padding = roi_padding
+        self.pyramid_side = pyramid_side
+        self.stats = stats if stats is not None else LocatorStats()
+        self._last_pts: Optional[np.ndarray] = None
+        self._local = threading.local()
+
+    def _detector(self) -> cv2.QRCodeDetector:
+        detector = getattr(self._local, "detector", None)
+        if detector is None:
+            detector = cv2.QRCodeDetector()
+            self._local.detector = detector
+        return detector
+
+    def _decode_scaled(self, image: np.ndarray, offset: Tuple[int, int] = (0, 0)) -> Tuple[str, Optional[np.ndarray]]:
+        """
+        Decodes an image after downscaling it to the pyramid size, and maps the corners back to frame coordinates
+        """
+        scale = min(1.0, self.pyramid_side / min(image.shape[:2]))
+        if scale < 1.0:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        value, pts, _ = self._detector().detectAndDecode(image)
+        if pts is not None:
+            pts = pts.reshape(-1, 2) / scale + offset
+        return value, pts
+
+    def _roi(self, shape: Tuple[int, ...]) -> Optional[Tuple[int, int, int, int]]:
+        last_pts = self._last_pts
+        if last_pts is None:
+            return None
+        x_min, y_min = last_pts.min(axis=0)
+        x_max, y_max = last_pts.max(axis=0)
+        pad_x, pad_y = (x_max - x_min) * self.roi_padding, (y_max - y_min) * self.roi_padding
+        x0, y0 = max(int(x_min - pad_x), 0), max(int(y_min - pad_y), 0)
+        x1, y1 = min(int(x_max + pad_x) + 1, shape[1]), min(int(y_max + pad_y) + 1, shape[0])
+        if x1 - x0 < 8 or y1 - y0 < 8:
+            return None
+        return x0, y0, x1, y1
+
+    def locate(self, frame: np.ndarray) -> LocateResult:
+        """
+        Runs the strategies in order without recording stats, see `detect_and_decode`
+        """
+        tried = []
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        roi = self._roi(frame.shape)
+        if roi is not None:
+            x0, y0, x1, y1 = roi
+            tried.append("roi")
+            value, pts = self._decode_scaled(gray[y0:y1, x0:x1], offset=(x0, y0))
+            if value:
+                self._last_pts = pts
+                return LocateResult(value, pts, tuple(tried), "roi")
+        if self.pyramid_side / min(frame.shape[:2]) < 1.0:
+            tried.append("pyramid")
+            value, pts = self._decode_scaled(gray)
+            if value:
+                self._last_pts = pts
+                return LocateResult(value, pts, tuple(tried), "pyramid")
+        tried.append("full")
+        value, pts, _ = self._detector().detectAndDecode(frame)
+        if value:
+            self._last_pts = pts.reshape(-1, 2)
+            return LocateResult(value, self._last_pts, tuple(tried), "full")
+        return LocateResult(value, pts, tuple(tried), None)
+
+    def detect_and_decode(self, frame: np.ndarray) -> Tuple[str, Optional[np.ndarray]]:
+        """
+        Finds and decodes the QR code in a frame and counts which strategy found it
+        :return: decoded string (empty if nothing was decoded) and the corners of the code in frame coordinates
+        """
+        result = self.locate(frame)
+        self.stats.record(result.tried, result.hit)
+        return result.value, result.pts
@@ -0,0 +1,91 @@
+import csv
+import json
+import os
+import threading
+import time
+from typing import List, Tuple
+import pandas as pd
+from frame_recorder import MARKER_QR
+
+RECORDING_INFO = "recording.json"
+SEGMENTS_DIR = "segments"
+SEGMENT_INDEX = "segments.csv"
+FRAME_INDEX = "frames.csv"
+SEGMENT_COLUMNS = ["sequence", "uri", "duration", "first_frame_received", "frames"]
+FRAME_COLUMNS = ["frame_number_received", "time_received", "pts"]
+
+
+class StreamRecorder:
+    """
+    Tees a stream read by an `hls_ingest.HLSIngester` to disk so it can be analyzed again later with `replay.py`:
+    * segments/<sequence>.ts: every downloaded segment as it came off the network, written by the download threads
+    * segments.csv: which `frame_number_received` each segment's frames got, written once a segment is done
+    * frames.csv: `time_received` and presentation timestamp of every frame read, by `frame_number_received`
+    * recording.json: stream url, analysis number and timing marker of the run
+    The csv files are appended to, so a recording interrupted half way can still be replayed up to that point.
+    """
+
+    def __init__(self, directory: str, stream_url: str = None, analysis_number: int = None,
+                 timing_marker: str = MARKER_QR):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, SEGMENTS_DIR), exist_ok=True)
+        with open(os.path.join(directory, RECORDING_INFO), "w") as info_file:
+            json.dump({"stream_url": stream_url, "analysis_number": analysis_number, "timing_marker": timing_marker,
+                       "created": time.time()}, info_file)
+        self._segments_file, self._segments = self._open_index(SEGMENT_INDEX, SEGMENT_COLUMNS)
+        self._frames_file, self._frames = self._open_index(FRAME_INDEX, FRAME_COLUMNS)
+        self._lock = threading.Lock()
+        self.segments_recorded = 0
+        self.frames_recorded = 0
+
+    def _open_index(self, file_name: str, columns: List[str]):
+        path = os.path.join(self.directory, file_name)
+        exists = os.path.exists(path)
+        index_file = open(path, "a", newline="")
+        writer = csv.writer(index_file)
+        if not exists:
+            writer.writerow(columns)
+        return index_file, writer
+
+    def save_segment_data(self, sequence: int, data: bytes) -> None:
+        with open(os.path.join(self.directory, SEGMENTS_DIR, f"{sequence}.ts"), "wb") as segment_file:
+            segment_file.write(data)
+
+    def record_segment(self, sequence: int, uri: str, duration: float, first_frame_received: int,
+                       frames: int) -> None:
+        with self._lock:
+            self._segments.writerow([sequence, uri, duration, first_frame_received, frames])
+            self.segments_recorded += 1
+
+    def record_frame(self, frame_number_received: int, time_received: float, pts: float) -> None:
+        with self._lock:
+            self._frames.writerow([frame_number_received, repr(time_received), repr(pts)])
+            self.frames_recorded += 1
+
+    def close(self) -> None:
+        with self._lock:
+            self._segments_file.close()
+            self._frames_file.close()
+
+
+def read_recording(directory: str) -> Tuple[dict, pd.DataFrame, pd.DataFrame]:
+    """
+    :return: the recording info, its segments that had frames read from them in playlist order, and its frame index
+    """
+    with open(os.path.join(directory, RECORDING_INFO)) as info_file:
+        info = json.load(info_file)
+    segments = pd.read_csv(os.path.join(directory, SEGMENT_INDEX))
+    segments = segments[segments["frames"] > 0].drop_duplicates("sequence", keep="last").sort_values("sequence")
+    frames = pd.read_csv(os.path.join(directory, FRAME_INDEX), float_precision="round_trip")
+    return info, segments.reset_index(drop=True), frames
+
+
+def split_segments(segments: pd.DataFrame, chunks: int) -> List[pd.DataFrame]:
+    """
+    Splits segments into up to `chunks` runs of consecutive segments with about the same number of frames each
+    """
+    if segments.empty:
+        return []
+    chunk_of_segment = (segments["frames"].cumsum().shift(fill_value=0) * chunks //
+                        max(segments["frames"].sum(), 1)).clip(upper=chunks - 1)
+    return [chunk for _, chunk in segments.groupby(chunk_of_segment, sort=True)]
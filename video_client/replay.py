@@ -0,0 +1,122 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import cv2
+from client_cv import StreamAnalyzer
+from frame_cache import DecodeCache
+from frame_recorder import FrameRecorder
+from qr_locator import QRLocator
+from recording import SEGMENTS_DIR, read_recording, split_segments
+from stream_analysis import summarize_analyses
+
+# frame_number_received, time_received, payload (None if it could not be read), decode_seconds
+ReplayedFrame = Tuple[int, float, Optional[dict], float]
+
+
+def _replay_chunk(directory: str, segments: List[dict], time_received: Dict[int, float],
+                  timing_marker: str) -> List[ReplayedFrame]:
+    """
+    Decodes the timing marker of every frame of a run of segments, in a worker process
+    :param time_received: frame_number_received -> time_received of the frames that were read in the live run,
+    others (the frame read past the frame limit) are skipped
+    """
+    qr_locator = QRLocator()
+    decode_cache = DecodeCache()
+    replayed: List[ReplayedFrame] = []
+    for segment in segments:
+        capture = cv2.VideoCapture(os.path.join(directory, SEGMENTS_DIR, f"{segment['sequence']}.ts"))
+        for frame_index in range(segment["frames"]):
+            frame_number_received = segment["first_frame_received"] + frame_index
+            ret, frame = capture.read()
+            if not ret:
+                print(f"Segment {segment['sequence']} ended after {frame_index} of {segment['frames']} frames")
+                break
+            if frame_number_received not in time_received:
+                continue
+            recorder = FrameRecorder(frame=frame, frame_received_counter=frame_number_received,
+                                     time=time_received[frame_number_received], analysis_number=-1,
+                                     timing_marker=timing_marker)
+            decode_start = time.perf_counter()
+            fingerprint = decode_cache.fingerprint(frame)
+            found, payload = decode_cache.lookup(fingerprint, wait_seconds=0)
+            if not found:
+                try:
+                    payload = recorder.decode_payload(qr_locator)
+                except cv2.error:
+                    decode_cache.abandon(fingerprint)
+                    print(f"Frame {frame_number_received} could not be decoded")
+                    continue
+                decode_cache.store(fingerprint, payload)
+            replayed.append((frame_number_received, recorder.time, payload, time.perf_counter() - decode_start))
+        capture.release()
+    return replayed
+
+
+def replay(directory: str, database_name: str = "stream_data.db", processes: int = None,
+           timing_marker: str = None, record_period_seconds: int = 10) -> int:
+    """
+    Runs a recording through the decoding and statistics again as a new analysis, as fast as it decodes: the segments
+    are split into `processes` chunks of consecutive segments that are decoded in parallel, and the results are
+    added to the statistics in frame order with the `time_received` of the live run. Summary and sliding windows are
+    written on the same boundaries of the live run's clock they would have been written on live.
+    :param timing_marker: marker to decode, the one the recording was made with if not given
+    :return: analysis number of the replay
+    """
+    info, segments, frames = read_recording(directory)
+    timing_marker = timing_marker or info["timing_marker"]
+    analyzer = StreamAnalyzer(database_name=database_name, record_params=False, timing_marker=timing_marker,
+                              record_period_seconds=record_period_seconds, decode_cache_size=0, frame_pool_size=0)
+    print(f"Replaying {len(frames)} frames of {info['stream_url']} (analysis {info['analysis_number']}) as analysis "
+          f"{analyzer.analysis_number}")
+    time_received = dict(zip(frames["frame_number_received"].tolist(), frames["time_received"].tolist()))
+    scheduler = None
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        chunks = split_segments(segments, processes or os.cpu_count() or 1)
+        futures = [pool.submit(_replay_chunk, directory, chunk.to_dict("records"),
+                               {number: time_received[number] for number in range(
+                                   int(chunk["first_frame_received"].iloc[0]),
+                                   int((chunk["first_frame_received"] + chunk["frames"]).iloc[-1]))
+                                if number in time_received}, timing_marker) for chunk in chunks]
+        for future in futures:
+            for frame_number_received, frame_time_received, payload, decode_seconds in future.result():
+                if scheduler is None:
+                    scheduler = analyzer.window_scheduler(lambda: None, now=frame_time_received)
+                scheduler.run_due(frame_time_received)
+                last_time_received = frame_time_received
+                analyzer.count_frame(frame_time_received)
+                recorder = FrameRecorder(frame=None, frame_received_counter=frame_number_received,
+                                         time=frame_time_received, analysis_number=analyzer.analysis_number,
+                                         timing_marker=timing_marker)
+                analyzer.add_frame_stats(recorder.record_payload(payload, db_writer=analyzer.db_writer,
+                                                                 table_name=analyzer.table_name,
+                                                                 decode_seconds=decode_seconds))
+    if scheduler is not None:
+        scheduler.flush(last_time_received)
+    print(f"Replayed in {time.perf_counter() - start:.1f}s")
+    analyzer.close()
+    return analyzer.analysis_number
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Analyzes a stream recorded with client_cv.py --record-dir again")
+    parser.add_argument("-r", "--recording", required=True, help="Directory the stream was recorded to")
+    parser.add_argument("-d", "--database", default="stream_data.db", help="SQLite database to record the replay to")
+    parser.add_argument("-p", "--processes", type=int, help="Processes to decode with, one per CPU by default")
+    parser.add_argument("-tm", "--timing-marker", help="Timing marker to decode, the recording's by default")
+    parser.add_argument("-rp", "--record-period", type=int, default=10,
+                        help="Seconds of the live run per stream_data_final row")
+    return parser
+
+
+def main() -> None:
+    args = get_parser().parse_args()
+    analysis_number = replay(args.recording, database_name=args.database, processes=args.processes,
+                             timing_marker=args.timing_marker, record_period_seconds=args.record_period)
+    print(summarize_analyses(args.database, analysis_numbers=[analysis_number]).to_string())
+
+
+if __name__ == '__main__':
+    main()
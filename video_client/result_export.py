@@ -0,0 +1,143 @@
+import json
+import os
+import sqlite3
+from typing import Dict, List, Tuple
+import numpy as np
+import pandas as pd
+
+EXPORT_FORMATS = ["csv", "parquet", "feather", "npy"]
+FILE_EXTENSIONS = {"csv": ".csv", "parquet": ".parquet", "feather": ".feather", "npy": ".npy.d"}
+# Frame number columns only ever go up by small steps, so they shrink a lot as int32 deltas
+DELTA_COLUMNS = ["frame_number", "frame_number_received", "frame_number_index_to_0"]
+METADATA_KEY = b"stream_params"
+METADATA_FILE = "metadata.json"
+
+
+def read_stream_params(database_name: str, analysis_number: int) -> dict:
+    """
+    :return: the `stream_params` row of an analysis as a dict, empty if the params were not recorded
+    """
+    connection = sqlite3.connect(database_name)
+    cursor = connection.execute("SELECT * FROM stream_params WHERE analysis_number = ?", [analysis_number])
+    row = cursor.fetchone()
+    columns = [description[0] for description in cursor.description]
+    connection.close()
+    params = dict(zip(columns, row)) if row is not None else {}
+    params["analysis_number"] = analysis_number
+    return params
+
+
+def _typed_columns(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Integer columns as int64 and everything else as float64, so every export has the same schema
+    """
+    data = data.reset_index(drop=True)
+    dtypes = {column: np.int64 if pd.api.types.is_integer_dtype(data[column]) else np.float64
+              for column in data.columns}
+    return data.astype(dtypes)
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError:
+        raise AssertionError("pyarrow is needed for parquet and feather output, install it with `pip install pyarrow` "
+                             "or use --output-format npy")
+    return pyarrow
+
+
+def export_results(data: pd.DataFrame, path: str, params: dict, output_format: str = "csv",
+                   delta_encode: bool = False) -> str:
+    """
+    Writes the analyzed frames of a run together with its stream params
+    * csv: the old plain text output, params are not stored
+    * parquet: zstd compressed, smallest on disk, params in the schema metadata
+    * feather: uncompressed arrow, can be memory mapped by `load_results`, params in the schema metadata
+    * npy: a directory with one .npy file per column and a metadata.json, can be memory mapped by `load_results`
+    :param delta_encode: npy only, store the frame number columns as int32 differences. Smaller, but those columns are
+    decoded into memory when loaded instead of being memory mapped
+    :return: path that was written
+    """
+    if output_format not in EXPORT_FORMATS:
+        raise AssertionError(f"Unknown output format {output_format}, expected one of {EXPORT_FORMATS}")
+    if output_format == "csv":
+        data.to_csv(path)
+        return path
+    data = _typed_columns(data)
+    if output_format == "npy":
+        _export_npy(data, path, params, delta_encode)
+        return path
+    pyarrow = _import_pyarrow()
+    table = pyarrow.Table.from_pandas(data, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[METADATA_KEY] = json.dumps(params).encode()
+    table = table.replace_schema_metadata(metadata)
+    if output_format == "parquet":
+        pyarrow.parquet.write_table(table, path, compression="zstd")
+    else:
+        pyarrow.feather.write_feather(table, path, compression="uncompressed")
+    return path
+
+
+def _export_npy(data: pd.DataFrame, path: str, params: dict, delta_encode: bool) -> None:
+    os.makedirs(path, exist_ok=True)
+    columns: List[dict] = []
+    for column in data.columns:
+        values = data[column].to_numpy()
+        entry = {"name": column, "dtype": values.dtype.str, "encoding": "plain"}
+        if delta_encode and column in DELTA_COLUMNS and len(values):
+            deltas = np.diff(values)
+            if deltas.size == 0 or (deltas.min() >= np.iinfo(np.int32).min and deltas.max() <= np.iinfo(np.int32).max):
+                entry.update({"encoding": "delta", "first": int(values[0])})
+                values = deltas.astype(np.int32)
+        np.save(os.path.join(path, f"{column}.npy"), values)
+        columns.append(entry)
+    with open(os.path.join(path, METADATA_FILE), "w") as metadata_file:
+        json.dump({"stream_params": params, "rows": len(data), "columns": columns}, metadata_file, indent=2)
+
+
+def load_results(path: str) -> Tuple[Dict[str, np.ndarray], dict]:
+    """
+    Loads an export written by `export_results` without copying it into memory where possible. npy bundles and feather
+    files are memory mapped, parquet files are decompressed into memory.
+    :return: column name -> numpy array, and the stream params of the run
+    """
+    if os.path.isdir(path):
+        return _load_npy(path)
+    pyarrow = _import_pyarrow()
+    if path.endswith(FILE_EXTENSIONS["parquet"]):
+        table = pyarrow.parquet.read_table(path, memory_map=True)
+    else:
+        table = pyarrow.feather.read_table(path, memory_map=True)
+    metadata = table.schema.metadata or {}
+    params = json.loads(metadata[METADATA_KEY]) if METADATA_KEY in metadata else {}
+    columns = {name: table.column(name).combine_chunks().to_numpy(zero_copy_only=False) for name in table.column_names}
+    return columns, params
+
+
+def _load_npy(path: str) -> Tuple[Dict[str, np.ndarray], dict]:
+    with open(os.path.join(path, METADATA_FILE)) as metadata_file:
+        metadata = json.load(metadata_file)
+    columns = {}
+    for entry in metadata["columns"]:
+        values = np.load(os.path.join(path, f"{entry['name']}.npy"), mmap_mode="r")
+        if entry["encoding"] == "delta":
+            decoded = np.empty(metadata["rows"], dtype=np.dtype(entry["dtype"]))
+            decoded[0] = entry["first"]
+            np.cumsum(values, out=decoded[1:])
+            decoded[1:] += entry["first"]
+            values = decoded
+        columns[entry["name"]] = values
+    return columns, metadata["stream_params"]
+
+
+def load_results_frame(path: str) -> pd.DataFrame:
+    """
+    Same as `load_results` but as a DataFrame, with the stream params in `DataFrame.attrs`
+    """
+    columns, params = load_results(path)
+    data = pd.DataFrame(columns, copy=False)
+    data.attrs["stream_params"] = params
+    return data
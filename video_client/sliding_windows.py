@@ -0,0 +1,229 @@
+import math
+import sqlite3
+import threading
+import time
+from array import array
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Sequence
+
+DEFAULT_WINDOWS = (1, 10, 60)
+WINDOWS_TABLE = "stream_data_windows"
+
+
+@dataclass
+class WindowStats:
+    """
+    Statistics of the frames received in [window_end - window_seconds, window_end)
+    """
+    window_seconds: float
+    window_end: float
+    frames_received: int
+    frames_dropped: int
+    fps: float
+    latency_mean: Optional[float]
+    latency_max: Optional[float]
+    jitter_mean: Optional[float]
+    interval_mean: Optional[float]
+
+
+def create_windows_table(cursor: sqlite3.Cursor) -> None:
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {WINDOWS_TABLE} (analysis_number INT, window_seconds FLOAT, "
+                   f"window_end FLOAT, frames_received INT, frames_dropped INT, fps FLOAT, latency_mean FLOAT, "
+                   f"latency_max FLOAT, jitter_mean FLOAT, interval_mean FLOAT)")
+
+
+class SlidingWindowStats:
+    """
+    Frame counts, drops, latency, jitter and time between frames over several sliding windows at once. Events are
+    added to the bucket of the second (`bucket_seconds`) the frame was received in, O(1) per event, and a window is
+    only summed up from its buckets when it is read. Buckets live in a ring of preallocated columns indexed by bucket
+    number, like the pairing engine's frames, so they are reset when the ring wraps around. Late events, i.e. a frame
+    decoded a few seconds after it was received, still land in the right bucket as long as it is in the ring.
+    """
+
+    def __init__(self, windows: Sequence[float] = DEFAULT_WINDOWS, bucket_seconds: float = 1.0,
+                 history_seconds: float = None):
+        """
+        :param history_seconds: how far back buckets are kept, the longest window plus a margin for late events by
+        default
+        """
+        self.windows = list(windows)
+        self.bucket_seconds = bucket_seconds
+        if history_seconds is None:
+            history_seconds = max(self.windows) + 30
+        self.capacity = int(math.ceil(history_seconds / bucket_seconds)) + 1
+        self._bucket = array("q", [-1] * self.capacity)
+        self._frames = array("q", [0] * self.capacity)
+        self._dropped = array("q", [0] * self.capacity)
+        self._latency_count = array("q", [0] * self.capacity)
+        self._latency_sum = array("d", [0.0] * self.capacity)
+        self._latency_max = array("d", [0.0] * self.capacity)
+        self._jitter_count = array("q", [0] * self.capacity)
+        self._jitter_sum = array("d", [0.0] * self.capacity)
+        self._interval_count = array("q", [0] * self.capacity)
+        self._interval_sum = array("d", [0.0] * self.capacity)
+        self._lock = threading.Lock()
+
+    def _slot(self, time_received: float) -> int:
+        """
+        :return: ring slot of the bucket `time_received` falls in, reset if it held an older bucket, or -1 if the
+        bucket already left the ring
+        """
+        bucket = int(time_received // self.bucket_seconds)
+        slot = bucket % self.capacity
+        if self._bucket[slot] != bucket:
+            if self._bucket[slot] > bucket:
+                return -1
+            self._bucket[slot] = bucket
+            self._frames[slot] = self._dropped[slot] = 0
+            self._latency_count[slot] = self._jitter_count[slot] = self._interval_count[slot] = 0
+            self._latency_sum[slot] = self._latency_max[slot] = 0.0
+            self._jitter_sum[slot] = self._interval_sum[slot] = 0.0
+        return slot
+
+    def record_frame(self, time_received: float) -> None:
+        with self._lock:
+            slot = self._slot(time_received)
+            if slot != -1:
+                self._frames[slot] += 1
+
+    def record_interval(self, time_received: float, interval: float, dropped: bool) -> None:
+        """
+        Time between a frame and the one received before it, and whether frames were missing between them
+        """
+        with self._lock:
+            slot = self._slot(time_received)
+            if slot == -1:
+                return
+            self._interval_count[slot] += 1
+            self._interval_sum[slot] += interval
+            if dropped:
+                self._dropped[slot] += 1
+
+    def record_latency(self, time_received: float, latency: float, jitter: float = None) -> None:
+        """
+        :param jitter: change in latency from the frame received before it, if that is known
+        """
+        with self._lock:
+            slot = self._slot(time_received)
+            if slot == -1:
+                return
+            if self._latency_count[slot] == 0 or latency > self._latency_max[slot]:
+                self._latency_max[slot] = latency
+            self._latency_count[slot] += 1
+            self._latency_sum[slot] += latency
+            if jitter is not None:
+                self._jitter_count[slot] += 1
+                self._jitter_sum[slot] += jitter
+
+    def snapshot(self, window_seconds: float, window_end: float, until: float = None) -> WindowStats:
+        """
+        Sums up the buckets of [window_end - window_seconds, window_end), `window_end` should be on a bucket boundary
+        :param until: for a window the stream ended in, when it ended. The fps is then over the part of the window
+        before it
+        """
+        last_bucket = int(round(window_end / self.bucket_seconds)) - 1
+        buckets = max(int(round(window_seconds / self.bucket_seconds)), 1)
+        frames = dropped = latency_count = jitter_count = interval_count = 0
+        latency_sum = jitter_sum = interval_sum = 0.0
+        latency_max = None
+        with self._lock:
+            for bucket in range(last_bucket - buckets + 1, last_bucket + 1):
+                slot = bucket % self.capacity
+                if self._bucket[slot] != bucket:
+                    continue
+                frames += self._frames[slot]
+                dropped += self._dropped[slot]
+                if self._latency_count[slot]:
+                    latency_max = self._latency_max[slot] if latency_max is None \
+                        else max(latency_max, self._latency_max[slot])
+                latency_count += self._latency_count[slot]
+                latency_sum += self._latency_sum[slot]
+                jitter_count += self._jitter_count[slot]
+                jitter_sum += self._jitter_sum[slot]
+                interval_count += self._interval_count[slot]
+                interval_sum += self._interval_sum[slot]
+        covered_seconds = window_seconds
+        if until is not None and until < window_end:
+            covered_seconds = max(window_seconds - (window_end - until), self.bucket_seconds / 1000)
+        return WindowStats(window_seconds=window_seconds, window_end=window_end, frames_received=frames,
+                           frames_dropped=dropped, fps=frames / covered_seconds,
+                           latency_mean=latency_sum / latency_count if latency_count else None,
+                           latency_max=latency_max,
+                           jitter_mean=jitter_sum / jitter_count if jitter_count else None,
+                           interval_mean=interval_sum / interval_count if interval_count else None)
+
+
+class _ScheduledTask:
+    __slots__ = ("period", "delay", "callback", "next_boundary")
+
+    def __init__(self, period: float, delay: float, callback: Callable[..., None], now: float):
+        self.period = period
+        self.delay = delay
+        self.callback = callback
+        self.next_boundary = math.floor(now / period) * period + period
+
+
+class WindowScheduler(threading.Thread):
+    """
+    Calls tasks on wall-clock boundaries that are multiples of their period (a 10s task runs at :00, :10, :20, ...),
+    `delay` seconds after the boundary so frames still being decoded can land in their window first. Each callback
+    gets the boundary it is for. Runs on its own thread once started, or can be driven from an event loop with
+    `next_deadline` and `run_due`. A boundary that was missed (i.e. the machine stalled) is skipped, not run late
+    several times. Once the stream ended `flush` records the windows it ended in.
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True, name="window-scheduler")
+        self._tasks: List[_ScheduledTask] = []
+        self._stop_requested = threading.Event()
+
+    def add(self, period: float, callback: Callable[..., None], delay: float = 0.0, now: float = None) -> None:
+        """
+        :param callback: called with the boundary a window ended on, and by `flush` also with `until`, the time the
+        stream ended inside the window
+        :param now: time to schedule the first boundary after, `time.time()` if not given. A replay passes the time of
+        the run it replays and drives `run_due` with that run's clock
+        """
+        self._tasks.append(_ScheduledTask(period, delay, callback, time.time() if now is None else now))
+
+    def next_deadline(self) -> float:
+        return min(task.next_boundary + task.delay for task in self._tasks)
+
+    def run_due(self, now: float) -> None:
+        for task in self._tasks:
+            if now < task.next_boundary + task.delay:
+                continue
+            boundary = task.next_boundary
+            task.next_boundary = math.floor((now - task.delay) / task.period) * task.period + task.period
+            self._run(task, boundary)
+
+    def flush(self, now: float) -> None:
+        """
+        Runs every task for a window that ended by `now` and did not run yet, and then for the window `now` is in with
+        `until=now`, so the last part of a stream is recorded even when it was shorter than a period. Call once
+        nothing is added to the windows anymore, the scheduler is not used after
+        """
+        for task in self._tasks:
+            if task.next_boundary <= now:
+                boundary = task.next_boundary
+                task.next_boundary = math.floor(now / task.period) * task.period + task.period
+                self._run(task, boundary)
+            self._run(task, task.next_boundary, until=now)
+            task.next_boundary += task.period
+
+    @staticmethod
+    def _run(task: _ScheduledTask, boundary: float, **kwargs) -> None:
+        try:
+            task.callback(boundary, **kwargs)
+        except Exception as e:
+            print(f"Window task failed: {e}")
+
+    def stop(self) -> None:
+        self._stop_requested.set()
+
+    def run(self) -> None:
+        if not self._tasks:
+            return
+        while not self._stop_requested.wait(max(self.next_deadline() - time.time(), 0)):
+            self.run_due(time.time())
@@ -0,0 +1,130 @@
+import argparse
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+import pandas as pd
+from histogram import LogHistogram
+
+STAGE_TIMINGS_TABLE = "stage_timings"
+# Stages of a frame in the order it goes through them
+STAGE_GRAB = "grab"  # VideoCapture.grab, includes waiting for the frame to arrive
+STAGE_RETRIEVE = "retrieve"  # Decoding the video frame into an image
+STAGE_QUEUE_WAIT = "queue_wait"  # Waiting between the capture thread and the thread handing frames to the decoders
+STAGE_SCHEDULE = "schedule"  # Waiting for a decode thread after being submitted
+STAGE_FINGERPRINT = "fingerprint"  # Fingerprinting the frame and looking it up in the decode cache
+STAGE_DETECT = "detect"  # Finding and reading the QR code or timing strip
+STAGE_PARSE = "parse"  # Parsing the QR payload
+STAGE_DB_INSERT = "db_insert"  # Queueing the frame's row for the database writer
+STAGE_STATS = "stats"  # Adding the decoded frame to the pairing statistics
+STAGES = [STAGE_GRAB, STAGE_RETRIEVE, STAGE_QUEUE_WAIT, STAGE_SCHEDULE, STAGE_FINGERPRINT, STAGE_DETECT, STAGE_PARSE,
+          STAGE_DB_INSERT, STAGE_STATS]
+
+
+def create_stage_timings_table(cursor: sqlite3.Cursor) -> None:
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {STAGE_TIMINGS_TABLE} (analysis_number INT, window_index INT, "
+                   f"stage TEXT, frame_width INT, frame_height INT, count INT, total_seconds FLOAT, p50 FLOAT, "
+                   f"p99 FLOAT, max FLOAT, histogram TEXT)")
+
+
+class StageProfiler:
+    """
+    Time spent per frame in each stage of the client pipeline (see `STAGES`), as one histogram per stage. Stages are
+    timed by the code running them with `time.perf_counter` and handed to `record`, from any thread. Profiling is off
+    when an analyzer has no profiler, the pipeline then only pays for an `is not None` check per stage.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.window: Dict[str, LogHistogram] = {stage: LogHistogram() for stage in STAGES}
+        self.frame_shape: Optional[Tuple[int, ...]] = None
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.window[stage].record(seconds)
+
+    def take_window(self) -> Dict[str, LogHistogram]:
+        """
+        :return: stage -> histogram of the time spent in it since the last call
+        """
+        with self._lock:
+            window, self.window = self.window, {stage: LogHistogram() for stage in STAGES}
+        return window
+
+    def window_rows(self, analysis_number: int, window_index: int) -> List[list]:
+        """
+        Takes the window as `stage_timings` rows, one per stage that saw a frame
+        """
+        height, width = self.frame_shape[:2] if self.frame_shape is not None else (None, None)
+        return [[analysis_number, window_index, stage, width, height, histogram.count, histogram.total,
+                 histogram.percentile(50), histogram.percentile(99), histogram.max, histogram.to_json()]
+                for stage, histogram in self.take_window().items() if histogram.count]
+
+
+def stage_report(database_name: str, analysis_numbers: Iterable[int] = None, image_size: int = None,
+                 fps: int = None) -> pd.DataFrame:
+    """
+    Where the time of a frame goes, per stage, merged over every window of the selected analyses. Analyses can be
+    picked by number or by the image size and FPS the server was started with (from `stream_params`, only recorded
+    for runs against a server that reports its params).
+    :return: DataFrame indexed by frame size and stage with frames, mean, p50, p99 and max in milliseconds, the share
+    of the time of all stages, and the mean as a fraction of the frame budget (1 / fps) when the fps is known
+    """
+    sql = f"SELECT t.analysis_number, t.stage, t.frame_width, t.frame_height, t.histogram, p.fps " \
+          f"FROM {STAGE_TIMINGS_TABLE} t LEFT JOIN stream_params p ON t.analysis_number = p.analysis_number " \
+          f"WHERE t.histogram IS NOT NULL"
+    params: List = []
+    if analysis_numbers is not None:
+        analysis_numbers = list(analysis_numbers)
+        sql += f" AND t.analysis_number IN ({','.join('?' * len(analysis_numbers))})"
+        params += analysis_numbers
+    if image_size is not None:
+        sql += " AND p.image_size = ?"
+        params.append(image_size)
+    if fps is not None:
+        sql += " AND p.fps = ?"
+        params.append(fps)
+    connection = sqlite3.connect(database_name)
+    data = pd.read_sql(sql, connection, params=params)
+    connection.close()
+    rows = []
+    for (width, height), size_data in data.groupby(["frame_width", "frame_height"], sort=True, dropna=False):
+        stream_fps = size_data["fps"].dropna().unique()
+        budget = 1 / stream_fps[0] if len(stream_fps) == 1 else None
+        merged: Dict[str, LogHistogram] = {}
+        for stage, serialized in zip(size_data["stage"], size_data["histogram"]):
+            merged.setdefault(stage, LogHistogram()).merge(LogHistogram.from_json(serialized))
+        total = sum(histogram.total for histogram in merged.values())
+        for stage in sorted(merged, key=lambda name: STAGES.index(name) if name in STAGES else len(STAGES)):
+            histogram = merged[stage]
+            rows.append({"frame_size": f"{width:.0f}x{height:.0f}" if pd.notna(width) else "unknown",
+                         "stage": stage, "frames": histogram.count, "mean_ms": histogram.mean() * 1000,
+                         "p50_ms": histogram.percentile(50) * 1000, "p99_ms": histogram.percentile(99) * 1000,
+                         "max_ms": histogram.max * 1000, "share": histogram.total / total if total else 0,
+                         "budget": histogram.mean() / budget if budget else None})
+    return pd.DataFrame(rows, columns=["frame_size", "stage", "frames", "mean_ms", "p50_ms", "p99_ms", "max_ms",
+                                       "share", "budget"]).set_index(["frame_size", "stage"])
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--database", default="stream_data.db", help="SQLite database the client recorded to")
+    parser.add_argument("-a", "--analysis-numbers", type=int, nargs="*",
+                        help="Analysis numbers to report on, all profiled analyses by default")
+    parser.add_argument("-is", "--image-size", type=int, help="Only analyses of streams with this IMAGE_SIZE")
+    parser.add_argument("-fps", "--fps", type=int, help="Only analyses of streams with this FPS")
+    parser.add_argument("-o", "--outfile", help="Write the report to this csv file instead of printing it")
+    return parser
+
+
+def main() -> None:
+    args = get_parser().parse_args()
+    report = stage_report(args.database, analysis_numbers=args.analysis_numbers, image_size=args.image_size,
+                          fps=args.fps)
+    if args.outfile:
+        report.to_csv(args.outfile)
+    else:
+        print(report.to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -36,10 +36,11 @@ class Subnet:
 
 def start_run_streaming_task(stack_name: str = "streaming", desired_az = "us-east-1a",
                              cpu: int = 512, memory: int = 1, fps: float = 25.0, image_size: int=0,
-                             video_type: str = "LIVE", identifier: str = "test") -> dict:
+                             video_type: str = "LIVE", identifier: str = "test", abr_sizes: str = None) -> dict:
     """
     Starts the task on the cluster for the task
     :param stack_name: str name of the stack
+    :param abr_sizes: comma separated image sizes, or ALL, to stream as one ABR ladder instead of only `image_size`
     """
     network_configuration = get_network_configuration(stack_name=stack_name, desired_az=desired_az)
     client = boto3.client("cloudformation")
@@ -55,7 +56,12 @@ def start_run_streaming_task(stack_name: str = "streaming", desired_az = "us-eas
     if task_definition_arn is None or cluster_name is None:
         raise AssertionError(f"No task definition or no cluster found for stack {stack_name}")
     ecs_client = boto3.client("ecs")
-    env_var_override = create_aws_dict({"CPU": cpu, "MEMORY": memory, "FPS":fps, "VIDEO_TYPE":video_type, "IMAGE_SIZE":image_size, "ID":identifier})
+    env_vars = {"CPU": cpu, "MEMORY": memory, "FPS":fps, "VIDEO_TYPE":video_type, "IMAGE_SIZE":image_size, "ID":identifier}
+    if abr_sizes:
+        env_vars["ABR_SIZES"] = abr_sizes
+    if video_type == "PRERECORDED":
+        env_vars["TIMING_MARKER"] = "STRIP"  # The frame library's QR codes only carry their position in the loop
+    env_var_override = create_aws_dict(env_vars)
     container_override = {"cpu": str(cpu), "memory": str(memory)+"GB", "containerOverrides": [{"name": "StreamingCluster", "environment": env_var_override}]}
     run_task_response = ecs_client.run_task(cluster=cluster_name, taskDefinition=task_definition_arn, launchType="FARGATE",
                         platformVersion="LATEST", networkConfiguration=network_configuration, overrides=container_override)
@@ -0,0 +1,192 @@
+import argparse
+import sqlite3
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+import pandas as pd
+
+STREAM_DATA_COLUMNS = ["frame_number", "frame_number_received", "time_generated", "time_received", "analysis_number"]
+STREAM_DATA_DTYPES: Dict[str, str] = {"frame_number": "int32", "frame_number_received": "int32",
+                                      "time_generated": "float64", "time_received": "float64",
+                                      "analysis_number": "int32"}
+# Running sums kept per analysis number while the chunks are read, turned into the summary at the end
+_SUM_COLUMNS = ["frames", "frames_missing", "duplicate_frames", "latency_sum", "latency_sq_sum", "interval_count",
+                "interval_sum", "interval_sq_sum", "jitter_sum"]
+_MIN_COLUMNS = ["first_frame", "latency_min", "first_time_received"]
+_MAX_COLUMNS = ["last_frame", "max_gap", "latency_max", "last_time_received"]
+
+
+def create_stream_data_index(cursor: sqlite3.Cursor, table_name: str = "stream_data") -> None:
+    """
+    Index used to read one analysis at a time in frame order without sorting the whole table
+    """
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {table_name}_analysis_frame ON {table_name} (analysis_number, frame_number)")
+
+
+def analyze_frames(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Adds the per frame metrics to frames of one analysis, sorted by frame number and indexed by the order they were
+    recorded in (see `read_analysis`). Everything is a whole column operation, no python code runs per row
+    """
+    data = data.astype(STREAM_DATA_DTYPES, copy=False)
+    first_frame_received = data['frame_number'].iloc[0]
+    data['frame_number_index_to_0'] = data['frame_number'] - first_frame_received
+    data['frames_dropped'] = data['frame_number_received'] - data.index
+    data['time_difference'] = data['time_received'] - data['time_generated']
+    data['difference_between_frame_times'] = data['time_received'].diff()
+    data['calculated_fps'] = 1 / data['difference_between_frame_times']
+    return data
+
+
+def correct_emit_lateness(data: pd.DataFrame, emit_log: str) -> pd.DataFrame:
+    """
+    Moves `time_generated` of every frame to when the server actually handed it to the encoder, so the latency no
+    longer includes the server emitting it late. Frames missing from the log are left as they are
+    :param emit_log: the server's emit_lateness.csv, a path or its url under /video/
+    """
+    lateness = pd.read_csv(emit_log, usecols=["frame_number", "lateness"]).drop_duplicates("frame_number", keep="last")
+    lateness = data["frame_number"].map(lateness.set_index("frame_number")["lateness"]).fillna(0.0)
+    data = data.copy()
+    data["time_generated"] = data["time_generated"] + lateness
+    return data
+
+
+def read_analysis(connection: sqlite3.Connection, analysis_number: int, table_name: str = "stream_data") -> pd.DataFrame:
+    """
+    :return: the frames of one analysis in frame number order, indexed by the order they were inserted in like a
+    `SELECT *` sorted afterwards would be, which is what `frames_dropped` counts against
+    """
+    sql = f"SELECT rowid, {', '.join(STREAM_DATA_COLUMNS)} FROM {table_name} WHERE analysis_number = ? " \
+          f"ORDER BY frame_number"
+    data = pd.read_sql(sql, connection, params=[analysis_number])
+    insertion_index = np.empty(len(data), dtype=np.int64)
+    insertion_index[np.argsort(data.pop("rowid").to_numpy(), kind="stable")] = np.arange(len(data))
+    data.index = insertion_index
+    return data
+
+
+def _chunk_partials(chunk: pd.DataFrame, previous: Optional[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Computes the running sums for one chunk. The last row of the previous chunk is put in front so the differences
+    across the chunk boundary are counted, it is not counted as a frame itself
+    """
+    carried = 0
+    if previous is not None:
+        chunk = pd.concat([previous, chunk], ignore_index=True)
+        carried = 1
+    analysis = chunk['analysis_number'].to_numpy()
+    frame_number = chunk['frame_number'].to_numpy(dtype=np.int64)
+    time_received = chunk['time_received'].to_numpy()
+    latency = time_received - chunk['time_generated'].to_numpy()
+
+    same_analysis = np.zeros(len(chunk), dtype=bool)
+    same_analysis[1:] = analysis[1:] == analysis[:-1]
+    frame_gap = np.zeros(len(chunk), dtype=np.int64)
+    frame_gap[1:] = np.diff(frame_number)
+    interval = np.zeros(len(chunk))
+    interval[1:] = np.diff(time_received)
+    jitter = np.zeros(len(chunk))
+    jitter[1:] = np.abs(np.diff(latency))
+    frame_gap[~same_analysis] = 0
+    interval[~same_analysis] = 0
+    jitter[~same_analysis] = 0
+
+    counted = np.ones(len(chunk), dtype=bool)
+    counted[:carried] = False
+    partial = pd.DataFrame({
+        "analysis_number": analysis,
+        "frames": counted.astype(np.int64),
+        "frames_missing": np.where(counted, np.maximum(frame_gap - 1, 0), 0),
+        "duplicate_frames": (counted & same_analysis & (frame_gap == 0)).astype(np.int64),
+        "latency_sum": np.where(counted, latency, 0),
+        "latency_sq_sum": np.where(counted, latency ** 2, 0),
+        "interval_count": (counted & same_analysis).astype(np.int64),
+        "interval_sum": np.where(counted, interval, 0),
+        "interval_sq_sum": np.where(counted, interval ** 2, 0),
+        "jitter_sum": np.where(counted, jitter, 0),
+        "first_frame": np.where(counted, frame_number, np.iinfo(np.int64).max),
+        "latency_min": np.where(counted, latency, np.inf),
+        "first_time_received": np.where(counted, time_received, np.inf),
+        "last_frame": np.where(counted, frame_number, np.iinfo(np.int64).min),
+        "max_gap": np.where(counted, frame_gap, 0),
+        "latency_max": np.where(counted, latency, -np.inf),
+        "last_time_received": np.where(counted, time_received, -np.inf),
+    })
+    grouped = partial.groupby("analysis_number", sort=False)
+    return pd.concat([grouped[_SUM_COLUMNS].sum(), grouped[_MIN_COLUMNS].min(), grouped[_MAX_COLUMNS].max()], axis=1)
+
+
+def _combine(totals: Optional[pd.DataFrame], partial: pd.DataFrame) -> pd.DataFrame:
+    if totals is None:
+        return partial
+    both = pd.concat([totals, partial])
+    grouped = both.groupby(level=0, sort=False)
+    return pd.concat([grouped[_SUM_COLUMNS].sum(), grouped[_MIN_COLUMNS].min(), grouped[_MAX_COLUMNS].max()], axis=1)
+
+
+def summarize_analyses(database_name: str, analysis_numbers: Iterable[int] = None, chunksize: int = 200_000,
+                       table_name: str = "stream_data") -> pd.DataFrame:
+    """
+    Summarizes one or many analyses in a single pass over `stream_data`, reading `chunksize` rows at a time in
+    (analysis_number, frame_number) order so memory stays flat no matter how long the runs were.
+    :return: DataFrame indexed by analysis_number with frame counts, frames missing (gaps in frame numbers), largest
+    gap, duplicate frames, latency mean/std/min/max, jitter (mean change in latency between frames), mean and std of
+    the time between frames and the average fps
+    """
+    sql = f"SELECT {', '.join(STREAM_DATA_COLUMNS)} FROM {table_name}"
+    params: List[int] = []
+    if analysis_numbers is not None:
+        params = list(analysis_numbers)
+        sql += f" WHERE analysis_number IN ({','.join('?' * len(params))})"
+    sql += " ORDER BY analysis_number, frame_number"
+    connection = sqlite3.connect(database_name)
+    totals = None
+    previous = None
+    for chunk in pd.read_sql(sql, connection, params=params, chunksize=chunksize):
+        chunk = chunk.astype(STREAM_DATA_DTYPES, copy=False)
+        totals = _combine(totals, _chunk_partials(chunk, previous))
+        previous = chunk.iloc[-1:]
+    connection.close()
+    if totals is None:
+        return pd.DataFrame(columns=["frames"])
+    summary = pd.DataFrame(index=totals.index)
+    summary["frames"] = totals["frames"]
+    summary["first_frame"] = totals["first_frame"]
+    summary["last_frame"] = totals["last_frame"]
+    summary["frames_missing"] = totals["frames_missing"]
+    summary["max_gap"] = totals["max_gap"]
+    summary["duplicate_frames"] = totals["duplicate_frames"]
+    summary["latency_mean"] = totals["latency_sum"] / totals["frames"]
+    summary["latency_std"] = np.sqrt(np.maximum(totals["latency_sq_sum"] / totals["frames"] - summary["latency_mean"] ** 2, 0))
+    summary["latency_min"] = totals["latency_min"]
+    summary["latency_max"] = totals["latency_max"]
+    intervals = totals["interval_count"].where(totals["interval_count"] > 0)
+    summary["jitter_mean"] = totals["jitter_sum"] / intervals
+    summary["interval_mean"] = totals["interval_sum"] / intervals
+    summary["interval_std"] = np.sqrt(np.maximum(totals["interval_sq_sum"] / intervals - summary["interval_mean"] ** 2, 0))
+    duration = totals["last_time_received"] - totals["first_time_received"]
+    summary["avg_fps"] = (totals["frames"] - 1) / duration.where(duration > 0)
+    summary.index.name = "analysis_number"
+    return summary.sort_index()
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--database", default="stream_data.db", help="SQLite database the client recorded to")
+    parser.add_argument("-a", "--analysis-numbers", type=int, nargs="*",
+                        help="Analysis numbers to summarize, all of them by default")
+    parser.add_argument("-c", "--chunksize", type=int, default=200_000, help="Rows to read from the database at once")
+    parser.add_argument("-o", "--outfile", help="Write the summary to this csv file instead of printing it")
+    return parser
+
+
+def main() -> None:
+    args = get_parser().parse_args()
+    summary = summarize_analyses(args.database, analysis_numbers=args.analysis_numbers, chunksize=args.chunksize)
+    if args.outfile:
+        summary.to_csv(args.outfile)
+    else:
+        print(summary.to_string())
+
+
+if __name__ == '__main__':
+    main()
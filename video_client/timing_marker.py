@@ -0,0 +1,73 @@
+from typing import NamedTuple, Optional
+import numpy as np
+
+# Layout of the timing strip, must match src/timing_marker.py on the streaming server
+MARKER_COLUMNS = 48
+MARKER_ROWS = 2
+SYNC_BITS = (1, 0, 1, 0)
+FRAME_NUMBER_BITS = 32
+TIME_BITS = 52  # microseconds since the epoch
+CHECKSUM_BITS = 8
+MIN_CONTRAST = 60
+
+_SYNC = np.array(SYNC_BITS, dtype=bool)
+_FRAME_NUMBER_SLICE = slice(len(SYNC_BITS), len(SYNC_BITS) + FRAME_NUMBER_BITS)
+_TIME_SLICE = slice(_FRAME_NUMBER_SLICE.stop, _FRAME_NUMBER_SLICE.stop + TIME_BITS)
+_CHECKSUM_SLICE = slice(_TIME_SLICE.stop, _TIME_SLICE.stop + CHECKSUM_BITS)
+_WEIGHTS = np.left_shift(np.uint64(1), np.arange(TIME_BITS, dtype=np.uint64))
+
+
+class MarkerReading(NamedTuple):
+    frame_number: int
+    time: float
+    confidence: float
+
+
+def crc8(data: bytes) -> int:
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+def _bits_value(bits: np.ndarray) -> int:
+    return int(np.dot(bits.astype(np.uint64), _WEIGHTS[:len(bits)]))
+
+
+def read_marker(frame: np.ndarray) -> Optional[MarkerReading]:
+    """
+    Reads the timing strip the server stamps at the top of each frame. Only the middle half of every block is averaged,
+    so the ringing that compression leaves at block edges does not matter, and the threshold is taken from the sync
+    blocks so it follows the brightness of the stream.
+    :return: MarkerReading, or None if there is no strip or the checksum does not match. The confidence is how far the
+    least certain block is from the threshold, as a fraction of half the contrast (1.0 is a perfectly clean strip)
+    """
+    width = frame.shape[1]
+    block = width // MARKER_COLUMNS
+    if block < 4 or frame.shape[0] < block * MARKER_ROWS:
+        return None
+    x0 = (width - block * MARKER_COLUMNS) // 2
+    strip = frame[:MARKER_ROWS * block, x0:x0 + MARKER_COLUMNS * block]
+    if strip.ndim == 2:
+        strip = strip[..., None]
+    quarter = block // 4
+    blocks = strip.reshape(MARKER_ROWS, block, MARKER_COLUMNS, block, strip.shape[2])
+    levels = blocks[:, quarter:block - quarter, :, quarter:block - quarter].mean(axis=(1, 3, 4)).ravel()
+    sync_levels = levels[:len(SYNC_BITS)]
+    dark, light = sync_levels[_SYNC].mean(), sync_levels[~_SYNC].mean()
+    contrast = light - dark
+    if contrast < MIN_CONTRAST:
+        return None
+    threshold = (light + dark) / 2
+    bits = levels < threshold
+    if not np.array_equal(bits[:len(SYNC_BITS)], _SYNC):
+        return None
+    frame_number = _bits_value(bits[_FRAME_NUMBER_SLICE])
+    time_micros = _bits_value(bits[_TIME_SLICE])
+    checksum = _bits_value(bits[_CHECKSUM_SLICE])
+    if checksum != crc8(frame_number.to_bytes(4, "big") + time_micros.to_bytes(7, "big")):
+        return None
+    confidence = float(min(np.abs(levels - threshold).min() / (contrast / 2), 1.0))
+    return MarkerReading(frame_number, time_micros / 1_000_000, confidence)
@@ -0,0 +1,136 @@
+import argparse
+import sqlite3
+from typing import Iterable, List, NamedTuple
+import numpy as np
+import pandas as pd
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+PTS_CLOCK = 90000
+FRAME_TIMESTAMPS_TABLE = "frame_timestamps"
+# Bytes of a PES header up to and including the PTS
+_PES_HEADER_BYTES = 14
+
+
+class SegmentTimestamps(NamedTuple):
+    """
+    Presentation timestamps in seconds of every video frame in a segment, in the order the decoder outputs the frames,
+    and whether each frame is a keyframe (random access point)
+    """
+    pts: np.ndarray
+    keyframes: np.ndarray
+
+
+def read_ts_timestamps(data: bytes) -> SegmentTimestamps:
+    """
+    Reads the PTS of every video frame of an MPEG-TS segment from its packet and PES headers, without decoding any
+    video. All packets are looked at as one (packets, 188) array, no python code runs per packet or frame.
+    Keyframes are the PES packets whose TS packet has the random access indicator set, which ffmpeg sets on keyframes.
+    :return: empty arrays if `data` is not MPEG-TS or has no video
+    """
+    start = data.find(bytes([TS_SYNC_BYTE]))
+    packet_count = (len(data) - max(start, 0)) // TS_PACKET_SIZE
+    if start < 0 or packet_count == 0:
+        return SegmentTimestamps(np.empty(0), np.empty(0, dtype=bool))
+    packets = np.frombuffer(data, dtype=np.uint8, count=packet_count * TS_PACKET_SIZE, offset=start) \
+        .reshape(packet_count, TS_PACKET_SIZE)
+    packets = packets[packets[:, 0] == TS_SYNC_BYTE]
+    payload_unit_start = (packets[:, 1] & 0x40) != 0
+    pid = (packets[:, 1].astype(np.int32) & 0x1F) << 8 | packets[:, 2]
+    has_adaptation = (packets[:, 3] & 0x20) != 0
+    has_payload = (packets[:, 3] & 0x10) != 0
+    adaptation_length = np.where(has_adaptation, packets[:, 4], 0).astype(np.int32)
+    random_access = has_adaptation & (adaptation_length > 0) & ((packets[:, 5] & 0x40) != 0)
+    payload_start = 4 + np.where(has_adaptation, adaptation_length + 1, 0)
+
+    rows = np.flatnonzero(payload_unit_start & has_payload & (payload_start + _PES_HEADER_BYTES <= TS_PACKET_SIZE))
+    header = packets[rows[:, None], payload_start[rows, None] + np.arange(_PES_HEADER_BYTES)].astype(np.int64)
+    # Video PES: start code 00 00 01, stream id 0xE0-0xEF, and a PTS
+    video = (header[:, 0] == 0) & (header[:, 1] == 0) & (header[:, 2] == 1) & ((header[:, 3] & 0xF0) == 0xE0) & \
+            ((header[:, 7] & 0x80) != 0)
+    if not video.any():
+        return SegmentTimestamps(np.empty(0), np.empty(0, dtype=bool))
+    video &= pid[rows] == pid[rows[video][0]]
+    header = header[video]
+    pts = (header[:, 9] >> 1 & 0x07) << 30 | header[:, 10] << 22 | (header[:, 11] >> 1) << 15 | \
+        header[:, 12] << 7 | header[:, 13] >> 1
+    # The PTS is 33 bits and wraps around about every 26 hours
+    pts += np.concatenate(([0], np.cumsum(np.diff(pts) < -(1 << 32)))) << 33
+    order = np.argsort(pts, kind="stable")
+    return SegmentTimestamps(pts[order] / PTS_CLOCK, random_access[rows[video]][order])
+
+
+def create_frame_timestamps_table(cursor: sqlite3.Cursor) -> None:
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {FRAME_TIMESTAMPS_TABLE} (analysis_number INT, "
+                   f"frame_number_received INT, time_received FLOAT, pts FLOAT, keyframe INT, sampled INT)")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {FRAME_TIMESTAMPS_TABLE}_analysis_frame ON {FRAME_TIMESTAMPS_TABLE} "
+                   f"(analysis_number, frame_number_received)")
+
+
+def frame_gaps(pts: np.ndarray) -> np.ndarray:
+    """
+    :return: for every frame after the first, how many frames are missing between it and the previous one, measured
+    against the median time between frames
+    """
+    deltas = np.diff(pts)
+    positive = deltas[deltas > 0]
+    if positive.size == 0:
+        return np.zeros(deltas.size, dtype=np.int64)
+    frame_duration = np.median(positive)
+    return np.maximum(np.rint(deltas / frame_duration).astype(np.int64) - 1, 0)
+
+
+def summarize_timestamps(database_name: str, analysis_numbers: Iterable[int] = None) -> pd.DataFrame:
+    """
+    FPS and drop summary of analyses recorded with frame sampling, from the container timestamps of every frame
+    (`frame_timestamps`) instead of the QR codes. Latency comes from the sampled frames in `stream_data`, see
+    `stream_analysis.summarize_analyses`.
+    :return: DataFrame indexed by analysis_number with frames, frames sampled for QR decoding, keyframes, fps from the
+    timestamps, fps of arrival, frames missing and largest gap (both in frames)
+    """
+    sql = f"SELECT analysis_number, time_received, pts, keyframe, sampled FROM {FRAME_TIMESTAMPS_TABLE}"
+    params: List[int] = []
+    if analysis_numbers is not None:
+        params = list(analysis_numbers)
+        sql += f" WHERE analysis_number IN ({','.join('?' * len(params))})"
+    sql += " ORDER BY analysis_number, frame_number_received"
+    connection = sqlite3.connect(database_name)
+    data = pd.read_sql(sql, connection, params=params)
+    connection.close()
+    rows = []
+    for analysis_number, frames in data.groupby("analysis_number", sort=True):
+        pts = frames["pts"].to_numpy()
+        time_received = frames["time_received"].to_numpy()
+        gaps = frame_gaps(pts)
+        pts_duration = pts[-1] - pts[0]
+        arrival_duration = time_received[-1] - time_received[0]
+        rows.append({"analysis_number": analysis_number, "frames": len(frames),
+                     "frames_sampled": int(frames["sampled"].sum()),
+                     "keyframes": int((frames["keyframe"] == 1).sum()),
+                     "pts_fps": (len(frames) - 1) / pts_duration if pts_duration > 0 else np.nan,
+                     "arrival_fps": (len(frames) - 1) / arrival_duration if arrival_duration > 0 else np.nan,
+                     "frames_missing": int(gaps.sum()), "max_gap": int(gaps.max(initial=0))})
+    return pd.DataFrame(rows, columns=["analysis_number", "frames", "frames_sampled", "keyframes", "pts_fps",
+                                       "arrival_fps", "frames_missing", "max_gap"]).set_index("analysis_number")
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--database", default="stream_data.db", help="SQLite database the client recorded to")
+    parser.add_argument("-a", "--analysis-numbers", type=int, nargs="*",
+                        help="Analysis numbers to summarize, all of them by default")
+    parser.add_argument("-o", "--outfile", help="Write the summary to this csv file instead of printing it")
+    return parser
+
+
+def main() -> None:
+    args = get_parser().parse_args()
+    summary = summarize_timestamps(args.database, analysis_numbers=args.analysis_numbers)
+    if args.outfile:
+        summary.to_csv(args.outfile)
+    else:
+        print(summary.to_string())
+
+
+if __name__ == '__main__':
+    main()